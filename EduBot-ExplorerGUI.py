@@ -8,17 +8,1198 @@ Created on Sunday October 19 15:46:55 2025
 
 # -*- coding: utf-8 -*-
 
-import sys, random, math, socket, json, threading
+import sys, random, math, socket, json, struct, threading, time, heapq, array, argparse
+from collections import deque, OrderedDict
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QPushButton, QLabel, QVBoxLayout, QHBoxLayout,
-    QTextEdit, QProgressBar, QGraphicsView, QGraphicsScene, QGraphicsEllipseItem, QFrame,
-    QGraphicsRectItem, QGraphicsLineItem, QGroupBox, QCheckBox, QLineEdit, QMessageBox,
-    QGridLayout
+    QPlainTextEdit, QComboBox, QFileDialog, QProgressBar, QGraphicsView, QGraphicsScene, QGraphicsEllipseItem, QFrame,
+    QGraphicsPathItem, QGroupBox, QCheckBox, QLineEdit, QMessageBox,
+    QGridLayout, QGraphicsItem
 )
-from PyQt5.QtCore import Qt, QTimer, QPointF
-from PyQt5.QtGui import QBrush, QColor, QPen, QFont
+from PyQt5.QtCore import Qt, QTimer, QPointF, QRectF, QObject, pyqtSignal
+from PyQt5.QtGui import (
+    QBrush, QColor, QPen, QFont, QTextCursor, QPainterPath, QImage, QPixmap, QPainter, QTransform, qRgba
+)
+
+try:
+    import numpy as np
+except ImportError:  # no path planning or occupancy mapping
+    np = None
+
+# Same framing as RobotServer.py: 4-byte big-endian length + payload, where the
+# payload is UTF-8 JSON or, once negotiated, a compact binary message
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024
+
+# Binary layouts, must match RobotServer.py, negotiated under this name
+BINARY_ENCODING = 'binary2'
+BINARY_SENSOR_DATA = 1
+BINARY_COMMAND_RESPONSE = 2
+BINARY_SENSOR_HEADER = struct.Struct('!Bd')
+BINARY_RESPONSE_HEADER = struct.Struct('!BBBBdH')
+BINARY_SENSOR_RECORD = struct.Struct('!dfffBBB')
+BINARY_RANGE_ENTRY = struct.Struct('!fffBB')
+BINARY_QUEUE_INFO = struct.Struct('!Bf')
+RESPONSE_HAS_SENSOR = 1
+RESPONSE_HAS_QUEUE = 2
+BINARY_COMMANDS = ('move', 'stop', 'get_sensors', 'start_autonomous', 'stop_autonomous',
+                   'smart_stop', 'emergency_stop', 'drive')
+BINARY_STATUSES = ('success', 'error')
+BINARY_SENSOR_STATUSES = ('active', 'error')
+
+# Commands sent over the UDP teleop channel when the robot offers one
+TELEOP_COMMANDS = ('move', 'drive')
+# TCP commands that stop motion, they tell the robot our newest teleop
+# sequence number so a datagram still in flight can't restart the motors
+STOP_COMMANDS = ('stop', 'emergency_stop', 'smart_stop', 'stop_autonomous')
+
+# Command log entries, severities in increasing order
+LOG_SEVERITIES = ('debug', 'info', 'warning', 'error')
+LOG_CATEGORIES = ('command', 'connection', 'autonomous', 'status', 'map', 'general')
+
+def encode_message(message):
+    payload = json.dumps(message).encode('utf-8')
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def decode_sensor_record(payload, offset):
+    timestamp, distance, raw_distance, temperature, battery, status, confidence = \
+        BINARY_SENSOR_RECORD.unpack_from(payload, offset)
+    
+    # Per-sensor readings of the ranging array follow the record
+    sensors = []
+    offset += BINARY_SENSOR_RECORD.size
+    count = payload[offset] if offset < len(payload) else 0
+    offset += 1
+    for _ in range(count):
+        angle, sensor_distance, sensor_raw, sensor_confidence, name_length = \
+            BINARY_RANGE_ENTRY.unpack_from(payload, offset)
+        offset += BINARY_RANGE_ENTRY.size
+        sensors.append({
+            'name': payload[offset:offset + name_length].decode('utf-8'),
+            'angle': angle,
+            'distance': round(sensor_distance, 2),
+            'raw_distance': round(sensor_raw, 2),
+            'confidence': sensor_confidence / 100
+        })
+        offset += name_length
+    
+    return {
+        'distance': round(distance, 2),
+        'raw_distance': round(raw_distance, 2),
+        'confidence': confidence / 100,
+        'sensors': sensors,
+        'temperature': round(temperature, 2),
+        'battery': battery,
+        'timestamp': timestamp,
+        'status': BINARY_SENSOR_STATUSES[status]
+    }
+
+def decode_payload(payload):
+    """Decode a JSON or binary payload into the same message dict"""
+    if payload[:1] == b'{':
+        return json.loads(payload.decode('utf-8'))
+    
+    kind = payload[0]
+    if kind == BINARY_SENSOR_DATA:
+        _, timestamp = BINARY_SENSOR_HEADER.unpack_from(payload)
+        return {
+            'type': 'sensor_data',
+            'data': decode_sensor_record(payload, BINARY_SENSOR_HEADER.size),
+            'timestamp': timestamp
+        }
+    if kind == BINARY_COMMAND_RESPONSE:
+        _, command, status, flags, timestamp, text_length = BINARY_RESPONSE_HEADER.unpack_from(payload)
+        offset = BINARY_RESPONSE_HEADER.size
+        message = {
+            'type': 'command_response',
+            'command': BINARY_COMMANDS[command],
+            'status': BINARY_STATUSES[status],
+            'timestamp': timestamp,
+            'message': payload[offset:offset + text_length].decode('utf-8')
+        }
+        offset += text_length
+        if flags & RESPONSE_HAS_QUEUE:
+            message['queue_depth'], message['queue_time'] = BINARY_QUEUE_INFO.unpack_from(payload, offset)
+            offset += BINARY_QUEUE_INFO.size
+        if flags & RESPONSE_HAS_SENSOR:
+            message['sensor_data'] = decode_sensor_record(payload, offset)
+        return message
+    raise ValueError(f"Unknown binary message kind {kind}")
+
+class MessageDecoder:
+    """Incremental decoder that pulls complete frames out of a TCP stream"""
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        
+    def feed(self, data):
+        self.buffer.extend(data)
+        payloads = []
+        offset = 0
+        header_size = FRAME_HEADER.size
+        
+        while len(self.buffer) - offset >= header_size:
+            (length,) = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_frame_size:
+                raise ValueError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+            end = offset + header_size + length
+            if len(self.buffer) < end:
+                break
+            payloads.append(bytes(self.buffer[offset + header_size:end]))
+            offset = end
+        
+        if offset:
+            del self.buffer[:offset]
+        return payloads
+
+class ClockSync:
+    """Offset between the robot's monotonic clock and ours, estimated NTP style
+    
+    Each 'test' exchange gives t0 (sent, our clock), t1 and t2 (received and
+    answered, robot clock) and t3 (answer received, our clock). The sample
+    with the shortest round trip bounds the offset error best, so the
+    estimate comes from that one among the recent samples.
+    """
+    WINDOW = 8
+    
+    def __init__(self):
+        self.samples = deque(maxlen=self.WINDOW)  # (round trip, offset)
+    
+    def add(self, t0, t1, t2, t3):
+        rtt = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self.samples.append((rtt, offset))
+    
+    def best(self):
+        return min(self.samples) if self.samples else None
+    
+    def to_local(self, robot_time):
+        """Robot timestamp on our monotonic clock, None until synchronized"""
+        sample = self.best()
+        if sample is None or not isinstance(robot_time, (int, float)):
+            return None
+        return robot_time - sample[1]
+
+class CommandLog(QObject):
+    """Bounded command log shown in a plain text view
+    
+    Entries are kept in a fixed-size ring buffer and reach the view in
+    batches from a timer, so a long session (autonomous mode logs every
+    100 ms tick) costs constant memory and one append per flush. The view
+    only shows entries passing the severity and category filters, and
+    changing a filter redraws it from the buffer.
+    """
+    CAPACITY = 2000
+    FLUSH_INTERVAL = 200  # ms
+    
+    def __init__(self, view, capacity=CAPACITY):
+        super().__init__(view)
+        self.view = view
+        self.view.setMaximumBlockCount(capacity)
+        self.entries = deque(maxlen=capacity)    # (wall time, severity, category, text)
+        self.unflushed = deque(maxlen=capacity)  # shown entries not yet in the view
+        self.min_severity = 'info'  # debug lines (autonomous ticks) are kept but hidden
+        self.category = None  # None shows every category
+        
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start(self.FLUSH_INTERVAL)
+    
+    def append(self, text, severity='info', category='general'):
+        entry = (time.time(), severity, category, text)
+        self.entries.append(entry)
+        if self.shown(entry):
+            self.unflushed.append(entry)
+    
+    def shown(self, entry):
+        _, severity, category, _ = entry
+        return (LOG_SEVERITIES.index(severity) >= LOG_SEVERITIES.index(self.min_severity)
+                and self.category in (None, category))
+    
+    @staticmethod
+    def format(entry):
+        _, severity, _, text = entry
+        return text if severity in ('debug', 'info') else f"{severity.upper()}: {text}"
+    
+    def flush(self):
+        if not self.unflushed:
+            return
+        self.view.appendPlainText("\n".join(self.format(entry) for entry in self.unflushed))
+        self.unflushed.clear()
+    
+    def set_filter(self, min_severity=None, category=None):
+        """Show entries at min_severity or above, of one category or all (None)"""
+        self.min_severity = min_severity or 'debug'
+        self.category = category
+        self.unflushed.clear()
+        self.view.setPlainText("\n".join(self.format(entry) for entry in self.entries if self.shown(entry)))
+        self.view.moveCursor(QTextCursor.End)
+    
+    def export(self, path):
+        """Write every buffered entry, filtered or not, as tab separated lines"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for timestamp, severity, category, text in self.entries:
+                stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+                f.write(f"{stamp}.{int(timestamp % 1 * 1000):03d}\t{severity}\t{category}\t{text}\n")
+        return len(self.entries)
+
+class ObstacleGrid:
+    """Uniform grid index over the map's obstacle rectangles
+    
+    Each obstacle is listed in every cell it overlaps, so a query only tests
+    the obstacles in the few cells around it and a movement step costs the
+    same however many obstacles the map has. Swept checks treat the robot
+    as a square of side 2 * radius, a little conservative at corners.
+    """
+    def __init__(self, rects, cell_size=15):
+        self.cell_size = cell_size
+        self.rects = list(rects)  # (x, y, w, h)
+        self.cells = {}  # (col, row) -> indices into rects
+        for index, (x, y, w, h) in enumerate(self.rects):
+            for col in range(int(x // cell_size), int((x + w) // cell_size) + 1):
+                for row in range(int(y // cell_size), int((y + h) // cell_size) + 1):
+                    self.cells.setdefault((col, row), []).append(index)
+    
+    def near(self, x0, y0, x1, y1):
+        """Indices of the obstacles listed in the cells covering a box"""
+        size = self.cell_size
+        found = set()
+        for col in range(int(x0 // size), int(x1 // size) + 1):
+            for row in range(int(y0 // size), int(y1 // size) + 1):
+                found.update(self.cells.get((col, row), ()))
+        return found
+    
+    def collides(self, x, y, radius=0.0):
+        """Whether a circle overlaps any obstacle"""
+        for index in self.near(x - radius, y - radius, x + radius, y + radius):
+            rx, ry, w, h = self.rects[index]
+            dx = x - max(rx, min(x, rx + w))
+            dy = y - max(ry, min(y, ry + h))
+            if dx * dx + dy * dy < radius * radius or (dx == 0 and dy == 0):
+                return True
+        return False
+    
+    def segment_clear(self, x0, y0, x1, y1, radius=0.0):
+        """Line of sight: whether a robot of radius can travel the segment unobstructed
+        
+        Walks the cells the segment crosses (Amanatides and Woo) and tests
+        the obstacles within radius of each one.
+        """
+        size = self.cell_size
+        dx, dy = x1 - x0, y1 - y0
+        col, row = int(x0 // size), int(y0 // size)
+        step_col, step_row = (1 if dx > 0 else -1), (1 if dy > 0 else -1)
+        # Segment parameter t (0..1) at the next column / row boundary
+        t_col = ((col + (dx > 0)) * size - x0) / dx if dx else math.inf
+        t_row = ((row + (dy > 0)) * size - y0) / dy if dy else math.inf
+        delta_col = abs(size / dx) if dx else math.inf
+        delta_row = abs(size / dy) if dy else math.inf
+        margin = int(math.ceil(radius / size))
+        
+        tested = set()
+        while True:
+            for c in range(col - margin, col + margin + 1):
+                for r in range(row - margin, row + margin + 1):
+                    for index in self.cells.get((c, r), ()):
+                        if index not in tested:
+                            tested.add(index)
+                            if self.segment_hits(self.rects[index], x0, y0, dx, dy, radius):
+                                return False
+            if min(t_col, t_row) > 1:
+                return True
+            if t_col < t_row:
+                col += step_col
+                t_col += delta_col
+            else:
+                row += step_row
+                t_row += delta_row
+    
+    @staticmethod
+    def depth(rect, x, y):
+        """Signed distance from a point to a rect, negative inside"""
+        rx, ry, w, h = rect
+        if rx < x < rx + w and ry < y < ry + h:
+            return -min(x - rx, rx + w - x, y - ry, ry + h - y)
+        return math.hypot(x - max(rx, min(x, rx + w)), y - max(ry, min(y, ry + h)))
+    
+    @classmethod
+    def segment_hits(cls, rect, x0, y0, dx, dy, radius):
+        """Slab test of the segment against the rect grown by radius
+        
+        Touching doesn't count. A segment starting inside the grown rect
+        (a robot placed overlapping an obstacle's margin) only passes if it
+        heads straight out: the distance to a rect is convex along a line,
+        so one that grows at the start keeps growing and never comes back in.
+        """
+        x, y, w, h = rect
+        low_x, low_y, high_x, high_y = x - radius, y - radius, x + w + radius, y + h + radius
+        if low_x < x0 < high_x and low_y < y0 < high_y:
+            step = 1e-6
+            return cls.depth(rect, x0 + dx * step, y0 + dy * step) <= cls.depth(rect, x0, y0)
+        t0, t1 = 0.0, 1.0
+        for start, delta, low, high in ((x0, dx, low_x, high_x), (y0, dy, low_y, high_y)):
+            if delta == 0:
+                if not low < start < high:
+                    return False
+                continue
+            ta, tb = sorted(((low - start) / delta, (high - start) / delta))
+            t0, t1 = max(t0, ta), min(t1, tb)
+            if t0 >= t1:
+                return False
+        return True
+
+class GridPlanner:
+    """D* Lite path planner on a grid of map cells
+    
+    Costs are a NumPy array with one cell per cell_size map pixels: 1 where
+    the robot can be centred, inf where it would touch an obstacle, with a
+    blocked border so neighbours never need bounds checks. Moves go to the
+    8 neighbours, diagonals only when neither corner cell is blocked. The
+    search runs from the goal back to the robot, so when the robot moves on
+    or obstacles change, only the part of the previous search they affect
+    is repaired (Koenig and Likhachev's D* Lite) instead of planning afresh.
+    """
+    def __init__(self, width, height, cell_size=15, radius=7):
+        self.cell_size = cell_size
+        self.radius = radius
+        self.cols = int(math.ceil(width / cell_size))
+        self.rows = int(math.ceil(height / cell_size))
+        self.stride = self.cols + 2  # cells are indexed row-major in the bordered grid
+        self.cost = self.rasterize([])
+        self.flat_cost = self.flatten(self.cost)
+        self.fresh_expansions = 0  # cells the last search from scratch closed
+        self.goal = None
+        
+        # (index offset, length, offsets of the two corner cells of a diagonal)
+        stride, diagonal = self.stride, math.sqrt(2)
+        self.neighbours = ((-stride, 1.0, 0, 0), (stride, 1.0, 0, 0), (-1, 1.0, 0, 0), (1, 1.0, 0, 0),
+                           (-stride - 1, diagonal, -stride, -1), (-stride + 1, diagonal, -stride, 1),
+                           (stride - 1, diagonal, stride, -1), (stride + 1, diagonal, stride, 1))
+    
+    def rasterize(self, rects):
+        """Cost array with the cells whose centre is within radius of an obstacle blocked"""
+        cost = np.full((self.rows + 2, self.cols + 2), np.inf)
+        cost[1:-1, 1:-1] = 1.0
+        size = self.cell_size
+        for x, y, w, h in rects:
+            col0 = max(int(math.ceil((x - self.radius) / size - 0.5)), 0)
+            col1 = min(int(math.floor((x + w + self.radius) / size - 0.5)), self.cols - 1)
+            row0 = max(int(math.ceil((y - self.radius) / size - 0.5)), 0)
+            row1 = min(int(math.floor((y + h + self.radius) / size - 0.5)), self.rows - 1)
+            if col0 <= col1 and row0 <= row1:
+                cost[row0 + 1:row1 + 2, col0 + 1:col1 + 2] = np.inf
+        return cost
+    
+    def set_obstacles(self, rects):
+        """Replace the obstacles, repairing the current search around changed cells"""
+        self.set_cost(self.rasterize(rects))
+    
+    def set_cost(self, cost):
+        """Replace the bordered cost array, repairing the current search around changed cells"""
+        changed = cost != self.cost
+        self.cost = cost
+        self.flat_cost = self.flatten(cost)
+        if self.goal is None or not changed.any():
+            return
+        
+        # Edge costs changed around the changed cells, but a cell's rhs can
+        # only change if the search reached it or one of its neighbours
+        searched = (np.isfinite(np.frombuffer(self.g)) | np.isfinite(np.frombuffer(self.rhs))).reshape(cost.shape)
+        affected = self.dilate(changed) & self.dilate(searched)
+        affected[[0, -1], :] = affected[:, [0, -1]] = False  # the border never changes
+        affected = np.flatnonzero(affected).tolist()
+        if len(affected) > np.count_nonzero(searched) // 2:
+            self.goal = None  # most of the search is invalid, the next plan starts over
+            return
+        
+        self.km += self.heuristic(self.last, self.start)
+        self.last = self.start
+        for index in affected:
+            if index != self.goal:
+                self.rhs[index] = self.lookahead(index)
+            self.update(index)
+    
+    @staticmethod
+    def flatten(cost):
+        """Costs as a flat array of doubles, the hot loops read plain floats from it"""
+        flat = array.array('d')
+        flat.frombytes(np.ascontiguousarray(cost, dtype=np.float64).tobytes())
+        return flat
+    
+    @staticmethod
+    def dilate(mask):
+        """Mask grown by one cell in all 8 directions"""
+        padded = np.pad(mask, 1)
+        rows, cols = mask.shape
+        grown = np.zeros_like(mask)
+        for dr in range(3):
+            for dc in range(3):
+                grown |= padded[dr:dr + rows, dc:dc + cols]
+        return grown
+    
+    def plan(self, start, goal):
+        """Map points from start to goal, without start, or None if unreachable"""
+        self.search(start, goal)
+        return self.extract()
+    
+    def search(self, start, goal):
+        """Bring the search up to date for map points start and goal"""
+        start, goal = self.free_cell(*start), self.free_cell(*goal)
+        if goal != self.goal:
+            self.reset(start, goal)  # settles the start, nothing left to repair
+        else:
+            if start != self.start:
+                # Keys already queued stay lower bounds under the new start
+                self.km += self.heuristic(self.last, start)
+                self.last = self.start = start
+            self.compute()
+    
+    def cell(self, x, y):
+        col = min(max(int(x // self.cell_size), 0), self.cols - 1)
+        row = min(max(int(y // self.cell_size), 0), self.rows - 1)
+        return (row + 1) * self.stride + col + 1
+    
+    def point(self, index):
+        row, col = divmod(index, self.stride)
+        return ((col - 0.5) * self.cell_size, (row - 0.5) * self.cell_size)
+    
+    def free_cell(self, x, y):
+        """Cell of a point, or its nearest free neighbour when it is blocked"""
+        index = self.cell(x, y)
+        if self.flat_cost[index] != math.inf:
+            return index
+        free = [index + offset for offset, _, _, _ in self.neighbours
+                if self.flat_cost[index + offset] != math.inf]
+        if not free:
+            return index
+        return min(free, key=lambda neighbour: math.dist(self.point(neighbour), (x, y)))
+    
+    def heuristic(self, a, b):
+        # Octile distance, exact on an empty grid
+        row_a, col_a = divmod(a, self.stride)
+        row_b, col_b = divmod(b, self.stride)
+        dx, dy = abs(col_a - col_b), abs(row_a - row_b)
+        return dx + dy + (math.sqrt(2) - 2) * min(dx, dy)
+    
+    def edges(self, index):
+        """(neighbour, cost) pairs of passable moves, symmetric so these are predecessors too"""
+        cost = self.flat_cost
+        here = cost[index]
+        result = []
+        for offset, length, corner_a, corner_b in self.neighbours:
+            step = length * (here + cost[index + offset]) / 2
+            if step == math.inf or (corner_a and (cost[index + corner_a] == math.inf
+                                                  or cost[index + corner_b] == math.inf)):
+                continue  # blocked, or cutting a corner
+            result.append((index + offset, step))
+        return result
+    
+    def reset(self, start, goal):
+        # Flat arrays of doubles, unlike lists of a million floats the
+        # garbage collector doesn't walk them on every full collection
+        count = len(self.flat_cost)
+        self.g = array.array('d', [math.inf]) * count
+        self.rhs = array.array('d', [math.inf]) * count
+        self.queue = []   # heap of (key1, key2, cell), stale entries skipped
+        self.queued = {}  # cell -> its current key
+        self.km = 0.0
+        self.start = self.last = start
+        self.goal = goal
+        self.rhs[goal] = 0.0
+        self.initial_search()
+    
+    def initial_search(self):
+        """Plain A* from the goal to seed the incremental search
+        
+        D* Lite's own ordering breaks ties toward cells near the goal, which
+        on open ground expands every one of the many equally short routes.
+        This search prefers the cell nearest the robot instead and stops once
+        it has closed it and relaxed its neighbours. What it leaves is a
+        valid D* Lite state: closed cells consistent and open cells holding
+        their best rhs over all closed neighbours, queued for compute().
+        """
+        g, rhs, start = self.g, self.rhs, self.start
+        self.fresh_expansions = 0
+        frontier = [(self.heuristic(start, self.goal), -0.0, self.goal)]  # (f, -rhs, cell)
+        while frontier:
+            _, best, index = heapq.heappop(frontier)
+            if g[index] != math.inf or -best != rhs[index]:
+                continue  # closed already, or a stale entry
+            g[index] = rhs[index]
+            self.fresh_expansions += 1
+            for neighbour, step in self.edges(index):
+                if g[neighbour] == math.inf and step + g[index] < rhs[neighbour]:
+                    rhs[neighbour] = step + g[index]
+                    estimate = round(rhs[neighbour] + self.heuristic(start, neighbour), 9)
+                    heapq.heappush(frontier, (estimate, -rhs[neighbour], neighbour))
+            if index == start:
+                break
+        
+        for index in {index for _, _, index in frontier}:
+            self.update(index)
+    
+    def key(self, index):
+        # Rounded so that routes summed in a different order tie exactly and
+        # the second component decides, as D* Lite's correctness needs
+        best = min(self.g[index], self.rhs[index])
+        return (round(best + self.heuristic(self.start, index) + self.km, 9), best)
+    
+    def update(self, index):
+        if self.g[index] != self.rhs[index]:
+            key = self.key(index)
+            self.queued[index] = key
+            heapq.heappush(self.queue, (key[0], key[1], index))
+        else:
+            self.queued.pop(index, None)
+    
+    def lookahead(self, index):
+        return min((step + self.g[neighbour] for neighbour, step in self.edges(index)), default=math.inf)
+    
+    def compute(self):
+        g, rhs, queue, queued = self.g, self.rhs, self.queue, self.queued
+        start, goal = self.start, self.goal
+        # A repair costing more than planning afresh did is abandoned for that
+        budget = max(self.fresh_expansions, 1000)
+        while queue:
+            k1, k2, index = queue[0]
+            if queued.get(index) != (k1, k2):
+                heapq.heappop(queue)
+                continue
+            if (k1, k2) >= self.key(start) and rhs[start] <= g[start]:
+                break
+            heapq.heappop(queue)
+            key = self.key(index)
+            if (k1, k2) < key:
+                queued[index] = key
+                heapq.heappush(queue, (key[0], key[1], index))
+                continue
+            del queued[index]
+            
+            budget -= 1
+            if budget < 0:
+                self.reset(start, goal)
+                return
+            if g[index] > rhs[index]:
+                g[index] = rhs[index]
+                for neighbour, step in self.edges(index):
+                    if neighbour != goal and step + g[index] < rhs[neighbour]:
+                        rhs[neighbour] = step + g[index]
+                        self.update(neighbour)
+            else:
+                old = g[index]
+                g[index] = math.inf
+                for neighbour, step in self.edges(index) + [(index, 0.0)]:
+                    if neighbour != goal and (neighbour == index or rhs[neighbour] == step + old):
+                        rhs[neighbour] = self.lookahead(neighbour)
+                    self.update(neighbour)
+    
+    def extract(self):
+        """Map points of the searched route, or None if the goal is unreachable"""
+        cells = self.route()
+        return None if cells is None else self.waypoints([self.start] + cells)
+    
+    def route(self):
+        """Greedy walk down g from the start: the cells after it, or None if the goal is unreachable"""
+        index = self.start
+        if self.rhs[index] == math.inf:
+            return None
+        cells = []
+        for _ in range(len(self.flat_cost)):
+            if index == self.goal:
+                return cells
+            index = min(self.edges(index), key=lambda edge: edge[1] + self.g[edge[0]])[0]
+            cells.append(index)
+        return None
+    
+    def waypoints(self, route):
+        """Map points of the cells where a route of neighbouring cells turns, and its last, without its first"""
+        points = [self.point(index) for previous, index, following in zip(route, route[1:], route[2:])
+                  if index - previous != following - index]
+        return points + [self.point(route[-1])] if len(route) > 1 else points
+
+class HierarchicalPlanner:
+    """Bounded-time routes on grids too large to search cell by cell
+    
+    Up to COARSE_SIDE cells a side this is just a GridPlanner. Beyond that a
+    GridPlanner routes over a coarse grid of factor x factor blocks of
+    cells, each costing more the more of it is blocked and impassable only
+    when all of it is. A plain A* over the fine cells then follows the first
+    few blocks of that route, in a corridor one block either side of it, so
+    neither search ever touches more than a few thousand cells. The path
+    returned ends where that corridor does, short of the goal, and the
+    caller plans again from there. A block the fine search can't get into
+    from the route is blocked on the coarse grid and the route planned
+    again; those marks last until the obstacles change.
+    """
+    COARSE_SIDE = 64      # coarse grid cells per side, also the largest grid searched directly
+    LOCAL_CELLS = 4096    # fine cells a corridor may cover
+    BLOCKED_PENALTY = 3.0  # extra cost of a fully blocked block that is still passable
+    RETRIES = 3           # route repairs per plan before settling for a partial path
+    
+    def __init__(self, width, height, cell_size=15, radius=7):
+        self.fine = GridPlanner(width, height, cell_size, radius)
+        self.factor = max(1, int(math.ceil(max(self.fine.cols, self.fine.rows) / self.COARSE_SIDE)))
+        self.coarse = None
+        if self.factor > 1:
+            size = cell_size * self.factor
+            self.coarse = GridPlanner(int(math.ceil(self.fine.cols / self.factor)) * size,
+                                      int(math.ceil(self.fine.rows / self.factor)) * size, size, radius)
+            # Blocks a corridor fits in, counting the blocks either side
+            self.horizon = max(1, self.LOCAL_CELLS // (3 * self.factor * self.factor) - 1)
+            self.set_obstacles([])
+    
+    def set_obstacles(self, rects):
+        if self.coarse is None:
+            self.fine.set_obstacles(rects)
+            return
+        self.fine.set_obstacles(rects)
+        self.coarse_cost = self.block_costs()
+        self.coarse.set_cost(self.coarse_cost.copy())
+        self.repaired = False  # whether coarse_cost has blocks marked by plan()
+    
+    def block_costs(self):
+        """Coarse cost array from the fine one, cells outside the arena count as blocked"""
+        factor, coarse = self.factor, self.coarse
+        blocked = np.ones((coarse.rows * factor, coarse.cols * factor))
+        blocked[:self.fine.rows, :self.fine.cols] = np.isinf(self.fine.cost[1:-1, 1:-1])
+        share = blocked.reshape(coarse.rows, factor, coarse.cols, factor).mean(axis=(1, 3))
+        cost = np.full((coarse.rows + 2, coarse.cols + 2), np.inf)
+        cost[1:-1, 1:-1] = np.where(share < 1.0, 1.0 + self.BLOCKED_PENALTY * share, np.inf)
+        return cost
+    
+    def plan(self, start, goal):
+        """Map points from start toward goal, without start, or None if unreachable
+        
+        The points end at the goal, or for a long route where the corridor
+        searched ends.
+        """
+        if self.coarse is None:
+            return self.fine.plan(start, goal)
+        fine = self.fine
+        start_cell, goal_cell = fine.free_cell(*start), fine.free_cell(*goal)
+        best = None
+        for _ in range(self.RETRIES + 1):
+            self.coarse.search(fine.point(start_cell), fine.point(goal_cell))
+            blocks = self.coarse.route()
+            if blocks is None and self.repaired:
+                # Maybe only our marks cut the goal off, start again from the obstacles
+                self.repaired = False
+                self.coarse_cost = self.block_costs()
+                self.coarse.set_cost(self.coarse_cost.copy())
+                continue
+            if blocks is None:
+                return None
+            blocks = [self.coarse.start] + blocks
+            if len(blocks) - 1 <= self.horizon:
+                # The goal is in reach, even when it is in a block next to the route
+                target, corridor_blocks = {goal_cell}, blocks + [self.block(goal_cell)]
+            else:
+                target, corridor_blocks = blocks[self.horizon], blocks[:self.horizon + 1]
+            cells, reached, found = self.corridor_search(start_cell, target, self.corridor(corridor_blocks))
+            if found:
+                return fine.waypoints([start_cell] + cells)
+            if cells and (best is None or len(cells) > len(best)):
+                best = cells
+            if reached is None:
+                break  # out of budget, what was reached says nothing
+            # Block the first block of the route the search couldn't enter
+            missed = next((block for block in corridor_blocks[1:] if block not in reached), None)
+            if missed is None or missed in (self.coarse.start, self.coarse.goal):
+                break
+            self.coarse_cost[divmod(missed, self.coarse.stride)] = np.inf
+            self.coarse.set_cost(self.coarse_cost.copy())
+            self.repaired = True
+        return fine.waypoints([start_cell] + best) if best else None
+    
+    def block(self, index):
+        """Coarse cell of a fine cell"""
+        row, col = divmod(index, self.fine.stride)
+        return ((row - 1) // self.factor + 1) * self.coarse.stride + (col - 1) // self.factor + 1
+    
+    def corridor(self, blocks):
+        """Coarse cells of a route and their 8 neighbours"""
+        stride = self.coarse.stride
+        return {block + row * stride + col for block in blocks for row in (-1, 0, 1) for col in (-1, 0, 1)}
+    
+    def corridor_search(self, start, target, corridor):
+        """A* over the fine cells of the corridor to target, a fine cell set or a coarse cell
+        
+        Returns (cells after start, coarse cells entered, whether the
+        target was reached). Otherwise the cells lead to where the search got
+        closest to it, and the coarse cells are None if the search ran out of
+        budget before exhausting the corridor.
+        """
+        fine, stride, factor = self.fine, self.fine.stride, self.factor
+        if isinstance(target, set):
+            goal = next(iter(target))
+            heuristic = lambda index: fine.heuristic(index, goal)
+            arrived = target.__contains__
+        else:
+            # Octile distance to the nearest fine cell of the target block
+            block_row, block_col = divmod(target, self.coarse.stride)
+            row0, col0 = (block_row - 1) * factor + 1, (block_col - 1) * factor + 1
+            def heuristic(index):
+                row, col = divmod(index, stride)
+                dx = max(col0 - col, 0, col - (col0 + factor - 1))
+                dy = max(row0 - row, 0, row - (row0 + factor - 1))
+                return dx + dy + (math.sqrt(2) - 2) * min(dx, dy)
+            arrived = lambda index: self.block(index) == target
+        
+        came_from = {start: None}
+        cost = {start: 0.0}
+        frontier = [(heuristic(start), 0.0, start)]
+        closest, closest_distance = start, heuristic(start)
+        reached = set()
+        budget = 2 * self.LOCAL_CELLS
+        found = None
+        while frontier and budget:
+            _, so_far, index = heapq.heappop(frontier)
+            if so_far != cost[index]:
+                continue  # stale entry
+            budget -= 1
+            reached.add(self.block(index))
+            if arrived(index):
+                found = index
+                break
+            distance = heuristic(index)
+            if distance < closest_distance:
+                closest, closest_distance = index, distance
+            for neighbour, step in fine.edges(index):
+                if self.block(neighbour) not in corridor:
+                    continue
+                if so_far + step < cost.get(neighbour, math.inf):
+                    cost[neighbour] = so_far + step
+                    came_from[neighbour] = index
+                    heapq.heappush(frontier, (so_far + step + heuristic(neighbour), so_far + step, neighbour))
+        
+        end = found if found is not None else closest
+        cells = []
+        while end != start:
+            cells.append(end)
+            end = came_from[end]
+        cells.reverse()
+        if found is None and frontier:
+            reached = None
+        return cells, reached, found is not None
+
+class PlannerWorker(QObject):
+    """Runs a GridPlanner or HierarchicalPlanner on its own thread, the latest request wins
+    
+    Results come back through path_ready as (goal, points), delivered on the
+    GUI thread like MessageBridge's.
+    """
+    path_ready = pyqtSignal(object)
+    
+    def __init__(self, planner):
+        super().__init__()
+        self.planner = planner
+        self.condition = threading.Condition()
+        self.request = None    # (start, goal) map points
+        self.obstacles = None  # new obstacle rects
+        
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def plan(self, start, goal):
+        with self.condition:
+            self.request = (start, goal)
+            self.condition.notify()
+    
+    def set_obstacles(self, rects):
+        with self.condition:
+            self.obstacles = list(rects)
+            self.condition.notify()
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while self.request is None and self.obstacles is None:
+                    self.condition.wait()
+                request, obstacles = self.request, self.obstacles
+                self.request = self.obstacles = None
+            
+            if obstacles is not None:
+                self.planner.set_obstacles(obstacles)
+            if request is not None:
+                start, goal = request
+                self.path_ready.emit((goal, self.planner.plan(start, goal)))
+
+class OccupancyMap(QGraphicsItem):
+    """Log-odds occupancy grid built up from range readings, drawn as one image
+    
+    Each reading lowers the log odds of the cells its beam crossed and
+    raises them where it ended. The grid is a NumPy array behind an 8-bit
+    indexed QImage, and after a reading only the rectangle of cells it
+    touched is re-coloured and repainted, so the cost of a reading depends
+    on its beam, not on how much of the map has been seen.
+    """
+    CELL_SIZE = 2      # map px per cell, unless given
+    MAX_RANGE = 400    # cm, like DistanceFilter.MAX_RANGE, a reading this long saw no echo
+    BEAM_WIDTH = 15.0  # degrees, the ultrasonic cone
+    BEAM_RAYS = 5
+    HIT = 0.85         # log odds added where a beam ended
+    MISS = -0.4        # log odds added along a beam
+    LIMIT = 5.0        # clamp, so cells can still change their mind
+    UNKNOWN = 128      # colour index of log odds 0
+    
+    def __init__(self, width, height, cell_size=None, cm_per_pixel=1.0):
+        super().__init__()
+        self.width, self.height = width, height
+        self.cell_size = cell_size or self.CELL_SIZE
+        self.cm_per_pixel = cm_per_pixel
+        self.cols = int(math.ceil(width / self.cell_size))
+        self.rows = int(math.ceil(height / self.cell_size))
+        self.log_odds = np.zeros((self.rows, self.cols), np.float32)
+        
+        self.image = QImage(self.cols, self.rows, QImage.Format_Indexed8)
+        self.image.setColorTable(self.colour_table())
+        self.image.fill(self.UNKNOWN)
+        # Writable view of the image's own pixels, rows are padded to 4 bytes
+        bits = self.image.bits()
+        bits.setsize(self.image.byteCount())
+        self.pixels = np.frombuffer(bits, np.uint8).reshape(self.rows, -1)[:, :self.cols]
+        
+        self.setZValue(-2)  # under the static layer's grid lines and obstacles, and everything else
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+    
+    @classmethod
+    def colour_table(cls):
+        """Index 0 is surely free, 255 surely occupied, the middle transparent"""
+        table = []
+        for index in range(256):
+            occupied = index / 255
+            grey = int(255 * (1 - occupied))
+            table.append(qRgba(grey, grey, grey, int(min(abs(occupied - 0.5) * 2, 1) * 180)))
+        return table
+    
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+    
+    def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect
+        size = self.cell_size
+        painter.drawImage(exposed, self.image, QRectF(exposed.x() / size, exposed.y() / size,
+                                                      exposed.width() / size, exposed.height() / size))
+    
+    def integrate(self, x, y, heading, readings):
+        """Fold in (angle, distance cm, confidence) readings taken at map pose (x, y, heading)
+        
+        Headings and angles are degrees, 0 up the map and clockwise positive
+        like the robot's.
+        """
+        free, hit = [], []
+        spread = np.linspace(-self.BEAM_WIDTH / 2, self.BEAM_WIDTH / 2, self.BEAM_RAYS)
+        for angle, distance, confidence in readings:
+            reach = min(distance, self.MAX_RANGE) / self.cm_per_pixel
+            angles = np.radians(heading + angle + spread)[:, None]
+            along = np.arange(0, reach, self.cell_size / 2)
+            free.append((self.cells(x + np.sin(angles) * along, y - np.cos(angles) * along), confidence))
+            if distance < self.MAX_RANGE:
+                hit.append((self.cells(x + np.sin(angles) * reach, y - np.cos(angles) * reach), confidence))
+        
+        flat = self.log_odds.ravel()
+        ends = np.concatenate([cells for cells, _ in hit]) if hit else np.empty(0, int)
+        touched = []
+        for cells, confidence in free:
+            cells = np.setdiff1d(cells, ends)  # the cells a beam ended in only get the hit
+            flat[cells] += self.MISS * confidence
+            touched.append(cells)
+        for cells, confidence in hit:
+            flat[cells] += self.HIT * confidence
+            touched.append(cells)
+        touched = np.concatenate(touched) if touched else np.empty(0, int)
+        if not len(touched):
+            return
+        flat[touched] = np.clip(flat[touched], -self.LIMIT, self.LIMIT)
+        
+        rows, cols = np.divmod(touched, self.cols)
+        self.recolour(rows.min(), rows.max() + 1, cols.min(), cols.max() + 1)
+    
+    def cells(self, xs, ys):
+        """Unique flat indices of the cells under map points inside the grid"""
+        cols = np.floor(xs.ravel() / self.cell_size).astype(int)
+        rows = np.floor(ys.ravel() / self.cell_size).astype(int)
+        inside = (cols >= 0) & (cols < self.cols) & (rows >= 0) & (rows < self.rows)
+        return np.unique(rows[inside] * self.cols + cols[inside])
+    
+    def recolour(self, row0, row1, col0, col1):
+        """Refresh the image over a block of cells and repaint just that part"""
+        block = self.log_odds[row0:row1, col0:col1]
+        self.pixels[row0:row1, col0:col1] = np.rint((block + self.LIMIT) * (255 / (2 * self.LIMIT)))
+        size = self.cell_size
+        self.update(QRectF(col0 * size, row0 * size, (col1 - col0) * size, (row1 - row0) * size))
+    
+    def clear(self):
+        self.log_odds[:] = 0
+        self.pixels[:] = self.UNKNOWN
+        self.update()
+
+class StaticMapLayer(QGraphicsItem):
+    """Grid, border and obstacles drawn as cached pixmap tiles
+    
+    Tiles are rendered on first use at the power-of-two zoom level nearest
+    the view's scale and kept in a bounded LRU cache, so a repaint only
+    blits pixmaps and costs the same whatever the size of the arena.
+    Zoomed out, grid lines closer than MIN_GRID_SPACING screen px are
+    left out.
+    """
+    TILE_SIZE = 256         # device px per tile side
+    MAX_TILES = 256
+    MIN_GRID_SPACING = 6.0  # device px
+    LEVELS = (-8, 3)        # zoom levels 2**-8 .. 2**3
+    
+    def __init__(self, width, height, obstacles, grid_spacing=15):
+        super().__init__()
+        self.width, self.height = width, height
+        self.obstacles = obstacles  # ObstacleGrid
+        self.grid_spacing = grid_spacing
+        self.tiles = OrderedDict()  # (level, col, row) -> QPixmap
+        self.setZValue(-1)  # over the occupancy map, its tiles are transparent between lines and obstacles
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+    
+    def boundingRect(self):
+        return QRectF(-1, -1, self.width + 2, self.height + 2)  # the border pen reaches outside
+    
+    def paint(self, painter, option, widget=None):
+        scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        level = max(self.LEVELS[0], min(round(math.log2(scale)), self.LEVELS[1]))
+        span = self.TILE_SIZE / 2 ** level  # scene units per tile
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, scale != 2 ** level)
+        for row in range(int(exposed.top() // span), int(exposed.bottom() // span) + 1):
+            for col in range(int(exposed.left() // span), int(exposed.right() // span) + 1):
+                painter.drawPixmap(QRectF(col * span, row * span, span, span), self.tile(level, col, row),
+                                   QRectF(0, 0, self.TILE_SIZE, self.TILE_SIZE))
+    
+    def tile(self, level, col, row):
+        key = (level, col, row)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        pixmap = self.render(level, col, row)
+        self.tiles[key] = pixmap
+        if len(self.tiles) > self.MAX_TILES:
+            self.tiles.popitem(last=False)
+        return pixmap
+    
+    def render(self, level, col, row):
+        zoom = 2 ** level
+        span = self.TILE_SIZE / zoom
+        x0, y0 = col * span, row * span
+        x1, y1 = min(x0 + span, self.width), min(y0 + span, self.height)
+        pixmap = QPixmap(self.TILE_SIZE, self.TILE_SIZE)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setTransform(QTransform(zoom, 0, 0, zoom, -x0 * zoom, -y0 * zoom))
+        
+        spacing = self.grid_spacing
+        if spacing * zoom >= self.MIN_GRID_SPACING:
+            painter.setPen(QPen(QColor("#E0E0E0"), 0.5))
+            for x in range(int(math.ceil(max(x0, 0) / spacing)) * spacing, int(x1), spacing):
+                painter.drawLine(QPointF(x, max(y0, 0)), QPointF(x, y1))
+            for y in range(int(math.ceil(max(y0, 0) / spacing)) * spacing, int(y1), spacing):
+                painter.drawLine(QPointF(max(x0, 0), y), QPointF(x1, y))
+        
+        rects = self.obstacles.rects
+        # A zoomed out tile covers more index cells than there are obstacles
+        cells = (span / self.obstacles.cell_size + 1) ** 2
+        indices = range(len(rects)) if cells > len(rects) else self.obstacles.near(x0, y0, x0 + span, y0 + span)
+        painter.setBrush(QBrush(QColor("#9E9E9E")))
+        painter.setPen(QPen(Qt.black, 1))
+        for index in indices:
+            painter.drawRect(QRectF(*rects[index]))
+        
+        # At least a device px wide, so the arena edge stays visible zoomed out
+        painter.setBrush(Qt.NoBrush)
+        painter.setPen(QPen(Qt.black, max(2, 1 / zoom)))
+        painter.drawRect(QRectF(0, 0, self.width, self.height))
+        painter.end()
+        return pixmap
+
+class MapView(QGraphicsView):
+    """Map view zoomed with the wheel and panned by dragging
+    
+    A press and release without a drag in between is a click, reported in
+    scene coordinates through clicked.
+    """
+    clicked = pyqtSignal(QPointF)
+    ZOOM_STEP = 1.25  # per wheel notch
+    MAX_ZOOM = 8.0
+    
+    def __init__(self, scene):
+        super().__init__(scene)
+        self.setDragMode(QGraphicsView.ScrollHandDrag)
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.press_pos = None
+    
+    def min_zoom(self):
+        """Zoom at which the whole arena fits, never above 1"""
+        rect, viewport = self.sceneRect(), self.viewport().rect()
+        return min(1.0, viewport.width() / rect.width(), viewport.height() / rect.height())
+    
+    def wheelEvent(self, event):
+        zoom = self.transform().m11()
+        target = zoom * self.ZOOM_STEP ** (event.angleDelta().y() / 120)
+        target = max(self.min_zoom(), min(target, self.MAX_ZOOM))
+        self.scale(target / zoom, target / zoom)
+        event.accept()
+    
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.press_pos = event.pos()
+        super().mousePressEvent(event)
+    
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        if (event.button() == Qt.LeftButton and self.press_pos is not None and
+                (event.pos() - self.press_pos).manhattanLength() < QApplication.startDragDistance()):
+            self.clicked.emit(self.mapToScene(event.pos()))
+        self.press_pos = None
+
+class RobotTrail:
+    """Trail of the robot on the map, drawn as a single path item
+    
+    Points that add no visible detail are merged into the trail's end: while
+    the last segment is shorter than MIN_DISTANCE, or the heading changes by
+    less than MIN_TURN, a new point moves the end instead of adding a
+    vertex. Past max_points the oldest vertices are dropped, so the item's
+    size follows the shape of the trail rather than how long the run was.
+    """
+    MIN_DISTANCE = 2.0  # map px
+    MIN_TURN = 5.0      # degrees
+    
+    def __init__(self, scene, max_points=2000):
+        self.max_points = max_points
+        self.points = []  # [x, y, starts a new subpath]
+        self.path = QPainterPath()
+        self.item = QGraphicsPathItem()
+        self.item.setPen(QPen(QColor("#2196F3"), 1.5))
+        scene.addItem(self.item)
+    
+    def add_step(self, x0, y0, x1, y1):
+        """Extend the trail by a step, starting a new piece if it doesn't begin at the end"""
+        if not self.points or self.points[-1][:2] != [x0, y0]:
+            self.add(x0, y0, connect=False)
+        self.add(x1, y1)
+    
+    def add(self, x, y, connect=True):
+        points = self.points
+        if connect and points and points[-1][:2] == [x, y]:
+            return  # no movement, against a wall
+        if not connect or not points:
+            points.append([x, y, True])
+            self.path.moveTo(x, y)
+        elif not points[-1][2] and self.redundant(points[-2], points[-1], x, y):
+            points[-1][:2] = [x, y]
+            self.path.setElementPositionAt(self.path.elementCount() - 1, x, y)
+        else:
+            points.append([x, y, False])
+            self.path.lineTo(x, y)
+        
+        # Trim in chunks, a rebuild per dropped point would cost as much as the old items
+        if len(points) > self.max_points + self.max_points // 4:
+            del points[:len(points) - self.max_points]
+            points[0][2] = True
+            self.rebuild()
+        self.item.setPath(self.path)
+    
+    def redundant(self, prev, last, x, y):
+        """Whether the end vertex last can move to (x, y) without losing detail"""
+        if math.hypot(last[0] - prev[0], last[1] - prev[1]) < self.MIN_DISTANCE:
+            return True
+        heading = math.atan2(last[1] - prev[1], last[0] - prev[0])
+        step = math.atan2(y - last[1], x - last[0])
+        turn = abs((math.degrees(step - heading) + 180) % 360 - 180)
+        return turn < self.MIN_TURN
+    
+    def rebuild(self):
+        self.path = QPainterPath()
+        for x, y, starts in self.points:
+            if starts:
+                self.path.moveTo(x, y)
+            else:
+                self.path.lineTo(x, y)
+    
+    def clear(self):
+        self.points.clear()
+        self.path = QPainterPath()
+        self.item.setPath(self.path)
+
+class MessageBridge(QObject):
+    """Hands messages from the receive thread over to the GUI thread
+    
+    Widgets may only be touched from the GUI thread, so the receive thread
+    posts messages here and a queued signal wakes the GUI thread to deliver
+    them. Delivery happens at most once per display frame, and messages that
+    only carry state (sensor readings, plain position updates) are merged so
+    just the latest of each is rendered however fast they arrive.
+    """
+    FRAME_INTERVAL = 16  # ms, one frame at 60 Hz
+    
+    wake = pyqtSignal()
+    
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler  # called on the GUI thread with each message
+        self.lock = threading.Lock()
+        self.pending = []  # messages delivered in order
+        self.latest = {}   # merge key -> latest state message
+        self.scheduled = False
+        
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.FRAME_INTERVAL)
+        self.timer.timeout.connect(self.deliver)
+        self.wake.connect(self.timer.start, Qt.QueuedConnection)
+    
+    @staticmethod
+    def merge_key(message):
+        """Key under which newer messages replace older ones, None to keep every one"""
+        kind = message.get('type')
+        if kind == 'sensor_data':
+            return kind
+        if kind == 'autonomous_update':
+            data = message.get('data', {})
+            if not data.get('obstacle_detected') and data.get('state') != 'reached':
+                return kind
+        return None
+    
+    def post(self, message):
+        """Queue a message for the GUI thread, callable from any thread"""
+        key = self.merge_key(message)
+        with self.lock:
+            if key is None:
+                # Keep order, state merged so far is older than this message
+                self.pending.extend(self.latest.values())
+                self.latest.clear()
+                self.pending.append(message)
+            else:
+                self.latest[key] = message
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.wake.emit()
+    
+    def deliver(self):
+        with self.lock:
+            messages = self.pending + list(self.latest.values())
+            self.pending = []
+            self.latest = {}
+            self.scheduled = False
+        for message in messages:
+            self.handler(message)
 
 class RobotConnection:
+    # Backpressure: with this many commands unanswered, or this much motion
+    # already queued on the robot, moves are held back and only the latest
+    # one is sent once the robot catches up. A command unanswered for
+    # RESPONSE_TIMEOUT seconds no longer counts, its response may have been
+    # lost and must not hold moves back until the next reconnect
+    MAX_IN_FLIGHT = 3
+    MAX_QUEUE_TIME = 1.0
+    RESPONSE_TIMEOUT = 2.0
+    
     def __init__(self, parent):
         self.parent = parent
         self.socket = None
@@ -26,75 +1207,204 @@ class RobotConnection:
         self.host = "192.168.1.100"
         self.port = 5000
         self.receive_thread = None
+        self.decoder = MessageDecoder()
+        self.encoding = 'json'
+        self.udp_socket = None
+        self.udp_address = None
+        self.udp_token = None
+        self.udp_seq = 0
+        self.clock = ClockSync()
+        self.bridge = MessageBridge(parent.handle_robot_message)
+        self.send_lock = threading.Lock()
+        self.in_flight = deque()  # our clock, when each unanswered command was sent
+        self.queue_until = 0.0  # our clock, when the robot's queued motion runs out
+        self.held_command = None
         
     def connect_to_robot(self, host, port):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.settimeout(5)
             self.socket.connect((host, port))
+            self.decoder = MessageDecoder()
+            self.encoding = 'json'
+            self.close_udp()
+            self.clock = ClockSync()
+            self.in_flight.clear()
+            self.queue_until = 0.0
+            self.held_command = None
             self.connected = True
             self.host = host
             self.port = port
             
+            # Connection test, also asks for compact binary telemetry and
+            # takes the first clock sample
+            self.send_ping()
+            
             self.receive_thread = threading.Thread(target=self.receive_data)
             self.receive_thread.daemon = True
             self.receive_thread.start()
             
             return True
         except Exception as e:
-            self.parent.log.append(f"Connection error: {str(e)}")
+            self.parent.log.append(f"Connection error: {str(e)}", 'error', 'connection')
             return False
     
+    def notify(self, text, severity='info'):
+        """Log line for the GUI, safe to call from the receive thread"""
+        self.bridge.post({'type': 'log', 'text': text, 'severity': severity})
+    
+    def send_ping(self):
+        """'test' message carrying our clock, answered with the robot's"""
+        message = {'type': 'test', 'encodings': [BINARY_ENCODING, 'json'], 't0': time.monotonic()}
+        with self.send_lock:
+            self.socket.sendall(encode_message(message))
+    
+    def throttled(self):
+        now = time.monotonic()
+        while self.in_flight and now - self.in_flight[0] > self.RESPONSE_TIMEOUT:
+            self.in_flight.popleft()
+        return len(self.in_flight) >= self.MAX_IN_FLIGHT or self.queue_until - now >= self.MAX_QUEUE_TIME
+    
     def send_command(self, command, data=None):
         if not self.connected or not self.socket:
-            self.parent.log.append("Not connected to robot")
+            self.notify("Not connected to robot", 'warning')
             return False
             
         try:
+            if command in TELEOP_COMMANDS and self.udp_socket:
+                # Latest-wins datagram, the robot drops any that arrive out of order
+                self.udp_seq += 1
+                datagram = {
+                    'token': self.udp_token,
+                    'seq': self.udp_seq,
+                    'command': command,
+                    'data': data or {}
+                }
+                self.udp_socket.sendto(json.dumps(datagram).encode('utf-8'), self.udp_address)
+                return True
+            
             message = {
                 'type': 'command',
                 'command': command,
                 'data': data or {}
             }
-            self.socket.send(json.dumps(message).encode())
+            if command in STOP_COMMANDS and self.udp_socket:
+                message['data'] = dict(message['data'], udp_seq=self.udp_seq)
+            with self.send_lock:
+                if command in TELEOP_COMMANDS and self.throttled():
+                    # Replaces any move already held, the robot only needs the latest
+                    self.held_command = (command, data)
+                    return True
+                if command not in TELEOP_COMMANDS:
+                    self.held_command = None  # stop and friends override a held move
+                self.socket.sendall(encode_message(message))
+                self.in_flight.append(time.monotonic())
             return True
         except Exception as e:
-            self.parent.log.append(f"Send error: {str(e)}")
+            self.notify(f"Send error: {str(e)}", 'error')
             self.connected = False
             return False
     
     def receive_data(self):
         while self.connected:
             try:
-                data = self.socket.recv(1024).decode()
-                if data:
-                    message = json.loads(data)
+                data = self.socket.recv(4096)
+                if not data:
+                    break
+                for payload in self.decoder.feed(data):
+                    try:
+                        message = decode_payload(payload)
+                    except (ValueError, IndexError, struct.error):
+                        continue
                     self.handle_received_message(message)
+            except socket.timeout:
+                continue
             except:
                 break
     
     def handle_received_message(self, message):
-        if message.get('type') == 'sensor_data':
-            self.parent.update_real_sensors(message.get('data', {}))
-        elif message.get('type') == 'autonomous_update':
-            self.parent.handle_autonomous_update(message.get('data', {}))
+        """Bookkeeping on the receive thread, anything for the widgets goes through the bridge"""
+        if self.held_command:
+            self.flush_held()
+        if message.get('type') == 'test_response':
+            received = time.monotonic()
+            first = not self.clock.samples
+            if all(key in message for key in ('t0', 't1', 't2')):
+                self.clock.add(message['t0'], message['t1'], message['t2'], received)
+            if not first:
+                return  # periodic resync
+            
+            self.encoding = message.get('encoding', 'json')
+            self.notify(f"Connection test successful ({self.encoding} telemetry)")
+            sample = self.clock.best()
+            if sample:
+                self.notify(f"Round trip {sample[0] * 1000:.1f} ms")
+            if message.get('udp_port') and message.get('udp_token'):
+                self.open_udp(message['udp_port'], message['udp_token'])
+        else:
+            if message.get('type') == 'command_response':
+                self.command_answered(message)
+            self.bridge.post(message)
+    
+    def command_answered(self, message):
+        """Track the robot's backlog from a command response"""
+        with self.send_lock:
+            if self.in_flight:
+                self.in_flight.popleft()
+            if 'queue_time' in message:
+                self.queue_until = time.monotonic() + message['queue_time']
+        self.flush_held()
+    
+    def flush_held(self):
+        """Send the held move once the robot has room for it"""
+        with self.send_lock:
+            held = self.held_command
+            if held is None or self.throttled():
+                return
+            self.held_command = None
+        self.send_command(*held)
+
+    def open_udp(self, port, token):
+        self.close_udp()
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_address = (self.host, port)
+        self.udp_token = token
+        self.udp_seq = 0
+        self.notify(f"UDP teleop channel on port {port}")
+    
+    def close_udp(self):
+        if self.udp_socket:
+            self.udp_socket.close()
+        self.udp_socket = None
+        self.udp_token = None
 
 class EduBotExplorer(QWidget):
-    def __init__(self):
+    TRAIL_LENGTH = 2000  # vertices kept in the map trail
+    ROBOT_RADIUS = 7     # map px, like SimulatedWorld.ROBOT_RADIUS on the robot
+    AVOID_ANGLES = (30, 60, 90, 120, 150)  # degrees off the target heading tried when blocked
+    GRID_SPACING = 15    # map px between grid lines, also the planner's cell size
+    MAX_MAP_CELLS = 2048  # occupancy map cells per side, coarser cells on larger arenas
+    MIN_ARENA_SIZE = 150  # map px, room for the start position and the first obstacles
+    
+    def __init__(self, arena_width=350, arena_height=200):
         super().__init__()
+        if min(arena_width, arena_height) < self.MIN_ARENA_SIZE:
+            raise ValueError(f"Arena must be at least {self.MIN_ARENA_SIZE} px on each side")
         self.setWindowTitle("EduBot Explorer - Real Robot Control")
         
         self.setGeometry(50, 50, 900, 650)
         
-        self.robot_x, self.robot_y = 100, 100
-        self.start_x, self.start_y = 100, 100
-        self.robot_trail = []
-        self.trail_lines = []
-        self.obstacles = []
+        self.arena_width, self.arena_height = arena_width, arena_height  # map px, 1 px per cm
+        # (100, 100), or the middle of an arena too small for that to be well inside
+        self.start_x = min(100, arena_width // 2)
+        self.start_y = min(100, arena_height // 2)
+        self.robot_x, self.robot_y = self.start_x, self.start_y
         self.autonomous_mode = False
         self.target_x, self.target_y = None, None
         self.target_item = None
         self.target_selection_mode = False
+        self.avoid_side = 1  # side autonomous_move last steered around an obstacle
+        self.robot_heading = 0.0  # degrees, 0 up the map and clockwise positive like the robot's
         self.autonomous_timer = QTimer()
         
         self.robot_connection = RobotConnection(self)
@@ -103,6 +1413,26 @@ class EduBotExplorer(QWidget):
         self.setup_connections()
         self.setup_timer()
         self.draw_map()
+        self.trail = RobotTrail(self.scene, self.TRAIL_LENGTH)
+        
+        # Route planning for autonomous mode needs NumPy, without it the
+        # robot only steers around obstacles
+        self.plan_path = None  # waypoints to the target, None until planned
+        self.plan_partial = False  # plan_path stops short of the target, more to ask for
+        self.planner = None
+        if np is not None:
+            self.planner = PlannerWorker(HierarchicalPlanner(self.arena_width, self.arena_height,
+                                                             self.GRID_SPACING, self.ROBOT_RADIUS))
+            self.planner.path_ready.connect(self.path_planned)
+            self.planner.set_obstacles(self.obstacle_index.rects)
+        
+        # Occupancy map from the robot's range readings, also NumPy only
+        self.occupancy = None
+        if np is not None:
+            cell_size = max(OccupancyMap.CELL_SIZE,
+                            math.ceil(max(self.arena_width, self.arena_height) / self.MAX_MAP_CELLS))
+            self.occupancy = OccupancyMap(self.arena_width, self.arena_height, cell_size)
+            self.scene.addItem(self.occupancy)
 
     def setup_ui(self):
         self.controls = {
@@ -222,13 +1552,12 @@ class EduBotExplorer(QWidget):
         self.battery_bar.setMaximumHeight(18)
         self.battery_bar.setStyleSheet("QProgressBar { height: 15px; font-size: 10px; }")
 
-        self.scene = QGraphicsScene(0, 0, 350, 200)
-        self.map_view = QGraphicsView(self.scene)
+        self.scene = QGraphicsScene(0, 0, self.arena_width, self.arena_height)
+        self.map_view = MapView(self.scene)
         self.map_view.setFixedHeight(200)
         self.map_view.setFrameShape(QFrame.Box)
         self.map_view.setStyleSheet("background-color: #F5F5F5;")
-        self.map_view.setSceneRect(0, 0, 350, 200)
-        self.map_view.mousePressEvent = self.map_clicked
+        self.map_view.setSceneRect(0, 0, self.arena_width, self.arena_height)
 
         self.robot_item = QGraphicsEllipseItem(0, 0, 15, 15)
         self.robot_item.setBrush(QBrush(QColor("#FF5722")))
@@ -236,15 +1565,31 @@ class EduBotExplorer(QWidget):
         self.scene.addItem(self.robot_item)
         self.robot_item.setPos(self.robot_x, self.robot_y)
 
-        self.position_label = QLabel("Position: (100, 100)")
+        self.position_label = QLabel(f"Position: ({self.robot_x}, {self.robot_y})")
         self.position_label.setMaximumHeight(18)
         self.position_label.setStyleSheet("font-size: 10px; background-color: #FFF9C4;")
 
-        self.log = QTextEdit()
-        self.log.setReadOnly(True)
-        self.log.setPlaceholderText("Command log...")
-        self.log.setMaximumHeight(80)
-        self.log.setStyleSheet("font-size: 9px;")
+        self.log_view = QPlainTextEdit()
+        self.log_view.setReadOnly(True)
+        self.log_view.setPlaceholderText("Command log...")
+        self.log_view.setMaximumHeight(80)
+        self.log_view.setStyleSheet("font-size: 9px;")
+        self.log = CommandLog(self.log_view)
+        
+        self.log_severity = QComboBox()
+        self.log_severity.addItems(["All"] + [severity.capitalize() for severity in LOG_SEVERITIES[1:]])
+        self.log_severity.setCurrentIndex(LOG_SEVERITIES.index(self.log.min_severity))
+        self.log_category = QComboBox()
+        self.log_category.addItems(["All categories"] + [category.capitalize() for category in LOG_CATEGORIES])
+        self.log_export_btn = QPushButton("Export")
+        self.log_export_btn.setMaximumHeight(22)
+        
+        log_header_layout = QHBoxLayout()
+        log_header_layout.addWidget(QLabel("Command Log"))
+        log_header_layout.addStretch()
+        log_header_layout.addWidget(self.log_severity)
+        log_header_layout.addWidget(self.log_category)
+        log_header_layout.addWidget(self.log_export_btn)
 
         layout = QVBoxLayout()
         layout.addWidget(connection_group)
@@ -261,8 +1606,8 @@ class EduBotExplorer(QWidget):
         layout.addWidget(self.battery_bar)
         layout.addWidget(QLabel("Robot Map"))
         layout.addWidget(self.map_view)
-        layout.addWidget(QLabel("Command Log"))
-        layout.addWidget(self.log)
+        layout.addLayout(log_header_layout)
+        layout.addWidget(self.log_view)
         
         layout.setSpacing(5)
         layout.setContentsMargins(8, 8, 8, 8)
@@ -271,31 +1616,17 @@ class EduBotExplorer(QWidget):
         self.setStyleSheet("font-size: 11px;")
 
     def draw_map(self):
-        for x in range(0, 350, 15):
-            line = QGraphicsLineItem(x, 0, x, 200)
-            line.setPen(QPen(QColor("#E0E0E0"), 0.5))
-            self.scene.addItem(line)
-            
-        for y in range(0, 200, 15):
-            line = QGraphicsLineItem(0, y, 350, y)
-            line.setPen(QPen(QColor("#E0E0E0"), 0.5))
-            self.scene.addItem(line)
-        
-        border = QGraphicsRectItem(0, 0, 350, 200)
-        border.setPen(QPen(Qt.black, 2))
-        self.scene.addItem(border)
-        
         obstacle_positions = [
             (40, 40, 25, 25), (150, 60, 30, 15), 
             (110, 120, 15, 30), (220, 90, 25, 25)
         ]
+        self.obstacle_index = ObstacleGrid(obstacle_positions, self.GRID_SPACING)
         
-        for x, y, w, h in obstacle_positions:
-            obstacle = QGraphicsRectItem(x, y, w, h)
-            obstacle.setBrush(QBrush(QColor("#9E9E9E")))
-            obstacle.setPen(QPen(Qt.black, 1))
-            self.scene.addItem(obstacle)
-            self.obstacles.append(obstacle)
+        # Grid, border and obstacles never change, one cached item draws them all
+        self.static_layer = StaticMapLayer(self.arena_width, self.arena_height, self.obstacle_index,
+                                           self.GRID_SPACING)
+        self.scene.addItem(self.static_layer)
+        self.map_view.centerOn(self.robot_item)
 
     def setup_connections(self):
         self.controls["Forward"].clicked.connect(lambda: self.move_robot(0, -8, "forward"))
@@ -318,7 +1649,29 @@ class EduBotExplorer(QWidget):
         self.connect_btn.clicked.connect(self.connect_to_robot)
         self.disconnect_btn.clicked.connect(self.disconnect_from_robot)
         
+        self.log_severity.currentIndexChanged.connect(self.filter_log)
+        self.log_category.currentIndexChanged.connect(self.filter_log)
+        self.log_export_btn.clicked.connect(self.export_log)
+        
         self.autonomous_timer.timeout.connect(self.autonomous_move)
+        self.map_view.clicked.connect(self.map_clicked)
+
+    def filter_log(self):
+        # Index 0 of both boxes means no filter, "All" severities starts at debug
+        severity = LOG_SEVERITIES[self.log_severity.currentIndex()]
+        category_index = self.log_category.currentIndex()
+        self.log.set_filter(severity, LOG_CATEGORIES[category_index - 1] if category_index else None)
+
+    def export_log(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Command Log", "edubot-log.txt", "Text files (*.txt)")
+        if not path:
+            return
+        try:
+            count = self.log.export(path)
+        except OSError as e:
+            self.log.append(f"Log export failed: {e}", 'error')
+            return
+        self.log.append(f"Exported {count} log entries to {path}")
 
     def connect_to_robot(self):
         host = self.host_input.text()
@@ -333,26 +1686,25 @@ class EduBotExplorer(QWidget):
             self.connection_status.setStyleSheet("font-size: 10px; background-color: #C8E6C9; padding: 2px;")
             self.connect_btn.setEnabled(False)
             self.disconnect_btn.setEnabled(True)
-            self.log.append(f"Connected to {host}:{port}")
+            self.log.append(f"Connected to {host}:{port}", 'info', 'connection')
         else:
             self.connection_status.setText("Status: Connection failed")
-            self.log.append("Connection failed")
+            self.log.append("Connection failed", 'error', 'connection')
 
     def disconnect_from_robot(self):
         if self.robot_connection.socket:
             self.robot_connection.socket.close()
+        self.robot_connection.close_udp()
         self.robot_connection.connected = False
         self.connection_status.setText("Status: Disconnected")
         self.connection_status.setStyleSheet("font-size: 10px; background-color: #FFCDD2; padding: 2px;")
         self.connect_btn.setEnabled(True)
         self.disconnect_btn.setEnabled(False)
-        self.log.append("Disconnected")
+        self.log.append("Disconnected", 'info', 'connection')
 
-    def map_clicked(self, event):
+    def map_clicked(self, pos):
         if self.target_selection_mode:
-            pos = self.map_view.mapToScene(event.pos())
             self.set_target(pos.x(), pos.y())
-        event.accept()
 
     def set_target(self, x, y):
         if self.target_item:
@@ -366,7 +1718,10 @@ class EduBotExplorer(QWidget):
         self.scene.addItem(self.target_item)
         
         self.target_label.setText(f"Target: ({int(x)}, {int(y)})")
-        self.log.append(f"Target: ({int(x)}, {int(y)})")
+        self.log.append(f"Target: ({int(x)}, {int(y)})", 'info', 'autonomous')
+        
+        self.plan_path = None
+        self.request_plan()
         
         self.target_selection_mode = False
         self.target_btn.setStyleSheet("background-color: #E91E63; color: white; font-size: 11px;")
@@ -376,21 +1731,21 @@ class EduBotExplorer(QWidget):
 
     def enable_target_selection(self):
         self.target_selection_mode = True
-        self.log.append("Click on map to set target")
+        self.log.append("Click on map to set target", 'info', 'autonomous')
         self.target_btn.setStyleSheet("background-color: #C2185B; color: white; font-size: 11px;")
 
     def toggle_autonomous_mode(self, state):
         self.autonomous_mode = state == Qt.Checked
         if self.autonomous_mode:
-            self.log.append("Autonomous enabled")
+            self.log.append("Autonomous enabled", 'info', 'autonomous')
             if self.target_x is not None:
                 self.autonomous_timer.start(100)
             else:
-                self.log.append("Set target first")
+                self.log.append("Set target first", 'warning', 'autonomous')
                 self.autonomous_check.setChecked(False)
                 self.autonomous_mode = False
         else:
-            self.log.append("Autonomous disabled")
+            self.log.append("Autonomous disabled", 'info', 'autonomous')
             self.autonomous_timer.stop()
 
     def autonomous_move(self):
@@ -404,18 +1759,84 @@ class EduBotExplorer(QWidget):
         distance = math.sqrt(dx*dx + dy*dy)
         
         if distance < 10:
-            self.log.append("Target reached!")
+            self.log.append("Target reached!", 'info', 'autonomous')
             self.autonomous_timer.stop()
             return
             
-        dx = dx / distance * 4
-        dy = dy / distance * 4
+        heading = math.atan2(dy, dx)
+        if self.obstacle_index.segment_clear(self.robot_x + 7, self.robot_y + 7, self.target_x, self.target_y,
+                                             self.ROBOT_RADIUS):
+            self.move_robot(math.cos(heading) * 4, math.sin(heading) * 4, "autonomous")
+            return
+        
+        # Routes across a large arena can take seconds to plan, keep going meanwhile
+        planning = self.planner is not None and self.plan_path is None
+        if self.planner is not None and not planning and self.follow_plan():
+            return
+        
+        # No line of sight, steer off the target heading, keeping to the side
+        # already used so the robot follows the obstacle instead of dithering
+        for offset in (0,) + self.AVOID_ANGLES:
+            for side in (self.avoid_side, -self.avoid_side):
+                angle = heading + side * math.radians(offset)
+                step_x, step_y = math.cos(angle) * 4, math.sin(angle) * 4
+                if self.step_clear(step_x, step_y):
+                    self.avoid_side = side
+                    self.move_robot(step_x, step_y, "autonomous")
+                    if not planning:
+                        self.request_plan()  # off the route, plan again from here
+                    return
+        
+        self.log.append("Autonomous path blocked", 'warning', 'autonomous')
+        self.autonomous_timer.stop()
+
+    def request_plan(self):
+        """Ask the planner thread for a route from where the robot is now"""
+        if self.planner is not None and self.target_x is not None:
+            self.planner.plan((self.robot_x + 7, self.robot_y + 7), (self.target_x, self.target_y))
+
+    def path_planned(self, result):
+        goal, path = result
+        if goal != (self.target_x, self.target_y):
+            return  # planned for an earlier target
+        if path is None:
+            self.plan_path = deque()
+            self.log.append("No path to target", 'warning', 'autonomous')
+            self.autonomous_timer.stop()
+            return
+        self.plan_path = deque(path)
+        # Long routes on large arenas come in stages
+        self.plan_partial = bool(path) and math.dist(path[-1], (self.target_x, self.target_y)) > self.GRID_SPACING
+        self.log.append(f"Planned {len(path)} waypoints to target", 'debug', 'autonomous')
+
+    def follow_plan(self):
+        """Step toward the next waypoint of the planned route, False if that isn't possible"""
+        x, y = self.robot_x + 7, self.robot_y + 7
+        path = self.plan_path
+        # Skip waypoints already reached, and any the one after can be seen past
+        while path and math.dist((x, y), path[0]) < 4:
+            path.popleft()
+        while len(path) > 1 and self.obstacle_index.segment_clear(x, y, *path[1], self.ROBOT_RADIUS):
+            path.popleft()
+        if self.plan_partial and len(path) <= 1:
+            # Ask for the next stage while this one is being finished
+            self.plan_partial = False
+            self.request_plan()
+        if not path:
+            return False
         
-        self.move_robot(dx, dy, "autonomous")
+        dx, dy = path[0][0] - x, path[0][1] - y
+        scale = min(4, math.hypot(dx, dy)) / math.hypot(dx, dy)
+        if not self.step_clear(dx * scale, dy * scale):
+            return False
+        return self.move_robot(dx * scale, dy * scale, "autonomous")
 
     def auto_move_random(self):
-        random_x = random.randint(15, 335)
-        random_y = random.randint(15, 185)
+        random_x = random.randint(15, self.arena_width - 15)
+        random_y = random.randint(15, self.arena_height - 15)
+        while self.obstacle_index.collides(random_x, random_y, self.ROBOT_RADIUS):
+            random_x = random.randint(15, self.arena_width - 15)
+            random_y = random.randint(15, self.arena_height - 15)
         self.set_target(random_x, random_y)
         
         if not self.autonomous_mode:
@@ -436,46 +1857,95 @@ class EduBotExplorer(QWidget):
     def emergency_stop_robot(self):
         if self.robot_connection.connected:
             self.robot_connection.send_command('emergency_stop')
-        self.log.append("Emergency Stop executed")
+        self.log.append("Emergency Stop executed", 'info', 'command')
 
     def smart_stop_robot(self):
         if self.robot_connection.connected:
             self.robot_connection.send_command('smart_stop')
-        self.log.append("Smart Stop executed")
+        self.log.append("Smart Stop executed", 'info', 'command')
 
     def start_autonomous_navigation(self):
+        if self.target_x is None:
+            self.log.append("Set target first", 'warning', 'autonomous')
+            return
         if self.robot_connection.connected:
+            # The robot dead-reckons from where the map shows it (robot centre)
             target_data = {
                 'target_x': self.target_x,
-                'target_y': self.target_y
+                'target_y': self.target_y,
+                'robot_x': self.robot_x + 7,
+                'robot_y': self.robot_y + 7
             }
             self.robot_connection.send_command('start_autonomous', target_data)
-        self.log.append("Autonomous navigation started")
+        self.log.append("Autonomous navigation started", 'info', 'autonomous')
 
     def stop_autonomous_navigation(self):
         if self.robot_connection.connected:
             self.robot_connection.send_command('stop_autonomous')
-        self.log.append("Autonomous navigation stopped")
+        self.log.append("Autonomous navigation stopped", 'info', 'autonomous')
 
     def get_robot_status(self):
         if self.robot_connection.connected:
             self.robot_connection.send_command('get_status')
-        self.log.append("Requesting robot status")
+        self.log.append("Requesting robot status", 'info', 'status')
+
+    def show_robot_status(self, status, metrics):
+        self.log.append(f"Robot: up {status.get('uptime', 0):.0f}s, {status.get('clients', 0)} client(s), "
+                        f"autonomous {status.get('autonomous', '--')}, ranging {status.get('ranging', '--')}",
+                        'info', 'status')
+        
+        # One line per command with its latency percentiles
+        for name, value in sorted(metrics.items()):
+            if name.startswith('edubot_command_latency_seconds') and value.get('count'):
+                command = name.split('"')[1]
+                self.log.append(f"  {command}: {value['count']} calls, "
+                                f"p50 {value['p50'] * 1000:.2f} ms, p99 {value['p99'] * 1000:.2f} ms", 'info', 'status')
+        # Timeouts are counted per ranging sensor
+        timeouts = {name.split('"')[1] if '"' in name else 'all': value
+                    for name, value in sorted(metrics.items())
+                    if name.startswith('edubot_distance_timeouts_total')}
+        per_sensor = ', '.join(f"{sensor} {count}" for sensor, count in timeouts.items())
+        self.log.append(f"  Distance timeouts: {sum(timeouts.values())}" + (f" ({per_sensor})" if per_sensor else ''),
+                        'info', 'status')
 
     def handle_autonomous_update(self, data):
         sensor_data = data.get('sensor_data', {})
         obstacle_detected = data.get('obstacle_detected', False)
+        position = data.get('position')
         
+        if position:
+            # Robot reports its centre, the map item is positioned by its corner
+            self.robot_x = position.get('x', self.robot_x + 7) - 7
+            self.robot_y = position.get('y', self.robot_y + 7) - 7
+            self.robot_item.setPos(self.robot_x, self.robot_y)
+            self.position_label.setText(f"Position: ({int(self.robot_x)}, {int(self.robot_y)})")
+        if data.get('heading') is not None:
+            self.robot_heading = data['heading']
+        
+        # After the pose, so the readings are mapped from where they were taken
         self.update_real_sensors(sensor_data)
         
         if obstacle_detected:
-            self.log.append("Obstacle detected and avoided")
+            self.log.append("Obstacle detected and avoided", 'info', 'autonomous')
+        if data.get('state') == 'reached':
+            self.log.append("Target reached!", 'info', 'autonomous')
+
+    def handle_robot_message(self, message):
+        """Render a message from the robot, called on the GUI thread by the bridge"""
+        kind = message.get('type')
+        if kind == 'sensor_data':
+            self.update_real_sensors(message.get('data', {}))
+        elif kind == 'autonomous_update':
+            self.handle_autonomous_update(message.get('data', {}))
+        elif kind == 'log':
+            self.log.append(message['text'], message.get('severity', 'info'), 'connection')
+        elif kind == 'command_response' and message.get('command') == 'get_status':
+            self.show_robot_status(message.get('robot_status', {}), message.get('metrics', {}))
 
     def clear_map(self):
-        for line in self.trail_lines:
-            self.scene.removeItem(line)
-        self.trail_lines.clear()
-        self.robot_trail.clear()
+        self.trail.clear()
+        if self.occupancy is not None:
+            self.occupancy.clear()
         
         if self.target_item:
             self.scene.removeItem(self.target_item)
@@ -483,39 +1953,61 @@ class EduBotExplorer(QWidget):
             self.target_x, self.target_y = None, None
             self.target_label.setText("Target: Not set")
             
-        self.log.append("Map cleared")
+        self.log.append("Map cleared", 'info', 'map')
 
     def return_to_start(self):
         self.robot_x, self.robot_y = self.start_x, self.start_y
         self.robot_item.setPos(self.robot_x, self.robot_y)
         self.position_label.setText(f"Position: ({self.robot_x}, {self.robot_y})")
-        self.log.append("Returned to start")
+        self.log.append("Returned to start", 'info', 'map')
 
     def setup_timer(self):
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_sensors)
         self.timer.start(1000)
+        
+        # Keeps the robot clock offset fresh
+        self.sync_timer = QTimer()
+        self.sync_timer.timeout.connect(self.sync_clock)
+        self.sync_timer.start(10000)
+    
+    def sync_clock(self):
+        if self.robot_connection.connected:
+            try:
+                self.robot_connection.send_ping()
+            except OSError:
+                pass
+
+    def clamp_step(self, dx, dy):
+        """Corner position after a step, kept inside the arena"""
+        return (max(8, min(self.robot_x + dx, self.arena_width - 8)),
+                max(8, min(self.robot_y + dy, self.arena_height - 8)))
+
+    def step_clear(self, dx, dy):
+        new_x, new_y = self.clamp_step(dx, dy)
+        return self.obstacle_index.segment_clear(self.robot_x + 7, self.robot_y + 7, new_x + 7, new_y + 7,
+                                                 self.ROBOT_RADIUS)
 
     def move_robot(self, dx, dy, command):
-        self.robot_trail.append((self.robot_x, self.robot_y))
+        if not self.step_clear(dx, dy):
+            self.log.append(f"{command.capitalize()} blocked by obstacle", 'warning', 'map')
+            return False
         
-        new_x = max(8, min(self.robot_x + dx, 342))
-        new_y = max(8, min(self.robot_y + dy, 192))
+        prev_x, prev_y = self.robot_x, self.robot_y
+        new_x, new_y = self.clamp_step(dx, dy)
         
         self.robot_x = new_x
         self.robot_y = new_y
+        if (new_x, new_y) != (prev_x, prev_y):
+            self.robot_heading = math.degrees(math.atan2(new_x - prev_x, prev_y - new_y)) % 360
         
         self.robot_item.setPos(self.robot_x, self.robot_y)
         
-        if len(self.robot_trail) > 1:
-            prev_x, prev_y = self.robot_trail[-1]
-            trail_line = QGraphicsLineItem(prev_x + 7, prev_y + 7, self.robot_x + 7, self.robot_y + 7)
-            trail_line.setPen(QPen(QColor("#2196F3"), 1.5))
-            self.scene.addItem(trail_line)
-            self.trail_lines.append(trail_line)
+        self.trail.add_step(prev_x + 7, prev_y + 7, self.robot_x + 7, self.robot_y + 7)
         
         self.position_label.setText(f"Position: ({int(self.robot_x)}, {int(self.robot_y)})")
-        self.send_command(command)
+        # Autonomous steps come every timer tick, logged below the default filter
+        self.send_command(command, 'debug' if command == 'autonomous' else 'info')
         
         if self.robot_connection.connected and command in ['forward', 'backward', 'left', 'right', 'stop']:
             movement_data = {
@@ -523,17 +2015,43 @@ class EduBotExplorer(QWidget):
                 'distance': math.sqrt(dx*dx + dy*dy)
             }
             self.robot_connection.send_command('move', movement_data)
+        return True
 
-    def send_command(self, command):
-        self.log.append(f"Command: {command}")
+    def send_command(self, command, severity='info'):
+        self.log.append(f"Command: {command}", severity, 'command')
 
     def update_real_sensors(self, sensor_data):
         distance = sensor_data.get('distance', 0)
         temperature = sensor_data.get('temperature', 25)
         battery = sensor_data.get('battery', 100)
         
-        self.sensor_label.setText(f"Distance: {distance} cm | Temp: {temperature} °C")
+        text = f"Distance: {distance} cm | Temp: {temperature} °C"
+        if 'confidence' in sensor_data:
+            # Filtered on the robot, show how much of the recent window agreed
+            text = (f"Distance: {distance} cm ({sensor_data['confidence']:.0%}, raw {sensor_data.get('raw_distance', distance)})"
+                    f" | Temp: {temperature} °C")
+        sensors = sensor_data.get('sensors', [])
+        if len(sensors) > 1:
+            text += " | " + " ".join(f"{sensor['name']}: {sensor['distance']:.0f}" for sensor in sensors)
+        # Sensor-to-screen latency: reading time mapped onto our clock
+        sampled_at = self.robot_connection.clock.to_local(sensor_data.get('timestamp'))
+        if sampled_at is not None:
+            text += f" | Age: {(time.monotonic() - sampled_at) * 1000:.0f} ms"
+        self.sensor_label.setText(text)
         self.battery_bar.setValue(battery)
+        self.map_readings(sensor_data)
+
+    def map_readings(self, sensor_data):
+        """Add the robot's range readings to the occupancy map at its current pose"""
+        if self.occupancy is None or sensor_data.get('status') == 'error':
+            return
+        sensors = sensor_data.get('sensors') or [
+            {'angle': 0.0, 'distance': sensor_data.get('distance', 0),
+             'confidence': sensor_data.get('confidence', 1.0)}]
+        readings = [(sensor.get('angle', 0.0), sensor['distance'], sensor.get('confidence', 1.0))
+                    for sensor in sensors if sensor.get('distance', 0) > 0]
+        if readings:
+            self.occupancy.integrate(self.robot_x + 7, self.robot_y + 7, self.robot_heading, readings)
 
     def update_sensors(self):
         if not self.robot_connection.connected:
@@ -543,8 +2061,23 @@ class EduBotExplorer(QWidget):
             self.sensor_label.setText(f"Distance: {distance} cm | Temp: {temperature} °C")
             self.battery_bar.setValue(battery)
 
+def parse_arena_size(text):
+    """Arena side in cm from the command line, at least EduBotExplorer.MIN_ARENA_SIZE"""
+    try:
+        size = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number of cm, got {text!r}")
+    if size < EduBotExplorer.MIN_ARENA_SIZE:
+        raise argparse.ArgumentTypeError(f"must be at least {EduBotExplorer.MIN_ARENA_SIZE} cm, got {size}")
+    return size
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = EduBotExplorer()
+    parser = argparse.ArgumentParser(description="EduBot Explorer robot control GUI")
+    parser.add_argument('--arena-width', type=parse_arena_size, default=350, help="arena width in cm")
+    parser.add_argument('--arena-height', type=parse_arena_size, default=200, help="arena height in cm")
+    # Anything else is left to Qt
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = EduBotExplorer(args.arena_width, args.arena_height)
     window.show()
     sys.exit(app.exec_())
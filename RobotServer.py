@@ -2,20 +2,1461 @@
 """
 Robot Server for EduBot Explorer
 Run this on Raspberry Pi: python3 RobotServer.py
+Run it anywhere else against a simulated robot: python3 RobotServer.py --simulate
 """
 
 import socket
+import statistics
+import selectors
+import logging
+import logging.handlers
+import queue
+import atexit
+import bisect
+import glob
+import heapq
+import mmap
+import os
 import json
-import RPi.GPIO as GPIO
+import struct
+import random
 import time
 import threading
+import math
 import signal
 import sys
-from datetime import datetime
+import argparse
+from collections import deque
 
-class RealEduBot:
+try:
+    import RPi.GPIO as RPiGPIO
+except ImportError:  # not on a Raspberry Pi, only the simulated backend is available
+    RPiGPIO = None
+
+try:
+    import numpy as np
+except ImportError:  # distance filtering falls back to plain Python
+    np = None
+
+log = logging.getLogger('edubot')
+
+# Per-message tracing, below DEBUG and only enabled with --trace
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+
+# Attributes every LogRecord has, anything else was passed through extra=
+STANDARD_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per msg_type: at most `rate` records per second, bursts up to `burst`
+    
+    Records without a msg_type are never limited. The number of records
+    suppressed since the last one let through is attached as 'suppressed'.
+    """
+    MAX_KEYS = 1000  # message types come from clients, don't let them grow the table forever
+    
+    def __init__(self, rate=10.0, burst=20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # msg_type -> [tokens, last refill, suppressed]
+        self.lock = threading.Lock()
+    
+    def filter(self, record):
+        key = getattr(record, 'msg_type', None)
+        if key is None or self.rate <= 0:
+            return True
+        key = str(key)
+        
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                if len(self.buckets) >= self.MAX_KEYS:
+                    self.buckets.clear()
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+            bucket[0] = tokens - 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+class AsyncLogHandler(logging.handlers.QueueHandler):
+    """Hands records to the log worker thread without formatting them
+    
+    The queue is bounded. If the worker falls behind, new records are counted
+    and dropped instead of blocking the caller.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record):
+        # Same process, no pickling: leave %-formatting to the worker
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class StructuredFormatter(logging.Formatter):
+    """Text lines with trailing key=value fields, or one JSON object per line"""
+    def __init__(self, json_lines=False):
+        super().__init__('%(asctime)s %(levelname)s %(message)s')
+        self.json_lines = json_lines
+    
+    def format(self, record):
+        fields = {key: value for key, value in vars(record).items() if key not in STANDARD_RECORD_FIELDS}
+        if self.json_lines:
+            entry = {'time': record.created, 'level': record.levelname, 'message': record.getMessage()}
+            entry.update(fields)
+            if record.exc_info:
+                entry['exception'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+        
+        line = super().format(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+def setup_logging(level='INFO', trace=False, rate_limit=10.0, json_lines=False, queue_size=10000):
+    """Route the 'edubot' logger through a background writer thread
+    
+    Callers only pay for the level check, the rate limit and a queue put.
+    Returns the started QueueListener, stop it to flush pending records.
+    """
+    handler = AsyncLogHandler(queue.Queue(queue_size))
+    handler.addFilter(RateLimitFilter(rate_limit))
+    
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(StructuredFormatter(json_lines))
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    
+    log.handlers[:] = [handler]
+    log.propagate = False
+    log.setLevel(TRACE if trace else getattr(logging, level))
+    listener.start()
+    return listener
+
+class Counter:
+    """Monotonically increasing count"""
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+    
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class Gauge:
+    """Value that can go up and down"""
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+    
+    def set(self, value):
+        self.value = value
+    
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+    
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+class Histogram:
+    """Cumulative bucket counts plus sum and count of observed values"""
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+    
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+    
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]  # beyond the last bound
+                low = self.buckets[index - 1] if index else 0.0
+                high = self.buckets[index]
+                return low + (high - low) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+class MetricsRegistry:
+    """In-process counters, gauges and histograms
+    
+    A metric is identified by its name plus label values and is created on
+    first use, so instrumented code just asks the registry for it. The
+    contents can be read as a JSON-friendly snapshot or in the Prometheus
+    text exposition format.
+    """
+    LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+    
     def __init__(self):
-        print("Initializing RealEduBot...")
+        self.lock = threading.Lock()
+        self.metrics = {}     # (name, sorted label items) -> metric
+        self.described = {}   # name -> (type, help)
+    
+    def get(self, kind, factory, name, help, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = factory()
+                    self.described.setdefault(name, (kind, help))
+        return metric
+    
+    def counter(self, name, help='', **labels):
+        return self.get('counter', Counter, name, help, labels)
+    
+    def gauge(self, name, help='', **labels):
+        return self.get('gauge', Gauge, name, help, labels)
+    
+    def histogram(self, name, help='', buckets=LATENCY_BUCKETS, **labels):
+        return self.get('histogram', lambda: Histogram(buckets), name, help, labels)
+    
+    def series_name(self, name, labels):
+        if not labels:
+            return name
+        return name + '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+    
+    def rounded(self, value):
+        return None if value is None else round(value, 6)
+    
+    def snapshot(self):
+        """Current values keyed by series name, histograms summarized"""
+        with self.lock:
+            items = sorted(self.metrics.items())
+        result = {}
+        for (name, labels), metric in items:
+            series = self.series_name(name, labels)
+            if isinstance(metric, Histogram):
+                result[series] = {
+                    'count': metric.count,
+                    'sum': round(metric.sum, 6),
+                    'p50': self.rounded(metric.quantile(0.5)),
+                    'p95': self.rounded(metric.quantile(0.95)),
+                    'p99': self.rounded(metric.quantile(0.99))
+                }
+            else:
+                result[series] = metric.value
+        return result
+    
+    def exposition(self):
+        """Prometheus text exposition format"""
+        with self.lock:
+            items = sorted(self.metrics.items())
+            described = dict(self.described)
+        lines = []
+        current = None
+        for (name, labels), metric in items:
+            if name != current:
+                kind, help = described[name]
+                if help:
+                    lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                current = name
+            if isinstance(metric, Histogram):
+                with metric.lock:
+                    counts = list(metric.counts)
+                    total, count = metric.sum, metric.count
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    bucket_labels = labels + (('le', bound),)
+                    lines.append(f'{self.series_name(name + "_bucket", bucket_labels)} {cumulative}')
+                lines.append(f'{self.series_name(name + "_sum", labels)} {total}')
+                lines.append(f'{self.series_name(name + "_count", labels)} {count}')
+            else:
+                lines.append(f'{self.series_name(name, labels)} {metric.value}')
+        return '\n'.join(lines) + '\n'
+    
+    def write_file(self, path):
+        """Atomically replace path with the current exposition"""
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.exposition())
+        os.replace(temp_path, path)
+
+metrics = MetricsRegistry()
+
+# Wire protocol: every message is sent as a frame made of a 4-byte big-endian
+# payload length followed by the payload itself. Payloads are UTF-8 JSON
+# objects (always starting with '{') unless the client negotiated the compact
+# binary encoding, whose payloads start with one of the BINARY_* kind bytes.
+FRAME_HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024
+
+# Encodings a client may ask for, in its own order of preference, in a 'test' message.
+# 'binary2' is the layout below; the older 'binary' sensor record had no
+# confidence or ranging sensors and is no longer offered, so a peer that only
+# knows it falls back to JSON instead of mis-decoding frames
+BINARY_ENCODING = 'binary2'
+SUPPORTED_ENCODINGS = (BINARY_ENCODING, 'json')
+
+BINARY_SENSOR_DATA = 1
+BINARY_COMMAND_RESPONSE = 2
+# kind, broadcast timestamp
+BINARY_SENSOR_HEADER = struct.Struct('!Bd')
+# kind, command index, status index, flags, timestamp, message length; the
+# message is followed by the motion queue (if RESPONSE_HAS_QUEUE) and a sensor
+# record (if RESPONSE_HAS_SENSOR)
+BINARY_RESPONSE_HEADER = struct.Struct('!BBBBdH')
+RESPONSE_HAS_SENSOR = 1
+RESPONSE_HAS_QUEUE = 2
+BINARY_QUEUE_INFO = struct.Struct('!Bf')  # queue depth, seconds of motion left
+# sample timestamp, filtered distance, raw distance, temperature, battery,
+# sensor status, confidence percent
+BINARY_SENSOR_RECORD = struct.Struct('!dfffBBB')
+# followed by a count byte and per ranging sensor: mount angle, filtered
+# distance, raw distance, confidence percent, name length and UTF-8 name
+BINARY_RANGE_ENTRY = struct.Struct('!fffBB')
+
+# Optional UDP teleop channel: one JSON datagram per drive/move update, tagged
+# with the token handed out on the 'test' handshake and a sequence number
+TELEOP_COMMANDS = ('move', 'drive')
+MAX_DATAGRAM_SIZE = 1024
+# TCP commands that stop motion; they carry the client's newest teleop
+# sequence number as data['udp_seq'] so datagrams sent before them are stale
+STOP_COMMANDS = ('stop', 'emergency_stop', 'smart_stop', 'stop_autonomous')
+
+# Enumerations shared with the GUI, append only
+BINARY_COMMANDS = ('move', 'stop', 'get_sensors', 'start_autonomous', 'stop_autonomous',
+                   'smart_stop', 'emergency_stop', 'drive')
+BINARY_STATUSES = ('success', 'error')
+BINARY_SENSOR_STATUSES = ('active', 'error')
+BINARY_SENSOR_KEYS = {'distance', 'raw_distance', 'confidence', 'sensors', 'temperature', 'battery',
+                      'timestamp', 'status'}
+BINARY_RANGE_KEYS = {'name', 'angle', 'distance', 'raw_distance', 'confidence'}
+BINARY_RESPONSE_KEYS = {'type', 'command', 'status', 'timestamp', 'message', 'sensor_data',
+                        'queue_depth', 'queue_time'}
+
+class ProtocolError(Exception):
+    """Raised when the byte stream cannot be split into valid frames"""
+
+def server_time():
+    """Timestamp for messages and readings: the server's monotonic clock in seconds
+    
+    Cheap to produce, never jumps when the system clock is adjusted, and
+    clients map it onto their own clock with the offset measured by the
+    'test' ping exchange.
+    """
+    return time.monotonic()
+
+def to_timestamp(value):
+    """Numeric message timestamp, now if the message has none"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return server_time()
+
+def encode_sensor_record(data):
+    """Pack a get_sensor_data dict, None if it has fields the layout can't hold"""
+    if not BINARY_SENSOR_KEYS.issuperset(data) or data.get('status') not in BINARY_SENSOR_STATUSES:
+        return None
+    sensors = data.get('sensors', [])
+    if len(sensors) > 255 or not all(BINARY_RANGE_KEYS.issuperset(sensor) for sensor in sensors):
+        return None
+    
+    entries = [bytes([len(sensors)])]
+    for sensor in sensors:
+        name = str(sensor.get('name', ''))[:32].encode('utf-8')
+        entries.append(BINARY_RANGE_ENTRY.pack(
+            sensor.get('angle', 0.0),
+            sensor.get('distance', 0.0),
+            sensor.get('raw_distance', sensor.get('distance', 0.0)),
+            max(0, min(100, round(sensor.get('confidence', 1.0) * 100))),
+            len(name)
+        ) + name)
+    return BINARY_SENSOR_RECORD.pack(
+        to_timestamp(data.get('timestamp')),
+        data.get('distance', 0.0),
+        data.get('raw_distance', data.get('distance', 0.0)),
+        data.get('temperature', 0.0),
+        max(0, min(255, int(data.get('battery', 0)))),
+        BINARY_SENSOR_STATUSES.index(data['status']),
+        max(0, min(100, round(data.get('confidence', 1.0) * 100)))  # percent
+    ) + b''.join(entries)
+
+def encode_binary(message):
+    """Compact binary payload for a message, or None to fall back to JSON"""
+    msg_type = message.get('type')
+    
+    if msg_type == 'sensor_data' and set(message) <= {'type', 'data', 'timestamp'}:
+        record = encode_sensor_record(message.get('data', {}))
+        if record is None:
+            return None
+        header = BINARY_SENSOR_HEADER.pack(BINARY_SENSOR_DATA, to_timestamp(message.get('timestamp')))
+        return header + record
+    
+    if msg_type == 'command_response' and BINARY_RESPONSE_KEYS.issuperset(message):
+        if message.get('command') not in BINARY_COMMANDS or message.get('status') not in BINARY_STATUSES:
+            return None
+        record = b''
+        if 'sensor_data' in message:
+            record = encode_sensor_record(message['sensor_data'])
+            if record is None:
+                return None
+        queue_info = b''
+        if 'queue_depth' in message:
+            queue_info = BINARY_QUEUE_INFO.pack(min(message['queue_depth'], 255), message.get('queue_time', 0.0))
+        text = message.get('message', '').encode('utf-8')
+        header = BINARY_RESPONSE_HEADER.pack(
+            BINARY_COMMAND_RESPONSE,
+            BINARY_COMMANDS.index(message['command']),
+            BINARY_STATUSES.index(message['status']),
+            (RESPONSE_HAS_SENSOR if record else 0) | (RESPONSE_HAS_QUEUE if queue_info else 0),
+            to_timestamp(message.get('timestamp')),
+            len(text)
+        )
+        return header + text + queue_info + record
+    
+    return None
+
+def encode_message(message, encoding='json'):
+    """Serialize a message dict into a length-prefixed frame"""
+    payload = encode_binary(message) if encoding == BINARY_ENCODING else None
+    if payload is None:
+        payload = json.dumps(message).encode('utf-8')
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+class MessageDecoder:
+    """Incremental decoder that pulls complete frames out of a TCP stream"""
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+        
+    def feed(self, data):
+        """Append received bytes and return every complete payload"""
+        self.buffer.extend(data)
+        payloads = []
+        offset = 0
+        header_size = FRAME_HEADER.size
+        
+        while len(self.buffer) - offset >= header_size:
+            (length,) = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_frame_size:
+                raise ProtocolError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+            end = offset + header_size + length
+            if len(self.buffer) < end:
+                break  # wait for the rest of this frame
+            payloads.append(bytes(self.buffer[offset + header_size:end]))
+            offset = end
+        
+        # Drop consumed bytes once per read instead of once per frame
+        if offset:
+            del self.buffer[:offset]
+        return payloads
+
+class ClientSession:
+    """Per-connection state with a bounded queue of outgoing frames
+    
+    Every frame for a client goes through its outbox and is written by a
+    single writer (the session's writer thread in threaded mode, the event
+    loop otherwise), so broadcasts and command responses never interleave on
+    the socket. When a slow client lets the outbox fill up, overflow_policy
+    decides between dropping the oldest queued broadcast ('drop_oldest') and
+    disconnecting the client ('disconnect'). Replies to the client's own
+    commands are never dropped, a client whose outbox is full of them is
+    disconnected either way.
+    """
+    def __init__(self, client_socket, address, max_queue=64, overflow_policy='drop_oldest'):
+        self.socket = client_socket
+        self.address = address
+        self.decoder = MessageDecoder()
+        self.outbox = deque()  # (encoded frame, droppable) not yet handed to the socket
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.condition = threading.Condition()
+        self.sending = b''       # frame partially written by the event loop
+        self.want_write = False  # registered for EVENT_WRITE in event-loop mode
+        self.dropped = 0
+        self.closed = False
+        self.encoding = 'json'  # switched by the 'test' handshake
+        self.udp_token = None   # identifies this client's teleop datagrams
+        self.udp_seq = -1       # newest teleop sequence number applied
+    
+    def enqueue(self, frame, droppable=False):
+        """Queue a frame, returns False if the client has to be disconnected
+        
+        droppable frames (broadcasts) may be evicted by the drop_oldest policy.
+        """
+        with self.condition:
+            if self.closed:
+                return True
+            if len(self.outbox) >= self.max_queue:
+                if self.overflow_policy == 'disconnect':
+                    return False
+                oldest = next((index for index, (_, evictable) in enumerate(self.outbox) if evictable), None)
+                if oldest is None and not droppable:
+                    return False  # nothing but replies queued, the client stopped reading
+                self.dropped += 1
+                metrics.counter('edubot_send_dropped_total', "Frames dropped for slow clients").inc()
+                if oldest is None:
+                    return True  # no older broadcast to make room, drop this one
+                del self.outbox[oldest]
+            self.outbox.append((frame, droppable))
+            self.condition.notify()
+        return True
+    
+    def next_frame(self):
+        """Block until a frame is queued, None once the session is closed and drained"""
+        with self.condition:
+            while not self.outbox and not self.closed:
+                self.condition.wait()
+            return self.outbox.popleft()[0] if self.outbox else None
+    
+    def pop_frame(self):
+        """Next queued frame without blocking, or None"""
+        with self.condition:
+            return self.outbox.popleft()[0] if self.outbox else None
+    
+    def mark_closed(self):
+        """Flag the session closed, returns False if it already was"""
+        with self.condition:
+            if self.closed:
+                return False
+            self.closed = True
+            self.condition.notify_all()
+            return True
+
+class MotionScheduler:
+    """Times motor moves on a background thread so command handlers never sleep
+    
+    Only one move drives the motors at a time. A move's action is a motion
+    name ('forward', 'left', ...) or a (left, right) wheel velocity pair.
+    Submitting a move preempts the current one immediately unless it is
+    explicitly queued behind it, and stop() cancels everything at once.
+    
+    Redundant moves are merged instead of piling up: a preempting move with
+    the action already driving the motors only moves the deadline, and a
+    queued move with the same action as the last queued one extends it. The
+    queue never takes more than MAX_BACKLOG seconds of motion in total, so
+    the robot stops within that time of the operator letting go however
+    bursty the queued input was.
+    """
+    MAX_BACKLOG = 2.0  # seconds of motion allowed ahead, including the current move
+    
+    def __init__(self, robot):
+        self.robot = robot
+        self.condition = threading.Condition()
+        self.queue = deque()  # pending (action, duration) moves
+        self.current = None   # action currently driving the motors
+        self.deadline = None  # time.monotonic() at which the current move ends
+        self.running = True
+        
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def submit(self, action, duration, queue=False):
+        """Start a move now, or queue it behind the current one
+        
+        Returns the seconds of the move that were accepted, less than duration
+        when a queued move would overflow MAX_BACKLOG.
+        """
+        with self.condition:
+            if not queue or self.current is None:
+                self.queue.clear()
+                if action == self.current:
+                    # Same motion already running, only the end time changes
+                    self.deadline = time.monotonic() + duration
+                    metrics.counter('edubot_commands_coalesced_total', "Motion commands merged or dropped",
+                                    reason='same_action').inc()
+                else:
+                    self.start_move(action, duration)
+            else:
+                duration = max(0.0, min(duration, self.MAX_BACKLOG - self.backlog_time()))
+                if duration <= 0:
+                    metrics.counter('edubot_commands_coalesced_total', "Motion commands merged or dropped",
+                                    reason='backlog_full').inc()
+                elif self.queue and self.queue[-1][0] == action:
+                    self.queue[-1] = (action, self.queue[-1][1] + duration)
+                    metrics.counter('edubot_commands_coalesced_total', "Motion commands merged or dropped",
+                                    reason='same_action').inc()
+                else:
+                    self.queue.append((action, duration))
+            self.condition.notify()
+            return duration
+    
+    def backlog_time(self):
+        # Caller holds self.condition
+        remaining = max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else 0.0
+        return remaining + sum(duration for _, duration in self.queue)
+    
+    def backlog(self):
+        """(moves waiting or running, seconds of motion left) for client backpressure"""
+        with self.condition:
+            depth = len(self.queue) + (1 if self.current is not None else 0)
+            return depth, round(self.backlog_time(), 3)
+    
+    def finish_current(self, max_remaining=0.2):
+        """Drop queued moves and let the current one run out, for at most max_remaining"""
+        with self.condition:
+            self.queue.clear()
+            if self.deadline is not None:
+                self.deadline = min(self.deadline, time.monotonic() + max_remaining)
+            self.condition.notify()
+    
+    def stop(self):
+        """Cancel the current and all queued moves and stop the motors"""
+        with self.condition:
+            self.queue.clear()
+            self.current = None
+            self.deadline = None
+            self.robot.apply_motion(None)
+            self.condition.notify()
+    
+    def start_move(self, action, duration):
+        # Caller holds self.condition
+        self.robot.apply_motion(action)
+        self.current = action
+        self.deadline = time.monotonic() + duration
+    
+    def run(self):
+        """Timer loop ending each move when its deadline passes"""
+        with self.condition:
+            while self.running:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+                
+                remaining = self.deadline - time.monotonic()
+                if remaining > 0:
+                    # Woken early by submit()/stop(), the deadline is re-read on the next pass
+                    self.condition.wait(remaining)
+                    continue
+                
+                if self.queue:
+                    self.start_move(*self.queue.popleft())
+                else:
+                    self.robot.apply_motion(None)
+                    self.current = None
+                    self.deadline = None
+    
+    def shutdown(self):
+        """Stop the motors and end the timer thread"""
+        with self.condition:
+            self.running = False
+        self.stop()
+
+def angle_difference(a, b):
+    """Unsigned difference between two headings in degrees, 0..180"""
+    return abs((a - b + 180) % 360 - 180)
+
+class SimulatedWorld:
+    """Virtual arena for the simulated backend, laid out like the GUI map
+    
+    Positions are GUI map pixels, one pixel standing for one centimetre. The
+    robot pose moves with the wheel velocities the motors are driven at and
+    stops at walls and obstacles.
+    """
+    CM_PER_PIXEL = 1.0
+    ROBOT_RADIUS = 7.0
+    MAX_SPEED = 40.0       # map px per second at full duty, like RealEduBot.FORWARD_SPEED
+    MAX_TURN_RATE = 180.0  # degrees per second, like RealEduBot.TURN_RATE
+    
+    def __init__(self, width=350, height=200, obstacles=None):
+        self.width = width
+        self.height = height
+        # Same (x, y, w, h) blocks the GUI draws
+        self.obstacles = obstacles if obstacles is not None else [
+            (40, 40, 25, 25), (150, 60, 30, 15),
+            (110, 120, 15, 30), (220, 90, 25, 25)
+        ]
+        self.x, self.y = 107.0, 107.0
+        self.heading = 0.0  # degrees, 0 is up the map, clockwise positive
+        self.left = 0.0
+        self.right = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def set_wheels(self, left, right):
+        """Change wheel velocities (-1..1), integrating the motion so far first"""
+        with self.lock:
+            self.advance()
+            self.left, self.right = left, right
+    
+    def pose(self):
+        with self.lock:
+            self.advance()
+            return self.x, self.y, self.heading
+    
+    def advance(self):
+        # Caller holds self.lock
+        now = time.monotonic()
+        dt = now - self.updated
+        self.updated = now
+        if dt <= 0 or (self.left == 0 and self.right == 0):
+            return
+        
+        self.heading = (self.heading + (self.left - self.right) / 2 * self.MAX_TURN_RATE * dt) % 360
+        step = (self.left + self.right) / 2 * self.MAX_SPEED * dt
+        x = self.x + step * math.sin(math.radians(self.heading))
+        y = self.y - step * math.cos(math.radians(self.heading))
+        if not self.collides(x, y):
+            self.x, self.y = x, y
+    
+    def collides(self, x, y):
+        r = self.ROBOT_RADIUS
+        if x < r or y < r or x > self.width - r or y > self.height - r:
+            return True
+        for ox, oy, ow, oh in self.obstacles:
+            if ox - r < x < ox + ow + r and oy - r < y < oy + oh + r:
+                return True
+        return False
+    
+    def raycast(self, x, y, heading):
+        """Distance in map px from (x, y) to the first wall or obstacle along heading"""
+        dx = math.sin(math.radians(heading))
+        dy = -math.cos(math.radians(heading))
+        
+        # Arena walls, seen from inside
+        hits = []
+        if dx > 0:
+            hits.append((self.width - x) / dx)
+        elif dx < 0:
+            hits.append(-x / dx)
+        if dy > 0:
+            hits.append((self.height - y) / dy)
+        elif dy < 0:
+            hits.append(-y / dy)
+        
+        # Obstacles, slab test against each rectangle
+        for ox, oy, ow, oh in self.obstacles:
+            t_near, t_far = 0.0, float('inf')
+            for origin, direction, low, high in ((x, dx, ox, ox + ow), (y, dy, oy, oy + oh)):
+                if direction == 0:
+                    if not low <= origin <= high:
+                        t_near, t_far = 1.0, 0.0
+                        break
+                    continue
+                t1 = (low - origin) / direction
+                t2 = (high - origin) / direction
+                t_near = max(t_near, min(t1, t2))
+                t_far = min(t_far, max(t1, t2))
+            if t_near <= t_far:
+                hits.append(t_near)
+        
+        return max(0.0, min(hits)) if hits else float('inf')
+    
+    def sensor_distance(self, mount_angle=0.0):
+        """True range in cm seen by a sensor facing mount_angle off the robot heading"""
+        x, y, heading = self.pose()
+        return self.raycast(x, y, heading + mount_angle) * self.CM_PER_PIXEL
+
+class SimulatedPWM:
+    """Stand-in for RPi.GPIO.PWM"""
+    def __init__(self, gpio, pin, frequency):
+        self.gpio = gpio
+        self.pin = pin
+        self.frequency = frequency
+    
+    def start(self, duty):
+        self.gpio.set_duty(self.pin, duty)
+    
+    def ChangeDutyCycle(self, duty):
+        self.gpio.set_duty(self.pin, duty)
+    
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+    
+    def stop(self):
+        self.gpio.set_duty(self.pin, 0)
+
+class SimulatedGPIO:
+    """Drop-in replacement for the RPi.GPIO module backed by a SimulatedWorld
+    
+    Motor pin levels and PWM duty cycles drive the virtual robot. A trigger
+    pulse on an HC-SR04 trigger pin schedules an echo pulse whose start delay
+    and width follow the real sensor's timing for the simulated range in the
+    direction that sensor faces, with measurement noise and occasional lost
+    echoes; like the real sensor, one that hears nothing holds its echo pin
+    high until it gives up after ECHO_TIMEOUT. input() on the echo pin
+    follows that schedule exactly, and edge
+    callbacks are fired from a helper thread at the scheduled times, so both
+    ranging paths work unchanged.
+    
+    Sensors facing within CROSSTALK_ANGLE of each other hear each other's
+    bursts: if another sensor's echo arrives while a sensor is listening, its
+    echo pulse ends early and it reports the wrong, shorter range.
+    """
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+    
+    SPEED_OF_SOUND = 34300   # cm/s
+    ECHO_DELAY = 0.0005      # burst transmission before the echo pin rises
+    MAX_RANGE = 400.0        # cm, no echo beyond this
+    NOISE = 0.3              # cm standard deviation
+    DROPOUT = 0.02           # probability of a lost echo
+    ECHO_TIMEOUT = 0.038     # the sensor gives up listening after this
+    CROSSTALK_ANGLE = 100.0  # degrees, sensors facing closer than this hear each other
+    
+    def __init__(self, world=None, motor_pins=(17, 18, 22, 23), sensors=((24, 25, 0.0),), seed=None):
+        self.world = world or SimulatedWorld()
+        self.left_forward, self.left_backward, self.right_forward, self.right_backward = motor_pins
+        # trigger pin -> (echo pin, mount angle in degrees off the robot heading)
+        self.sensors = {trigger: (echo, angle) for trigger, echo, angle in sensors}
+        self.random = random.Random(seed)
+        
+        self.levels = {}
+        self.duties = {}
+        self.callbacks = {}  # pin -> [(edge, callback)]
+        self.echo_windows = {}  # echo pin -> perf_counter() interval the pin is high
+        self.listening = {}     # echo pin -> (angle, listen start, listen end, own echo arrival)
+        self.lock = threading.Lock()
+        
+        self.echo_condition = threading.Condition()
+        self.pending_edges = []  # heap of (perf_counter() time, sequence, pin, edge)
+        self.edge_sequence = 0
+        self.echo_thread = threading.Thread(target=self.echo_loop)
+        self.echo_thread.daemon = True
+        self.echo_thread.start()
+    
+    def setmode(self, mode):
+        pass
+    
+    def setwarnings(self, flag):
+        pass
+    
+    def setup(self, pin, direction, **kwargs):
+        with self.lock:
+            self.levels.setdefault(pin, self.LOW)
+    
+    def output(self, pin, value):
+        with self.lock:
+            previous = self.levels.get(pin, self.LOW)
+            self.levels[pin] = value
+        
+        if pin in self.sensors:
+            if previous == self.HIGH and value == self.LOW:
+                self.schedule_echo(*self.sensors[pin])
+        elif pin not in self.duties:
+            self.update_motors()
+    
+    def input(self, pin):
+        if pin in self.echo_windows:
+            start, end = self.echo_windows[pin]
+            return self.HIGH if start <= time.perf_counter() < end else self.LOW
+        return self.levels.get(pin, self.LOW)
+    
+    def PWM(self, pin, frequency):
+        self.duties[pin] = 0.0
+        return SimulatedPWM(self, pin, frequency)
+    
+    def set_duty(self, pin, duty):
+        self.duties[pin] = duty
+        self.update_motors()
+    
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        with self.lock:
+            self.callbacks[pin] = [(edge, callback)] if callback else []
+    
+    def add_event_callback(self, pin, callback):
+        with self.lock:
+            self.callbacks.setdefault(pin, []).append((self.BOTH, callback))
+    
+    def remove_event_detect(self, pin):
+        with self.lock:
+            self.callbacks.pop(pin, None)
+    
+    def cleanup(self, *pins):
+        with self.lock:
+            self.callbacks.clear()
+        self.world.set_wheels(0.0, 0.0)
+    
+    def drive_level(self, pin):
+        """Effective drive of a motor pin in 0..1 from PWM duty or digital level"""
+        if pin in self.duties:
+            return self.duties[pin] / 100.0
+        return 1.0 if self.levels.get(pin) == self.HIGH else 0.0
+    
+    def update_motors(self):
+        left = self.drive_level(self.left_forward) - self.drive_level(self.left_backward)
+        right = self.drive_level(self.right_forward) - self.drive_level(self.right_backward)
+        self.world.set_wheels(left, right)
+    
+    def schedule_echo(self, echo_pin, angle):
+        """Work out the echo pulse for the current pose after a trigger pulse"""
+        now = time.perf_counter()
+        start = now + self.ECHO_DELAY
+        listen_end = start + self.ECHO_TIMEOUT
+        
+        distance = self.world.sensor_distance(angle)
+        arrival = None  # when our own burst comes back
+        if distance <= self.MAX_RANGE and self.random.random() >= self.DROPOUT:
+            distance = max(2.0, distance + self.random.gauss(0.0, self.NOISE))
+            arrival = start + 2 * distance / self.SPEED_OF_SOUND
+        
+        with self.lock:
+            end = arrival
+            for other_pin, (other_angle, other_start, other_end, other_arrival) in list(self.listening.items()):
+                if other_pin == echo_pin or other_end <= now:
+                    continue
+                if angle_difference(angle, other_angle) >= self.CROSSTALK_ANGLE:
+                    continue
+                # Their echo ends our pulse early...
+                if other_arrival is not None and start < other_arrival < (end or listen_end):
+                    end = other_arrival
+                # ...and ours ends theirs
+                window = self.echo_windows.get(other_pin)
+                if arrival is not None and window is not None and window[0] == other_start < arrival < window[1]:
+                    self.echo_windows[other_pin] = (self.echo_windows[other_pin][0], arrival)
+                    self.push_edge(arrival, other_pin, self.FALLING)
+            
+            self.listening[echo_pin] = (angle, start, listen_end, arrival)
+            if end is None:
+                end = listen_end  # nothing heard, the pin stays high until the sensor gives up
+            self.echo_windows[echo_pin] = (start, end)
+            self.push_edge(start, echo_pin, self.RISING)
+            self.push_edge(end, echo_pin, self.FALLING)
+    
+    def push_edge(self, when, pin, edge):
+        with self.echo_condition:
+            self.edge_sequence += 1
+            heapq.heappush(self.pending_edges, (when, self.edge_sequence, pin, edge))
+            self.echo_condition.notify()
+    
+    def echo_loop(self):
+        """Fire echo pin edge callbacks at the scheduled times"""
+        while True:
+            with self.echo_condition:
+                while not self.pending_edges:
+                    self.echo_condition.wait()
+                when, _, pin, edge = self.pending_edges[0]
+                delay = when - time.perf_counter()
+                if delay > 0:
+                    # An earlier edge may be pushed meanwhile
+                    self.echo_condition.wait(delay)
+                    continue
+                heapq.heappop(self.pending_edges)
+            with self.lock:
+                callbacks = list(self.callbacks.get(pin, ()))
+            for wanted, callback in callbacks:
+                if wanted in (edge, self.BOTH):
+                    callback(pin)
+
+def default_gpio_backend(sensors=None):
+    """RPi.GPIO on a Pi, the simulator anywhere else
+    
+    sensors are the robot's (name, trigger pin, echo pin, angle) ultrasonic
+    sensors, the simulator answers pings on those pins.
+    """
+    if RPiGPIO is not None:
+        return RPiGPIO
+    log.warning("RPi.GPIO not available, using the simulated robot")
+    if sensors is None:
+        return SimulatedGPIO()
+    return SimulatedGPIO(sensors=[(trigger, echo, angle) for _, trigger, echo, angle in sensors])
+
+class DistanceFilter:
+    """Filters raw HC-SR04 readings over a ring buffer of recent samples
+    
+    Each new reading goes into a fixed-size buffer; 0.0 (no echo) and
+    out-of-range readings are stored as missing. The valid samples are then
+    processed as a batch: samples further than outlier_k robust standard
+    deviations (scaled MAD) from the median are rejected, and the inliers
+    are smoothed with the configured method:
+    
+    - 'median': median of the inliers
+    - 'ema': exponentially weighted mean, newest sample weighted by ema_alpha
+    - 'kalman': 1-D constant-position Kalman filter over accepted readings
+    - 'none': latest valid reading, outliers are still rejected
+    
+    confidence is the fraction of the window that holds valid inliers. With
+    no valid sample in the window the filtered distance is 0.0, the same
+    "nothing in range" value the raw readings use.
+    """
+    METHODS = ('median', 'ema', 'kalman', 'none')
+    MAX_RANGE = 400.0   # cm, the sensor's rated range
+    MIN_SPREAD = 1.0    # cm, floor for the outlier scale so steady readings aren't all rejected
+    
+    def __init__(self, window=5, method='median', outlier_k=3.0, ema_alpha=0.5,
+                 process_noise=4.0, measurement_noise=4.0):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown filter method: {method}")
+        self.window = max(1, int(window))
+        self.method = method
+        self.outlier_k = outlier_k
+        self.ema_alpha = ema_alpha
+        self.process_noise = process_noise          # cm^2 added per reading
+        self.measurement_noise = measurement_noise  # cm^2
+        self.lock = threading.Lock()
+        self.samples = np.full(self.window, np.nan) if np is not None else [math.nan] * self.window
+        self.next = 0  # ring buffer slot for the next sample
+        self.kalman = None  # (estimate, variance)
+        self.raw = 0.0
+        self.filtered = 0.0
+        self.confidence = 0.0
+    
+    def add(self, raw):
+        """Add a raw reading, returns the new filtered distance"""
+        valid = 0.0 < raw <= self.MAX_RANGE
+        with self.lock:
+            self.samples[self.next] = raw if valid else math.nan
+            self.next = (self.next + 1) % self.window
+            if np is not None:
+                inliers = self.inliers_numpy()
+            else:
+                inliers = self.inliers_python()
+            
+            # Kalman filter only takes the new reading, and only if it was accepted
+            latest_accepted = valid and any(value == raw for value in inliers[-1:])
+            self.raw = raw
+            self.filtered = round(self.smooth(inliers, raw if latest_accepted else None), 2)
+            self.confidence = round(len(inliers) / self.window, 2)
+            return self.filtered
+    
+    def reading(self):
+        """(raw, filtered, confidence) of the latest reading"""
+        with self.lock:
+            return self.raw, self.filtered, self.confidence
+    
+    def inliers_numpy(self):
+        # Oldest to newest so the last inlier is the most recent sample
+        ordered = np.roll(self.samples, -self.next)
+        values = ordered[~np.isnan(ordered)]
+        if values.size == 0:
+            return values
+        reference = np.append(values, self.prior(len(values)))
+        median = np.median(reference)
+        spread = max(1.4826 * np.median(np.abs(reference - median)), self.MIN_SPREAD)
+        return values[np.abs(values - median) <= self.outlier_k * spread]
+    
+    def inliers_python(self):
+        ordered = self.samples[self.next:] + self.samples[:self.next]
+        values = [value for value in ordered if not math.isnan(value)]
+        if not values:
+            return values
+        reference = values + self.prior(len(values))
+        median = statistics.median(reference)
+        spread = max(1.4826 * statistics.median(abs(value - median) for value in reference), self.MIN_SPREAD)
+        return [value for value in values if abs(value - median) <= self.outlier_k * spread]
+    
+    def prior(self, count):
+        """Previous estimate as an extra reference when too few samples can outvote a spike"""
+        return [self.filtered] if count < 3 and self.filtered > 0 else []
+    
+    def smooth(self, inliers, accepted):
+        # Caller holds self.lock
+        if len(inliers) == 0:
+            self.kalman = None
+            return 0.0
+        
+        if self.method == 'median':
+            return float(np.median(inliers)) if np is not None else statistics.median(inliers)
+        
+        if self.method == 'ema':
+            # Weight alpha * (1 - alpha)^age, normalized over the samples present
+            if np is not None:
+                weights = self.ema_alpha * (1 - self.ema_alpha) ** np.arange(len(inliers) - 1, -1, -1)
+                return float(np.dot(weights, inliers) / weights.sum())
+            ages = range(len(inliers) - 1, -1, -1)
+            weights = [self.ema_alpha * (1 - self.ema_alpha) ** age for age in ages]
+            return sum(w * v for w, v in zip(weights, inliers)) / sum(weights)
+        
+        if self.method == 'kalman':
+            if self.kalman is None:
+                estimate, variance = float(inliers[-1]), self.measurement_noise
+            else:
+                estimate, variance = self.kalman
+                variance += self.process_noise
+                if accepted is not None:
+                    gain = variance / (variance + self.measurement_noise)
+                    estimate += gain * (accepted - estimate)
+                    variance *= 1 - gain
+            self.kalman = (estimate, variance)
+            return estimate
+        
+        return float(inliers[-1])
+
+class RangingSensor:
+    """One HC-SR04 of the ranging array, with its filter and latest reading"""
+    def __init__(self, name, trigger_pin, echo_pin, angle=0.0, distance_filter=None):
+        self.name = name
+        self.trigger_pin = trigger_pin
+        self.echo_pin = echo_pin
+        self.angle = angle  # degrees off the robot heading, clockwise positive
+        self.filter = distance_filter if distance_filter is not None else DistanceFilter()
+        self.distance = 0.0       # latest raw reading, 0.0 for a miss
+        self.reading_time = None  # time.monotonic() of the latest reading
+        
+        # Edge-ranging state for the ping in flight
+        self.echo_start = None
+        self.expect_rising = False
+        self.echo_done = threading.Event()
+        self.echo_deadline = 0.0  # perf_counter() after which edges belong to no ping
+        # Edges a timed out ping still owes, the sensor ignores triggers until they are in
+        self.stale_edges = 0
+        self.stale_done = threading.Event()
+        self.busy_until = 0.0     # perf_counter() to give up waiting for them
+    
+    def record(self, distance):
+        """Store a raw reading and pass it through the filter"""
+        self.distance = distance
+        self.reading_time = time.monotonic()
+        self.filter.add(distance)
+    
+    def reading(self):
+        """Latest filtered reading as published in sensor data"""
+        raw, distance, confidence = self.filter.reading()
+        return {
+            'name': self.name,
+            'angle': self.angle,
+            'distance': distance,
+            'raw_distance': raw,
+            'confidence': confidence
+        }
+
+def parse_sensor_spec(spec):
+    """Parse a NAME:TRIGGER:ECHO[:ANGLE] sensor description from the command line"""
+    parts = spec.split(':')
+    if len(parts) not in (3, 4):
+        raise argparse.ArgumentTypeError(f"expected NAME:TRIGGER:ECHO[:ANGLE], got {spec!r}")
+    try:
+        return parts[0], int(parts[1]), int(parts[2]), float(parts[3]) if len(parts) == 4 else 0.0
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"pins must be integers and the angle a number: {spec!r}")
+
+def plan_ranging_slots(sensors, separation):
+    """Group sensors into slots whose members face at least separation degrees apart"""
+    slots = []
+    for sensor in sensors:
+        for slot in slots:
+            if all(angle_difference(sensor.angle, other.angle) >= separation for other in slot):
+                slot.append(sensor)
+                break
+        else:
+            slots.append([sensor])
+    return slots
+
+class UltrasonicRanger:
+    """Continuous ranging over an array of HC-SR04s driven by GPIO edge callbacks
+    
+    Sensors that face each other's beams hear each other's bursts, so they
+    are grouped into firing slots: sensors in one slot face at least
+    SEPARATION degrees apart and are triggered together, and the slots fire
+    one after another. The next slot fires as soon as every echo of the
+    current one is in (or timed out) plus SETTLE_TIME for reverberation to die
+    down, so the array runs as fast as crosstalk allows; rate caps how often
+    each sensor fires, 0 for no cap. Rising and falling echo edges are
+    timestamped in the GPIO callback, so readers get the most recent
+    distance without touching the sensors or busy-waiting on an echo pin.
+    """
+    SPEED_OF_SOUND = 34300  # cm/s
+    ECHO_TIMEOUT = 0.03     # no echo within ~5 m of round trip counts as a miss
+    SETTLE_TIME = 0.005     # seconds between slots for stray reflections to fade
+    MAX_PULSE = 0.06        # a sensor that hears nothing holds its echo pin high ~38 ms
+    SEPARATION = 120.0      # degrees between sensors allowed to fire together
+    
+    def __init__(self, gpio, sensors, rate=10.0):
+        self.gpio = gpio
+        self.sensors = list(sensors)
+        self.by_echo_pin = {sensor.echo_pin: sensor for sensor in self.sensors}
+        self.rate = rate
+        self.slots = plan_ranging_slots(self.sensors, self.SEPARATION)
+        self.running = False
+        self.thread = None
+    
+    def start(self):
+        """Register the echo callbacks and start pinging"""
+        for sensor in self.sensors:
+            self.gpio.add_event_detect(sensor.echo_pin, self.gpio.BOTH, callback=self.on_echo_edge)
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        """Stop pinging and release the echo callbacks"""
+        self.running = False
+        for sensor in self.sensors:
+            sensor.echo_done.set()
+            try:
+                self.gpio.remove_event_detect(sensor.echo_pin)
+            except Exception:
+                pass
+    
+    def on_echo_edge(self, channel):
+        """GPIO callback: timestamp the echo pulse edges"""
+        now = time.perf_counter()
+        sensor = self.by_echo_pin.get(channel)
+        if sensor is None:
+            return
+        if sensor.stale_edges:
+            # The late end of a pulse held up by a missed echo
+            sensor.stale_edges -= 1
+            if not sensor.stale_edges:
+                sensor.stale_done.set()
+            return
+        if now > sensor.echo_deadline:
+            return
+        # Edges are matched by order rather than by reading the pin, a short
+        # echo may already be over by the time the callback thread runs
+        if sensor.expect_rising:
+            sensor.echo_start = now
+            sensor.expect_rising = False
+        elif sensor.echo_start is not None:
+            pulse = now - sensor.echo_start
+            sensor.echo_start = None
+            sensor.record(round((pulse * self.SPEED_OF_SOUND) / 2, 2))
+            sensor.echo_done.set()
+    
+    def run(self):
+        """Fire the slots in turn, at most rate rounds per second"""
+        period = 1.0 / self.rate if self.rate > 0 else 0.0
+        next_round = time.monotonic()
+        while self.running:
+            for slot in self.slots:
+                if not self.running:
+                    return
+                self.fire(slot)
+                time.sleep(self.SETTLE_TIME)
+            
+            next_round += period
+            delay = next_round - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_round = time.monotonic()
+    
+    def fire(self, slot):
+        """Trigger every sensor of a slot together and wait for their echoes"""
+        # A sensor still holding up the pulse of a missed echo ignores triggers
+        for sensor in slot:
+            if sensor.stale_edges:
+                sensor.stale_done.wait(max(0.0, sensor.busy_until - time.perf_counter()))
+                sensor.stale_edges = 0
+        deadline = time.perf_counter() + self.ECHO_TIMEOUT
+        for sensor in slot:
+            sensor.echo_done.clear()
+            sensor.echo_start = None
+            sensor.expect_rising = True
+            sensor.echo_deadline = deadline
+        for sensor in slot:
+            self.gpio.output(sensor.trigger_pin, self.gpio.HIGH)
+        time.sleep(0.00001)
+        for sensor in slot:
+            self.gpio.output(sensor.trigger_pin, self.gpio.LOW)
+        triggered = time.perf_counter()
+        
+        for sensor in slot:
+            if not sensor.echo_done.wait(max(0.0, deadline - time.perf_counter())) and self.running:
+                # Same result the polling path reports for a missing echo. The
+                # pulse may still be high, its falling edge is not a reading
+                sensor.stale_done.clear()
+                sensor.stale_edges = 1 if sensor.echo_start is not None else 2
+                sensor.expect_rising = False
+                sensor.echo_start = None
+                sensor.busy_until = triggered + self.MAX_PULSE
+                metrics.counter('edubot_distance_timeouts_total', "Pings without an echo, reported as 0.0",
+                                sensor=sensor.name).inc()
+                sensor.record(0.0)
+
+class AutonomousNavigator:
+    """Closed-loop navigation to a map target, running on the robot itself
+    
+    The control loop reads the latest distance at CONTROL_RATE and refreshes
+    short motion pulses, so obstacle reactions never wait on the network.
+    The pose is dead-reckoned in GUI map pixels (heading 0 is "forward" on the
+    map, clockwise positive) from the motions actually commanded, using the
+    robot's calibrated FORWARD_SPEED and TURN_RATE. Progress is handed to
+    on_update every UPDATE_INTERVAL seconds.
+    """
+    CONTROL_RATE = 20.0        # control loop iterations per second
+    UPDATE_INTERVAL = 0.25     # seconds between progress updates
+    PULSE = 0.15               # motion pulse length, outlives a few loop iterations
+    OBSTACLE_DISTANCE = 20.0   # cm, nearer readings count as an obstacle
+    TARGET_TOLERANCE = 10.0    # map px, same threshold as the GUI's "Target reached"
+    HEADING_TOLERANCE = 15.0   # degrees off the target bearing before turning
+    AVOID_TURN_TIME = 0.4      # seconds turning away from an obstacle
+    AVOID_FORWARD_TIME = 0.6   # seconds driving past it before seeking again
+    
+    def __init__(self, robot, read_distance, read_sensors, on_update):
+        self.robot = robot
+        self.read_distance = read_distance
+        self.read_sensors = read_sensors
+        self.on_update = on_update
+        self.lock = threading.Lock()
+        self.active = False
+        self.thread = None
+        self.generation = 0  # bumped per control loop started, older loops exit
+        
+        self.x, self.y = 107.0, 107.0  # GUI start position (robot centre)
+        self.heading = 0.0
+        self.target = None
+        self.state = 'idle'
+        self.action = None
+        self.avoid_plan = []  # remaining (action, end time) avoidance steps
+        self.obstacle_seen = False
+    
+    def start(self, target_x, target_y, x=None, y=None, heading=None):
+        """Start (or retarget) navigation, optionally resetting the pose estimate"""
+        with self.lock:
+            if x is not None and y is not None:
+                self.x, self.y = float(x), float(y)
+            if heading is not None:
+                self.heading = float(heading) % 360
+            self.target = (float(target_x), float(target_y))
+            self.avoid_plan = []
+            self.state = 'seeking'
+            if self.active:
+                return
+            # A loop stopped a moment ago may not have woken up yet, it
+            # notices the new generation and exits instead of resuming
+            self.active = True
+            self.generation += 1
+            self.thread = threading.Thread(target=self.run, args=(self.generation,))
+            self.thread.daemon = True
+            self.thread.start()
+    
+    def stop(self, state='stopped'):
+        """Stop the control loop, motors are left to the caller"""
+        with self.lock:
+            was_active = self.active
+            self.active = False
+            self.action = None
+            if was_active:
+                self.state = state
+        if was_active:
+            self.publish()
+        return was_active
+    
+    def integrate(self, dt):
+        """Advance the dead-reckoned pose by the motion commanded during dt"""
+        if self.action == 'forward' or self.action == 'backward':
+            step = self.robot.FORWARD_SPEED * dt * (1 if self.action == 'forward' else -1)
+            self.x += step * math.sin(math.radians(self.heading))
+            self.y -= step * math.cos(math.radians(self.heading))
+        elif self.action == 'right':
+            self.heading = (self.heading + self.robot.TURN_RATE * dt) % 360
+        elif self.action == 'left':
+            self.heading = (self.heading - self.robot.TURN_RATE * dt) % 360
+    
+    def decide(self, now, obstacle):
+        """Next motion for the current pose and reading, None once the target is reached"""
+        # Obstacle ahead: turn away, then drive past it
+        if obstacle and self.action != 'right':
+            self.avoid_plan = [('right', now + self.AVOID_TURN_TIME),
+                               ('forward', now + self.AVOID_TURN_TIME + self.AVOID_FORWARD_TIME)]
+        while self.avoid_plan and self.avoid_plan[0][1] <= now:
+            self.avoid_plan.pop(0)
+        if self.avoid_plan:
+            self.state = 'avoiding'
+            return self.avoid_plan[0][0]
+        
+        dx = self.target[0] - self.x
+        dy = self.target[1] - self.y
+        if math.hypot(dx, dy) < self.TARGET_TOLERANCE:
+            return None
+        
+        bearing = math.degrees(math.atan2(dx, -dy))
+        error = (bearing - self.heading + 180) % 360 - 180
+        if abs(error) > self.HEADING_TOLERANCE:
+            self.state = 'turning'
+            return 'right' if error > 0 else 'left'
+        self.state = 'driving'
+        return 'forward'
+    
+    def run(self, generation):
+        """Control loop, runs until stopped or superseded by a newer generation"""
+        period = 1.0 / self.CONTROL_RATE
+        last = time.monotonic()
+        next_update = last
+        while True:
+            now = time.monotonic()
+            distance = self.read_distance()
+            # 0.0 means no echo, i.e. nothing within range
+            obstacle = 0.0 < distance < self.OBSTACLE_DISTANCE
+            
+            with self.lock:
+                if not self.active or generation != self.generation:
+                    return
+                self.integrate(now - last)
+                last = now
+                if obstacle:
+                    self.obstacle_seen = True
+                action = self.decide(now, obstacle)
+                if action is None:
+                    self.active = False
+                    self.action = None
+                    self.state = 'reached'
+                    self.robot.stop_motors()
+                else:
+                    # Submitted under the lock so stop() can't be overtaken by a late pulse
+                    self.robot.motion.submit(action, self.PULSE)
+                    self.action = action
+            
+            if action is None or now >= next_update:
+                self.publish()
+                next_update = now + self.UPDATE_INTERVAL
+            if action is None:
+                return
+            time.sleep(period)
+    
+    def publish(self):
+        """Hand a progress snapshot to on_update"""
+        with self.lock:
+            update = {
+                'state': self.state,
+                'position': {'x': round(self.x, 1), 'y': round(self.y, 1)},
+                'heading': round(self.heading, 1),
+                'obstacle_detected': self.obstacle_seen
+            }
+            if self.target is not None:
+                update['target'] = {'x': self.target[0], 'y': self.target[1]}
+                update['distance_to_target'] = round(
+                    math.hypot(self.target[0] - self.x, self.target[1] - self.y), 1)
+            self.obstacle_seen = False
+        update['sensor_data'] = self.read_sensors()
+        try:
+            self.on_update(update)
+        except Exception as e:
+            log.error("Autonomous update error: %s", e)
+
+class RealEduBot:
+    def __init__(self, ranging_rate=10.0, edge_ranging=True, gpio=None, sensors=None, filter_factory=None):
+        log.info("Initializing RealEduBot...")
+        # Ultrasonic sensors as (name, trigger pin, echo pin, mount angle in degrees
+        # clockwise from straight ahead). The first one is the primary sensor that
+        # 'distance' reports, adjust these according to your connections.
+        sensors = sensors or [('front', 24, 25, 0.0)]
+        
+        # RPi.GPIO or anything with the same interface, e.g. SimulatedGPIO
+        self.gpio = gpio if gpio is not None else default_gpio_backend(sensors)
         
         # Motor pins - adjust these according to your connections
         self.MOTOR_LEFT_FORWARD = 17
@@ -23,18 +1464,49 @@ class RealEduBot:
         self.MOTOR_RIGHT_FORWARD = 22
         self.MOTOR_RIGHT_BACKWARD = 23
         
-        # Sensor pins (optional)
-        self.TRIGGER_PIN = 24
-        self.ECHO_PIN = 25
+        # Every raw distance reading passes through its sensor's filter
+        make_filter = filter_factory or DistanceFilter
+        self.sensors = [RangingSensor(name, trigger_pin, echo_pin, angle, make_filter())
+                        for name, trigger_pin, echo_pin, angle in sensors]
+        
+        # Software PWM on every motor pin, duty cycle sets the wheel speed
+        self.PWM_FREQUENCY = 100  # Hz
+        self.pwm = {}  # pin -> backend PWM object, empty when only digital output works
+        
+        # (left, right) wheel velocities in -1..1 for each named motion
+        self.MOTION_VELOCITIES = {
+            'forward': (1.0, 1.0),
+            'backward': (-1.0, -1.0),
+            'left': (-1.0, 1.0),
+            'right': (1.0, -1.0),
+        }
+        
+        # Calibration at full speed, in GUI map units - measure these per robot
+        self.FORWARD_SPEED = 40.0  # map px per second
+        self.TURN_RATE = 180.0     # degrees per second turning on the spot
         
         self.setup_gpio()
-        print("GPIO setup completed")
+        log.info("GPIO setup completed")
+        
+        self.motion = MotionScheduler(self)
+        
+        # Prefer interrupt-driven ranging, fall back to polling get_distance
+        self.ranger = None
+        if edge_ranging:
+            try:
+                self.ranger = UltrasonicRanger(self.gpio, self.sensors, ranging_rate)
+                self.ranger.start()
+                log.info("Edge-triggered ranging at %s Hz, %d sensor(s) in %d slot(s)",
+                         ranging_rate or 'max', len(self.sensors), len(self.ranger.slots))
+            except Exception as e:
+                log.warning("Edge ranging unavailable, polling the sensor instead: %s", e)
+                self.ranger = None
         
     def setup_gpio(self):
         """Setup GPIO pins"""
         try:
-            GPIO.setmode(GPIO.BCM)
-            GPIO.setwarnings(True)
+            self.gpio.setmode(self.gpio.BCM)
+            self.gpio.setwarnings(True)
             
             # Setup motor pins
             motor_pins = [
@@ -43,141 +1515,635 @@ class RealEduBot:
             ]
             
             for pin in motor_pins:
-                GPIO.setup(pin, GPIO.OUT)
-                GPIO.output(pin, GPIO.LOW)
+                self.gpio.setup(pin, self.gpio.OUT)
+                self.gpio.output(pin, self.gpio.LOW)
+            
+            try:
+                for pin in motor_pins:
+                    self.pwm[pin] = self.gpio.PWM(pin, self.PWM_FREQUENCY)
+                    self.pwm[pin].start(0)
+            except Exception as e:
+                log.warning("PWM unavailable, motors run at full speed only: %s", e)
+                for pwm in self.pwm.values():
+                    pwm.stop()
+                self.pwm = {}
             
-            # Setup distance sensor (optional)
-            GPIO.setup(self.TRIGGER_PIN, GPIO.OUT)
-            GPIO.setup(self.ECHO_PIN, GPIO.IN)
-            GPIO.output(self.TRIGGER_PIN, GPIO.LOW)
+            # Setup distance sensors (optional)
+            for sensor in self.sensors:
+                self.gpio.setup(sensor.trigger_pin, self.gpio.OUT)
+                self.gpio.setup(sensor.echo_pin, self.gpio.IN)
+                self.gpio.output(sensor.trigger_pin, self.gpio.LOW)
             
-            print("Motor and sensor pins initialized")
+            log.info("Motor and sensor pins initialized")
             
         except Exception as e:
-            print(f"GPIO setup error: {e}")
+            log.error("GPIO setup error: %s", e)
     
-    def move_forward(self, duration=0.5):
+    def move_forward(self, duration=0.5, queue=False, speed=1.0):
         """Move forward"""
         try:
-            print("Moving forward")
-            self.stop_motors()
-            GPIO.output(self.MOTOR_LEFT_FORWARD, GPIO.HIGH)
-            GPIO.output(self.MOTOR_RIGHT_FORWARD, GPIO.HIGH)
-            time.sleep(duration)
-            self.stop_motors()
+            log.debug("Moving forward", extra={'msg_type': 'motion'})
+            return self.motion.submit(self.scaled_motion('forward', speed), duration, queue)
         except Exception as e:
-            print(f"Move forward error: {e}")
+            log.error("Move forward error: %s", e)
     
-    def move_backward(self, duration=0.5):
+    def move_backward(self, duration=0.5, queue=False, speed=1.0):
         """Move backward"""
         try:
-            print("Moving backward")
-            self.stop_motors()
-            GPIO.output(self.MOTOR_LEFT_BACKWARD, GPIO.HIGH)
-            GPIO.output(self.MOTOR_RIGHT_BACKWARD, GPIO.HIGH)
-            time.sleep(duration)
-            self.stop_motors()
+            log.debug("Moving backward", extra={'msg_type': 'motion'})
+            return self.motion.submit(self.scaled_motion('backward', speed), duration, queue)
         except Exception as e:
-            print(f"Move backward error: {e}")
+            log.error("Move backward error: %s", e)
     
-    def turn_left(self, duration=0.3):
+    def turn_left(self, duration=0.3, queue=False, speed=1.0):
         """Turn left"""
         try:
-            print("Turning left")
-            self.stop_motors()
-            GPIO.output(self.MOTOR_RIGHT_FORWARD, GPIO.HIGH)
-            GPIO.output(self.MOTOR_LEFT_BACKWARD, GPIO.HIGH)
-            time.sleep(duration)
-            self.stop_motors()
+            log.debug("Turning left", extra={'msg_type': 'motion'})
+            return self.motion.submit(self.scaled_motion('left', speed), duration, queue)
         except Exception as e:
-            print(f"Turn left error: {e}")
+            log.error("Turn left error: %s", e)
     
-    def turn_right(self, duration=0.3):
+    def turn_right(self, duration=0.3, queue=False, speed=1.0):
         """Turn right"""
         try:
-            print("Turning right")
-            self.stop_motors()
-            GPIO.output(self.MOTOR_LEFT_FORWARD, GPIO.HIGH)
-            GPIO.output(self.MOTOR_RIGHT_BACKWARD, GPIO.HIGH)
-            time.sleep(duration)
-            self.stop_motors()
+            log.debug("Turning right", extra={'msg_type': 'motion'})
+            return self.motion.submit(self.scaled_motion('right', speed), duration, queue)
+        except Exception as e:
+            log.error("Turn right error: %s", e)
+    
+    def drive(self, left, right, timeout=0.5):
+        """Set wheel velocities (-1..1) until the next drive command or timeout"""
+        try:
+            return self.motion.submit((left, right), timeout)
         except Exception as e:
-            print(f"Turn right error: {e}")
+            log.error("Drive error: %s", e, extra={'msg_type': 'motor_error'})
+    
+    def scaled_motion(self, name, speed):
+        """Velocity pair for a named motion at a fraction of full speed"""
+        if speed >= 1.0:
+            return name
+        left, right = self.MOTION_VELOCITIES[name]
+        return (left * speed, right * speed)
     
     def stop_motors(self):
-        """Stop all motors"""
+        """Stop all motors, cancelling any running or queued move"""
         try:
-            pins = [
-                self.MOTOR_LEFT_FORWARD, self.MOTOR_LEFT_BACKWARD,
-                self.MOTOR_RIGHT_FORWARD, self.MOTOR_RIGHT_BACKWARD
-            ]
-            for pin in pins:
-                GPIO.output(pin, GPIO.LOW)
+            self.motion.stop()
         except Exception as e:
-            print(f"Stop motors error: {e}")
+            log.error("Stop motors error: %s", e)
+    
+    def apply_motion(self, action):
+        """Drive the motors for a motion name or (left, right) velocity pair, None stops"""
+        if action is None:
+            left, right = 0.0, 0.0
+        elif isinstance(action, str):
+            left, right = self.MOTION_VELOCITIES[action]
+        else:
+            left, right = action
+        self.set_velocity(left, right)
+    
+    def set_velocity(self, left, right):
+        """Set both wheel velocities in -1..1, sign gives the direction"""
+        try:
+            duties = {}
+            for velocity, forward_pin, backward_pin in (
+                (left, self.MOTOR_LEFT_FORWARD, self.MOTOR_LEFT_BACKWARD),
+                (right, self.MOTOR_RIGHT_FORWARD, self.MOTOR_RIGHT_BACKWARD)
+            ):
+                duty = min(abs(velocity), 1.0) * 100
+                duties[forward_pin] = duty if velocity > 0 else 0
+                duties[backward_pin] = duty if velocity < 0 else 0
+            
+            # Lower pins first so a direction change never drives both sides of a motor.
+            # Only duty cycles change, a running wheel is never stopped in between.
+            for pin, duty in sorted(duties.items(), key=lambda item: item[1]):
+                if pin in self.pwm:
+                    self.pwm[pin].ChangeDutyCycle(duty)
+                else:
+                    self.gpio.output(pin, self.gpio.HIGH if duty > 0 else self.gpio.LOW)
+        except Exception as e:
+            log.error("Motor output error: %s", e, extra={'msg_type': 'motor_error'})
     
     def get_distance(self):
-        """Measure distance using HC-SR04 sensor"""
+        """Latest filtered distance of the primary sensor in cm, 0.0 if nothing is in range"""
+        primary = self.sensors[0]
+        if self.ranger is None:
+            primary.record(self.measure_distance_polling(primary))
+        return primary.filter.reading()[1]
+    
+    def measure_distance_polling(self, sensor):
+        """Measure distance using HC-SR04 sensor by polling the echo pin"""
         try:
             # Ensure TRIG is low
-            GPIO.output(self.TRIGGER_PIN, GPIO.LOW)
-            time.sleep(0.1)
+            self.gpio.output(sensor.trigger_pin, self.gpio.LOW)
+            time.sleep(0.1)  # also lets the previous sensor's reflections fade
             
             # Send pulse
-            GPIO.output(self.TRIGGER_PIN, GPIO.HIGH)
+            self.gpio.output(sensor.trigger_pin, self.gpio.HIGH)
             time.sleep(0.00001)
-            GPIO.output(self.TRIGGER_PIN, GPIO.LOW)
+            self.gpio.output(sensor.trigger_pin, self.gpio.LOW)
+            
+            deadline = time.perf_counter() + 0.1  # timeout after 0.1 seconds
             
             # Wait for pulse start
-            start_time = time.time()
-            while GPIO.input(self.ECHO_PIN) == 0:
-                start_time = time.time()
-                if time.time() - start_time > 0.1:  # timeout after 0.1 seconds
+            start_time = time.perf_counter()
+            while self.gpio.input(sensor.echo_pin) == 0:
+                start_time = time.perf_counter()
+                if start_time > deadline:
+                    metrics.counter('edubot_distance_timeouts_total', "Pings without an echo, reported as 0.0",
+                                    sensor=sensor.name).inc()
                     return 0.0
             
             # Wait for pulse end
-            stop_time = time.time()
-            while GPIO.input(self.ECHO_PIN) == 1:
-                stop_time = time.time()
-                if time.time() - start_time > 0.1:  # timeout after 0.1 seconds
+            stop_time = time.perf_counter()
+            while self.gpio.input(sensor.echo_pin) == 1:
+                stop_time = time.perf_counter()
+                if stop_time > deadline:
+                    metrics.counter('edubot_distance_timeouts_total', "Pings without an echo, reported as 0.0",
+                                    sensor=sensor.name).inc()
                     return 0.0
             
-            # Calculate distance
+            # Calculate distance, a pulse this long is the sensor giving up
             time_elapsed = stop_time - start_time
+            if time_elapsed >= UltrasonicRanger.ECHO_TIMEOUT:
+                metrics.counter('edubot_distance_timeouts_total', "Pings without an echo, reported as 0.0",
+                                sensor=sensor.name).inc()
+                return 0.0
             distance = (time_elapsed * 34300) / 2
             return round(distance, 2)
             
         except Exception as e:
-            print(f"Distance sensor error: {e}")
+            log.error("Distance sensor error: %s", e, extra={'msg_type': 'sensor_error'})
             return 0.0
     
     def get_sensor_data(self):
         """Collect all sensor data"""
         try:
+            if self.ranger is None:
+                # One sensor after the other, never two pings in flight
+                for sensor in self.sensors:
+                    sensor.record(self.measure_distance_polling(sensor))
+            readings = [sensor.reading() for sensor in self.sensors]
             return {
-                'distance': self.get_distance(),
+                'distance': readings[0]['distance'],
+                'raw_distance': readings[0]['raw_distance'],
+                'confidence': readings[0]['confidence'],
+                'sensors': readings,
                 'temperature': 25.0,  # Can add temperature sensor later
                 'battery': 85,        # Simulate battery level
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': server_time(),
                 'status': 'active'
             }
         except Exception as e:
-            print(f"Sensor data error: {e}")
+            log.error("Sensor data error: %s", e, extra={'msg_type': 'sensor_error'})
             return {
                 'distance': 0.0,
+                'raw_distance': 0.0,
+                'confidence': 0.0,
+                'sensors': [],
                 'temperature': 25.0,
                 'battery': 85,
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': server_time(),
                 'status': 'error'
             }
 
+    def cleanup(self):
+        """Stop the motion timer and ranging, then release the GPIO pins"""
+        self.motion.shutdown()
+        if self.ranger is not None:
+            self.ranger.stop()
+        for pwm in self.pwm.values():
+            pwm.stop()
+        self.gpio.cleanup()
+
+class SensorSampler:
+    """Single owner of the sensor hardware, publishing timestamped snapshots
+    
+    A background thread samples the robot at a fixed interval and every
+    consumer reads the cached snapshot. If the snapshot is older than max_age
+    (sampler not started yet or stalled) the first reader refreshes it while
+    concurrent readers wait for that same result instead of pinging again.
+    Snapshots are shared between consumers and must not be modified.
+    """
+    def __init__(self, robot, interval=0.2, max_age=0.5, recorder=None):
+        self.robot = robot
+        self.interval = interval
+        self.max_age = max_age
+        self.recorder = recorder      # TelemetryRecorder receiving every reading
+        self.lock = threading.Lock()  # serializes hardware access
+        self.latest = (None, None)    # (time.monotonic() sampled, sensor data)
+        self.running = False
+        self.thread = None
+    
+    def start(self):
+        """Start the background sampling thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        self.running = False
+    
+    def run(self):
+        """Sample the hardware every interval"""
+        while self.running:
+            try:
+                self.sample()
+            except Exception as e:
+                log.error("Sensor sampling error: %s", e, extra={'msg_type': 'sensor_error'})
+            time.sleep(self.interval)
+    
+    def sample(self):
+        """Read the hardware and publish a new snapshot"""
+        with self.lock:
+            return self.refresh()
+    
+    def refresh(self):
+        # Caller holds self.lock
+        data = self.robot.get_sensor_data()
+        self.latest = (time.monotonic(), data)
+        if self.recorder is not None:
+            self.recorder.record_sensor(data)
+        return data
+    
+    def is_fresh(self, sampled_at):
+        return sampled_at is not None and time.monotonic() - sampled_at <= self.max_age
+    
+    def get(self):
+        """Latest snapshot no older than max_age"""
+        sampled_at, data = self.latest
+        if self.is_fresh(sampled_at):
+            return data
+        
+        with self.lock:
+            # Another reader may have refreshed it while we waited for the lock
+            sampled_at, data = self.latest
+            if self.is_fresh(sampled_at):
+                return data
+            return self.refresh()
+
+# Telemetry log: segments of fixed-size records behind a small header that
+# pairs the wall clock with the monotonic clock records are stamped with.
+# A record is (kind, timestamp, four values, code, detail):
+#   sensor:  distance, raw distance, temperature, battery;
+#            code = status index, detail = confidence percent
+#   command: command parameters; code = command index, detail = move direction
+TELEMETRY_MAGIC = b'EDUTLM\0\0'
+TELEMETRY_VERSION = 3
+TELEMETRY_HEADER = struct.Struct('!8sHHdd')
+TELEMETRY_RECORD = struct.Struct('!Bd4fBB')
+RECORD_SENSOR = 1
+RECORD_COMMAND = 2
+RECORD_COMMANDS = BINARY_COMMANDS
+MOVE_DIRECTIONS = ('forward', 'backward', 'left', 'right', 'stop')
+UNKNOWN_CODE = 255
+
+def encode_telemetry_record(kind, data, command=None):
+    """Pack a sensor reading or an executed command into one record"""
+    if kind == RECORD_SENSOR:
+        status = data.get('status')
+        return TELEMETRY_RECORD.pack(
+            RECORD_SENSOR, to_timestamp(data.get('timestamp')),
+            data.get('distance', 0.0), data.get('raw_distance', data.get('distance', 0.0)),
+            data.get('temperature', 0.0), data.get('battery', 0),
+            BINARY_SENSOR_STATUSES.index(status) if status in BINARY_SENSOR_STATUSES else UNKNOWN_CODE,
+            max(0, min(100, round(data.get('confidence', 1.0) * 100))))
+    
+    code = RECORD_COMMANDS.index(command) if command in RECORD_COMMANDS else UNKNOWN_CODE
+    detail = 0
+    values = (0.0, 0.0, 0.0, 0.0)
+    if command == 'move':
+        direction = data.get('direction', '')
+        detail = MOVE_DIRECTIONS.index(direction) if direction in MOVE_DIRECTIONS else UNKNOWN_CODE
+        values = (data.get('speed', 1.0), data.get('distance') or 0.0, 0.0, 0.0)
+    elif command == 'drive':
+        values = (data.get('left', 0.0), data.get('right', 0.0), data.get('timeout', 0.5), 0.0)
+    elif command == 'start_autonomous':
+        values = (data.get('target_x', 0.0), data.get('target_y', 0.0), 0.0, 0.0)
+    values = tuple(float(value) if isinstance(value, (int, float)) else 0.0 for value in values)
+    return TELEMETRY_RECORD.pack(RECORD_COMMAND, server_time(), *values, code, detail)
+
+def decode_telemetry_record(record):
+    """Inverse of encode_telemetry_record, None for an empty (unwritten) slot"""
+    kind, timestamp, a, b, c, d, code, detail = TELEMETRY_RECORD.unpack(record)
+    if kind == RECORD_SENSOR:
+        return {
+            'kind': 'sensor',
+            'timestamp': timestamp,
+            'data': {
+                'distance': round(a, 2),
+                'raw_distance': round(b, 2),
+                'confidence': detail / 100,
+                'temperature': round(c, 2),
+                'battery': int(d),
+                'timestamp': timestamp,
+                'status': BINARY_SENSOR_STATUSES[code] if code < len(BINARY_SENSOR_STATUSES) else 'error'
+            }
+        }
+    if kind == RECORD_COMMAND:
+        command = RECORD_COMMANDS[code] if code < len(RECORD_COMMANDS) else 'unknown'
+        data = {}
+        if command == 'move':
+            data = {'direction': MOVE_DIRECTIONS[detail] if detail < len(MOVE_DIRECTIONS) else 'unknown',
+                    'speed': round(a, 3), 'distance': round(b, 2)}
+        elif command == 'drive':
+            data = {'left': round(a, 3), 'right': round(b, 3), 'timeout': round(c, 3)}
+        elif command == 'start_autonomous':
+            data = {'target_x': round(a, 1), 'target_y': round(b, 1)}
+        return {'kind': 'command', 'timestamp': timestamp, 'command': command, 'data': data}
+    return None
+
+def telemetry_segments(prefix):
+    """(run, path) of every segment written under prefix, in recording order
+    
+    Each recorder run writes its own PREFIX.RRRR.NNNN.tlm series, so runs
+    never share a timeline and a missing file is never reused.
+    """
+    digits = '[0-9]' * 4
+    segments = []
+    for path in glob.glob(f'{glob.escape(prefix)}.{digits}.{digits}.tlm'):
+        run, index = path[len(prefix) + 1:-len('.tlm')].split('.')
+        segments.append((int(run), int(index), path))
+    return [(run, path) for run, index, path in sorted(segments)]
+
+def read_telemetry(prefix):
+    """Yield the decoded records of every segment written under prefix, in order
+    
+    Records carry the run they were recorded in. Segments of another
+    format version are skipped with a warning.
+    """
+    for run, path in telemetry_segments(prefix):
+        with open(path, 'rb') as f:
+            header = f.read(TELEMETRY_HEADER.size)
+            if len(header) < TELEMETRY_HEADER.size:
+                continue
+            magic, version, record_size, wall_anchor, clock_anchor = TELEMETRY_HEADER.unpack(header)
+            if magic != TELEMETRY_MAGIC:
+                raise ValueError(f"{path} is not a telemetry log")
+            if version != TELEMETRY_VERSION or record_size != TELEMETRY_RECORD.size:
+                log.warning("Skipping %s, telemetry version %s instead of %s", path, version, TELEMETRY_VERSION,
+                            extra={'msg_type': 'replay'})
+                continue
+            while True:
+                record = f.read(record_size)
+                if len(record) < record_size:
+                    break
+                decoded = decode_telemetry_record(record)
+                if decoded is None:
+                    break  # preallocated space that was never written
+                decoded['wall_time'] = wall_anchor + decoded['timestamp'] - clock_anchor
+                decoded['run'] = run
+                yield decoded
+
+class TelemetrySegment:
+    """One preallocated, memory-mapped log file"""
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.count = 0
+        self.file = open(path, 'x+b')  # never overwrite an earlier recording
+        size = TELEMETRY_HEADER.size + capacity * TELEMETRY_RECORD.size
+        try:
+            # Reserve the blocks now: a full disk is an OSError here rather
+            # than a SIGBUS on some later write through the map
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(self.file.fileno(), 0, size)
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), 0)
+        except OSError:
+            self.file.close()
+            os.remove(path)
+            raise
+        TELEMETRY_HEADER.pack_into(self.map, 0, TELEMETRY_MAGIC, TELEMETRY_VERSION, TELEMETRY_RECORD.size,
+                                   time.time(), server_time())
+    
+    def append(self, record):
+        offset = TELEMETRY_HEADER.size + self.count * TELEMETRY_RECORD.size
+        self.map[offset:offset + TELEMETRY_RECORD.size] = record
+        self.count += 1
+    
+    def close(self):
+        """Flush and trim the unused preallocated tail"""
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(TELEMETRY_HEADER.size + self.count * TELEMETRY_RECORD.size)
+        self.file.close()
+
+class TelemetryRecorder:
+    """Appends sensor readings and executed commands to a binary log
+    
+    Records are copied into memory-mapped segment files that are sized up
+    front, so appending is a memory write and never waits on the disk; the
+    kernel writes dirty pages back in the background. Once a segment is
+    half full the next one is created on a helper thread so the switch at
+    rollover is just a pointer swap; the full segment is flushed, trimmed
+    and closed on another helper thread.
+    """
+    SEGMENT_RECORDS = 65536  # about 1.8 MB per segment
+    RETRY_INTERVAL = 5.0     # seconds before creating a segment again after a failure
+    
+    def __init__(self, prefix, segment_records=SEGMENT_RECORDS):
+        self.prefix = prefix
+        self.segment_records = segment_records
+        self.lock = threading.Lock()
+        # A new run after every earlier one under this prefix
+        self.run = max((run for run, path in telemetry_segments(prefix)), default=-1) + 1
+        self.index = 0
+        self.segment = TelemetrySegment(self.allocate_path(), self.segment_records)
+        self.next_segment = None
+        self.preparing = False
+        self.retry_at = 0.0  # time.monotonic() before which no segment is created
+        self.retiring = []  # helper threads closing full segments
+        self.closed = False
+    
+    def allocate_path(self):
+        """Path of the next segment of this run, called with the lock held"""
+        path = f'{self.prefix}.{self.run:04d}.{self.index:04d}.tlm'
+        self.index += 1
+        return path
+    
+    def prepare_next_segment(self):
+        with self.lock:
+            path = self.allocate_path()
+            index = self.index - 1
+        try:
+            segment = TelemetrySegment(path, self.segment_records)
+        except OSError as e:
+            log.error("Telemetry segment error: %s", e, extra={'msg_type': 'telemetry_error'})
+            segment = None
+        with self.lock:
+            self.preparing = False
+            if segment is None:
+                self.retry_at = time.monotonic() + self.RETRY_INTERVAL
+                return
+            # A rollover that couldn't wait for us took a later index, using
+            # this segment after it would put the records out of order
+            stale = self.closed or index != self.index - 1
+            if not stale:
+                self.next_segment = segment
+        if stale:
+            segment.close()
+            os.remove(segment.path)
+    
+    def record_sensor(self, data):
+        try:
+            self.append(encode_telemetry_record(RECORD_SENSOR, data))
+        except struct.error as e:
+            log.error("Telemetry record error: %s", e, extra={'msg_type': 'telemetry_error'})
+    
+    def record_command(self, command, data):
+        try:
+            self.append(encode_telemetry_record(RECORD_COMMAND, data, command))
+        except struct.error as e:
+            log.error("Telemetry record error: %s", e, extra={'msg_type': 'telemetry_error'})
+    
+    def retire_segment(self, segment):
+        """Helper thread: flush, trim and close a full segment"""
+        try:
+            segment.close()
+        except OSError as e:
+            log.error("Telemetry segment error: %s", e, extra={'msg_type': 'telemetry_error'})
+    
+    def rollover(self):
+        """Switch to the next segment, False if there is none to switch to
+        
+        Called with the lock held. Only when the helper thread fell behind
+        does this touch the disk.
+        """
+        segment, self.next_segment = self.next_segment, None
+        if segment is None:
+            if time.monotonic() < self.retry_at:
+                return False
+            try:
+                segment = TelemetrySegment(self.allocate_path(), self.segment_records)
+            except OSError as e:
+                log.error("Telemetry segment error: %s", e, extra={'msg_type': 'telemetry_error'})
+                self.retry_at = time.monotonic() + self.RETRY_INTERVAL
+                return False
+        
+        full, self.segment = self.segment, segment
+        helper = threading.Thread(target=self.retire_segment, args=(full,))
+        helper.daemon = True
+        self.retiring = [thread for thread in self.retiring if thread.is_alive()] + [helper]
+        helper.start()
+        return True
+    
+    def append(self, record):
+        """Add a record, dropping it rather than failing if the disk lets us down"""
+        with self.lock:
+            if self.closed:
+                return
+            if self.segment.count >= self.segment.capacity and not self.rollover():
+                metrics.counter('edubot_telemetry_dropped_total', "Records lost to telemetry errors").inc()
+                return
+            self.segment.append(record)
+            
+            if (self.segment.count * 2 >= self.segment.capacity and self.next_segment is None
+                    and not self.preparing and time.monotonic() >= self.retry_at):
+                self.preparing = True
+                helper = threading.Thread(target=self.prepare_next_segment)
+                helper.daemon = True
+                helper.start()
+        metrics.counter('edubot_telemetry_records_total', "Records written to the telemetry log").inc()
+    
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.segment.close()
+            if self.next_segment is not None:
+                # Prepared but never used
+                self.next_segment.close()
+                os.remove(self.next_segment.path)
+            retiring = self.retiring
+        # Full segments still being closed must reach the disk too
+        for helper in retiring:
+            helper.join()
+
+class TelemetryReplay:
+    """Plays a recorded telemetry log back with its original timing
+    
+    speed scales the playback rate (2.0 plays twice as fast); 0 plays the
+    records back to back. publish is called with each decoded record.
+    """
+    def __init__(self, prefix, speed=1.0, loop=False):
+        self.prefix = prefix
+        self.speed = speed
+        self.loop = loop
+        self.running = False
+        if not telemetry_segments(prefix):
+            raise ValueError(f"No telemetry segments found for {prefix}")
+    
+    def run(self, publish):
+        self.running = True
+        while self.running:
+            run = None
+            for record in read_telemetry(self.prefix):
+                if not self.running:
+                    return
+                if record['run'] != run:
+                    # Each recorded run is timed from its own start, back to back
+                    run = record['run']
+                    started = time.monotonic()
+                    first = record['wall_time']
+                if self.speed > 0:
+                    # Wall time from the segment header, the monotonic stamps restart every boot
+                    due = started + (record['wall_time'] - first) / self.speed
+                    delay = due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                publish(record)
+            log.info("Telemetry replay finished", extra={'msg_type': 'replay'})
+            if not self.loop:
+                break
+        self.running = False
+    
+    def stop(self):
+        self.running = False
+
 class RobotServer:
-    def __init__(self, host='0.0.0.0', port=5000):
+    BROADCAST_INTERVAL = 2.0  # seconds between sensor broadcasts
+    DRAIN_TIMEOUT = 1.0       # seconds a closed client's writer gets to send what is queued
+    # Message types and commands that get their own latency series
+    METRIC_COMMANDS = ('move', 'stop', 'get_sensors', 'drive', 'start_autonomous', 'stop_autonomous',
+                       'smart_stop', 'emergency_stop', 'get_status', 'metrics', 'test')
+    
+    def __init__(self, host='0.0.0.0', port=5000, mode='threaded', robot=None,
+                 sample_interval=0.2, sample_max_age=0.5,
+                 send_queue_size=64, overflow_policy='drop_oldest',
+                 metrics_file=None, metrics_interval=10.0, udp_port=None,
+                 recorder=None, replay=None):
         self.host = host
         self.port = port
-        self.robot = RealEduBot()
+        self.mode = mode  # 'threaded' or 'event_loop'
+        self.robot = robot or RealEduBot()
+        # Every consumer of sensor data reads through this cache
+        self.recorder = recorder  # TelemetryRecorder or None
+        self.replay = replay      # TelemetryReplay streamed instead of live sensor data
+        self.sampler = SensorSampler(self.robot, sample_interval, sample_max_age, recorder)
+        self.navigator = AutonomousNavigator(
+            self.robot, self.latest_distance, self.sampler.get, self.publish_autonomous_update)
+        self.send_queue_size = send_queue_size
+        self.overflow_policy = overflow_policy  # 'drop_oldest' or 'disconnect'
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.udp_port = udp_port
+        self.udp_socket = None
+        self.udp_tokens = {}  # teleop token -> ClientSession
+        self.teleop_lock = threading.Lock()  # orders datagrams against stop commands
+        self.started_at = server_time()
+        self.last_broadcast = None
         self.running = False
-        self.clients = []  # Store connected clients
+        self.sessions = {}  # Connected clients: socket -> ClientSession
+        self.sessions_lock = threading.Lock()
+        self.selector = None
+        # Event-loop mode: work handed to the loop thread by other threads
+        self.loop_thread = None
+        self.loop_callbacks = deque()
+        self.wakeup_reader = None
+        self.wakeup_writer = None
         
         # Setup shutdown signal handling
         signal.signal(signal.SIGINT, self.signal_handler)
@@ -185,88 +2151,512 @@ class RobotServer:
         
     def signal_handler(self, signum, frame):
         """Handle shutdown signals"""
-        print(f"Received signal {signum}, shutting down...")
+        log.info("Received signal %s, shutting down...", signum)
         self.running = False
         self.cleanup()
         sys.exit(0)
     
     def start_server(self):
-        """Start the robot server"""
+        """Start the robot server in the configured mode"""
+        if self.mode == 'event_loop':
+            self.start_event_loop_server()
+        else:
+            self.start_threaded_server()
+    
+    def create_server_socket(self):
+        """Create, bind and listen on the server socket"""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(32)  # room for several operator and monitoring clients
+        
+        log.info("Robot server started on %s:%s (%s mode)", self.host, self.port, self.mode)
+        
+        if self.udp_port is not None:
+            self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.udp_socket.bind((self.host, self.udp_port))
+            log.info("UDP teleop channel on %s:%s", self.host, self.udp_port)
+        log.info("Waiting for connections...")
+        self.running = True
+        self.started_at = server_time()
+        self.sampler.start()
+        
+        if self.replay is not None:
+            replay_thread = threading.Thread(target=self.replay_loop)
+            replay_thread.daemon = True
+            replay_thread.start()
+        
+        if self.metrics_file:
+            metrics_thread = threading.Thread(target=self.metrics_dump_loop)
+            metrics_thread.daemon = True
+            metrics_thread.start()
+    
+    def start_threaded_server(self):
+        """Serve every client from its own thread"""
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
+            self.create_server_socket()
             self.server_socket.settimeout(1)  # timeout to check self.running
             
-            print(f"Robot server started on {self.host}:{self.port}")
-            print("Waiting for connections...")
-            self.running = True
-            
             # Start thread for automatic sensor data broadcasting
             sensor_thread = threading.Thread(target=self.sensor_broadcast_loop)
             sensor_thread.daemon = True
             sensor_thread.start()
             
+            if self.udp_socket is not None:
+                self.udp_socket.settimeout(1)
+                udp_thread = threading.Thread(target=self.udp_receive_loop)
+                udp_thread.daemon = True
+                udp_thread.start()
+            
             while self.running:
                 try:
                     client_socket, address = self.server_socket.accept()
-                    print(f"New connection from {address}")
-                    
-                    # Add client to list
-                    self.clients.append(client_socket)
+                    log.info("New connection from %s", address)
+                    session = self.open_session(client_socket, address)
                     
                     # Start thread to handle client
                     client_thread = threading.Thread(
                         target=self.handle_client, 
-                        args=(client_socket, address)
+                        args=(session,)
                     )
                     client_thread.daemon = True
                     client_thread.start()
                     
+                    # Single writer for everything sent to this client
+                    writer_thread = threading.Thread(
+                        target=self.client_writer_loop,
+                        args=(session,)
+                    )
+                    writer_thread.daemon = True
+                    writer_thread.start()
+                    
                 except socket.timeout:
                     continue
                 except Exception as e:
                     if self.running:
-                        print(f"Accept error: {e}")
+                        log.error("Accept error: %s", e)
                     break
                     
         except Exception as e:
-            print(f"Server error: {e}")
+            log.error("Server error: %s", e)
         finally:
             self.cleanup()
     
-    def handle_client(self, client_socket, address):
-        """Handle client connection"""
-        print(f"Handling client {address}")
+    def start_event_loop_server(self):
+        """Serve every client from a single thread multiplexed with selectors"""
         try:
+            self.create_server_socket()
+            self.server_socket.setblocking(False)
+            
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(self.server_socket, selectors.EVENT_READ)
+            
+            # Lets other threads (navigation updates) interrupt select()
+            self.loop_thread = threading.get_ident()
+            self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+            self.wakeup_reader.setblocking(False)
+            self.wakeup_writer.setblocking(False)
+            self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+            
+            if self.udp_socket is not None:
+                self.udp_socket.setblocking(False)
+                self.selector.register(self.udp_socket, selectors.EVENT_READ)
+            
+            next_broadcast = time.monotonic() + self.BROADCAST_INTERVAL
             while self.running:
-                # Receive data from client
-                data = client_socket.recv(1024).decode('utf-8')
+                # Sleep until there is socket activity or the next broadcast is due
+                timeout = max(0.0, next_broadcast - time.monotonic())
+                for key, mask in self.selector.select(timeout):
+                    if key.fileobj is self.server_socket:
+                        self.accept_session()
+                        continue
+                    if key.fileobj is self.wakeup_reader:
+                        self.run_loop_callbacks()
+                        continue
+                    if key.fileobj is self.udp_socket:
+                        self.read_datagrams()
+                        continue
+                    
+                    session = key.data
+                    if mask & selectors.EVENT_READ:
+                        self.read_session(session)
+                    if mask & selectors.EVENT_WRITE and not session.closed:
+                        self.flush_session(session)
+                
+                now = time.monotonic()
+                if now >= next_broadcast:
+                    self.broadcast_sensor_data()
+                    next_broadcast += self.BROADCAST_INTERVAL
+                    if next_broadcast < now:
+                        # Fell behind (slow sensor read), don't try to catch up in a burst
+                        next_broadcast = now + self.BROADCAST_INTERVAL
+                    
+        except Exception as e:
+            if self.running:
+                log.error("Server error: %s", e)
+        finally:
+            self.cleanup()
+    
+    def call_in_server_thread(self, callback):
+        """Run callback on the event-loop thread, or right away in threaded mode"""
+        if self.mode != 'event_loop' or self.loop_thread in (None, threading.get_ident()):
+            callback()
+            return
+        self.loop_callbacks.append(callback)
+        try:
+            self.wakeup_writer.send(b'\0')
+        except OSError:
+            pass  # wakeup already pending
+    
+    def run_loop_callbacks(self):
+        """Drain the wakeup socket and run the callbacks queued by other threads"""
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self.loop_callbacks:
+            self.loop_callbacks.popleft()()
+    
+    def open_session(self, client_socket, address):
+        """Register a newly accepted client"""
+        session = ClientSession(client_socket, address, self.send_queue_size, self.overflow_policy)
+        with self.sessions_lock:
+            self.sessions[client_socket] = session
+            metrics.gauge('edubot_clients', "Connected clients").set(len(self.sessions))
+        metrics.counter('edubot_connections_total', "Accepted client connections").inc()
+        return session
+    
+    def accept_session(self):
+        """Accept a pending connection in event-loop mode"""
+        try:
+            client_socket, address = self.server_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        
+        log.info("New connection from %s", address)
+        client_socket.setblocking(False)
+        session = self.open_session(client_socket, address)
+        self.selector.register(client_socket, selectors.EVENT_READ, session)
+    
+    def read_session(self, session):
+        """Read whatever is available from a client in event-loop mode"""
+        try:
+            data = session.socket.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            log.warning("Client handling error for %s: %s", session.address, e)
+            self.close_session(session)
+            return
+        
+        if not data:
+            self.close_session(session)
+            return
+        
+        try:
+            payloads = session.decoder.feed(data)
+        except ProtocolError as e:
+            self.send_message(session.socket, {'type': 'error', 'message': str(e)})
+            log.warning("Protocol error from %s: %s", session.address, e)
+            self.close_session(session)
+            return
+        
+        self.handle_payloads(payloads, session.socket, session.address)
+    
+    def flush_session(self, session):
+        """Write queued frames until the socket would block (event-loop mode)"""
+        while not session.closed:
+            if not session.sending:
+                session.sending = session.pop_frame()
+                if session.sending is None:
+                    session.sending = b''
+                    break
+            try:
+                sent = session.socket.send(session.sending)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self.close_session(session)
+                return
+            session.sending = session.sending[sent:]
+            if session.sending:
+                break  # socket buffer full
+        
+        if session.closed:
+            return
+        # Only wait for writability while something is still pending
+        want_write = bool(session.sending or session.outbox)
+        if want_write != session.want_write:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if want_write else 0)
+            self.selector.modify(session.socket, events, session)
+            session.want_write = want_write
+    
+    def client_writer_loop(self, session):
+        """Write queued frames to one client (threaded mode)
+        
+        Once the session is closed the frames still queued, like the error
+        that explains a disconnect, are written before the socket is closed.
+        """
+        while True:
+            frame = session.next_frame()
+            if frame is None:
+                break
+            try:
+                session.socket.sendall(frame)
+            except OSError:
+                self.close_session(session)
+                break
+        self.shutdown_socket(session.socket)
+        session.socket.close()
+    
+    @staticmethod
+    def shutdown_socket(client_socket, how=socket.SHUT_RDWR):
+        try:
+            client_socket.shutdown(how)
+        except OSError:
+            pass
+    
+    def close_session(self, session):
+        """Unregister and close a client connection"""
+        if not session.mark_closed():
+            return
+        with self.sessions_lock:
+            self.sessions.pop(session.socket, None)
+            self.udp_tokens.pop(session.udp_token, None)
+            metrics.gauge('edubot_clients', "Connected clients").set(len(self.sessions))
+        if self.mode == 'event_loop':
+            try:
+                self.selector.unregister(session.socket)
+            except (KeyError, ValueError):
+                pass
+            self.shutdown_socket(session.socket)
+            session.socket.close()
+        else:
+            # Wakes a handler thread blocked in recv(), the writer thread drains
+            # the outbox and closes the socket, or is cut off if the client
+            # doesn't take the data
+            self.shutdown_socket(session.socket, socket.SHUT_RD)
+            timer = threading.Timer(self.DRAIN_TIMEOUT, self.shutdown_socket, (session.socket,))
+            timer.daemon = True
+            timer.start()
+        log.info("Disconnected from %s", session.address)
+    
+    def handle_client(self, session):
+        """Handle client connection"""
+        address = session.address
+        client_socket = session.socket
+        log.debug("Handling client %s", address)
+        try:
+            while self.running and not session.closed:
+                # Receive data from client, a single read may hold several frames
+                data = client_socket.recv(4096)
                 if not data:
                     break
-                    
+                
                 try:
-                    message = json.loads(data)
-                    self.process_message(message, client_socket, address)
-                except json.JSONDecodeError as e:
-                    error_msg = {'type': 'error', 'message': f'Invalid JSON: {str(e)}'}
-                    client_socket.send(json.dumps(error_msg).encode())
-                    print(f"JSON error from {address}: {e}")
+                    payloads = session.decoder.feed(data)
+                except ProtocolError as e:
+                    # Stream is out of sync, nothing after this point can be trusted
+                    self.send_message(client_socket, {'type': 'error', 'message': str(e)})
+                    log.warning("Protocol error from %s: %s", address, e)
+                    break
+                
+                self.handle_payloads(payloads, client_socket, address)
                     
         except Exception as e:
-            print(f"Client handling error for {address}: {e}")
+            if not session.closed:
+                log.warning("Client handling error for %s: %s", address, e)
         finally:
             # Remove client from list and close connection
-            if client_socket in self.clients:
-                self.clients.remove(client_socket)
-            client_socket.close()
-            print(f"Disconnected from {address}")
+            self.close_session(session)
+    
+    def handle_payloads(self, payloads, client_socket, address):
+        """Decode and process every complete frame received from a client"""
+        messages = []
+        for payload in payloads:
+            try:
+                messages.append(json.loads(payload.decode('utf-8')))
+            except ValueError as e:
+                error_msg = {'type': 'error', 'message': f'Invalid JSON: {str(e)}'}
+                self.send_message(client_socket, error_msg)
+                log.warning("JSON error from %s: %s", address, e, extra={'msg_type': 'invalid_json'})
+                metrics.counter('edubot_invalid_messages_total', "Frames that were not valid JSON").inc()
+        
+        # A client that got ahead of us sends its backlog in one read; motion
+        # commands a later one in the same batch would cancel are skipped
+        superseded = set()
+        pending = []
+        for index, message in enumerate(messages):
+            if not isinstance(message, dict) or message.get('type') != 'command':
+                continue
+            if self.preempts_motion(message):
+                superseded.update(pending)
+                pending = []
+            if message.get('command') in ('move', 'drive') and self.runnable_motion(message):
+                pending.append(index)
+        
+        for index, message in enumerate(messages):
+            if index in superseded:
+                self.send_superseded(message, client_socket)
+                continue
+            if not isinstance(message, dict):
+                self.send_message(client_socket, {'type': 'error', 'message': 'Messages must be JSON objects'})
+                continue
+            
+            started = time.perf_counter()
+            self.process_message(message, client_socket, address)
+            metrics.histogram('edubot_command_latency_seconds', "process_message time per command",
+                              command=self.command_label(message)).observe(time.perf_counter() - started)
+    
+    def udp_receive_loop(self):
+        """Threaded mode: apply teleop datagrams as they arrive"""
+        while self.running:
+            try:
+                payload, address = self.udp_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.handle_datagram(payload, address)
+    
+    def read_datagrams(self):
+        """Event-loop mode: drain every datagram queued on the UDP socket"""
+        while True:
+            try:
+                payload, address = self.udp_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                log.error("UDP receive error: %s", e)
+                return
+            self.handle_datagram(payload, address)
+    
+    def handle_datagram(self, payload, address):
+        """Apply one teleop datagram unless a newer one was already applied
+        
+        Datagrams can be lost, duplicated or reordered, so only a sequence
+        number above the newest one seen for the session is accepted.
+        """
+        try:
+            message = json.loads(payload.decode('utf-8'))
+            token = message.get('token')
+            seq = message.get('seq')
+            command = message.get('command')
+        except (UnicodeDecodeError, json.JSONDecodeError, AttributeError):
+            metrics.counter('edubot_teleop_datagrams_total', "UDP teleop datagrams", result='invalid').inc()
+            return
+        
+        session = self.udp_tokens.get(token) if isinstance(token, str) else None
+        if session is None or not isinstance(seq, int) or command not in TELEOP_COMMANDS:
+            metrics.counter('edubot_teleop_datagrams_total', "UDP teleop datagrams", result='rejected').inc()
+            log.debug("Rejected teleop datagram from %s", address, extra={'msg_type': 'teleop_rejected'})
+            return
+        with self.teleop_lock:
+            if seq <= session.udp_seq:
+                metrics.counter('edubot_teleop_datagrams_total', "UDP teleop datagrams", result='stale').inc()
+                return
+            session.udp_seq = seq
+            metrics.counter('edubot_teleop_datagrams_total', "UDP teleop datagrams", result='accepted').inc()
+            
+            # Same handling as over TCP, without a response: the next update supersedes it anyway
+            command_message = {'type': 'command', 'command': command, 'data': message.get('data', {})}
+            started = time.perf_counter()
+            self.process_message(command_message, None, address)
+        metrics.histogram('edubot_command_latency_seconds', "process_message time per command",
+                          command=command).observe(time.perf_counter() - started)
+    
+    def preempts_motion(self, message):
+        """Whether a command cancels whatever motion came before it
+        
+        Only a move or drive that will actually run counts, a malformed one
+        is answered with an error and leaves earlier motion alone.
+        """
+        command = message.get('command')
+        if command == 'move':
+            return self.runnable_motion(message) and not message.get('data', {}).get('queue')
+        if command == 'drive':
+            return self.runnable_motion(message)
+        return command in STOP_COMMANDS
+    
+    def runnable_motion(self, message):
+        """Whether a move or drive has the parameters process_message needs to run it"""
+        data = message.get('data', {})
+        if not isinstance(data, dict):
+            return False
+        if message.get('command') == 'move':
+            direction = data.get('direction', '')
+            if not isinstance(direction, str) or direction.lower() not in MOVE_DIRECTIONS:
+                return False
+            numbers = {'speed': data.get('speed', 1.0)}
+        else:
+            numbers = {key: data.get(key, 0.5) for key in ('left', 'right', 'timeout')}
+        return all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                   for value in numbers.values())
+    
+    def fence_teleop(self, client_socket, data):
+        """Mark the client's teleop datagrams up to data['udp_seq'] as stale
+        
+        A datagram sent before a stop can arrive after it, it must not
+        restart the motors.
+        """
+        session = self.sessions.get(client_socket)
+        seq = data.get('udp_seq') if isinstance(data, dict) else None
+        if session is None or not isinstance(seq, int):
+            return
+        with self.teleop_lock:
+            session.udp_seq = max(session.udp_seq, seq)
+    
+    def send_superseded(self, message, client_socket):
+        """Answer a motion command that was merged into a newer one without running it
+        
+        The 'superseded' status isn't in the binary layout, these replies go out as JSON.
+        """
+        metrics.counter('edubot_commands_coalesced_total', "Motion commands merged or dropped",
+                        reason='superseded').inc()
+        response = {
+            'type': 'command_response',
+            'command': message.get('command'),
+            'status': 'superseded',
+            'message': 'Superseded by a newer command',
+            'timestamp': server_time()
+        }
+        response.update(self.queue_status())
+        self.send_message(client_socket, response)
+    
+    def queue_status(self):
+        """Motion backlog reported to clients so they can throttle"""
+        depth, remaining = self.robot.motion.backlog()
+        return {'queue_depth': depth, 'queue_time': remaining}
+    
+    def command_label(self, message):
+        """Metrics label for a message, bounded so clients can't invent new series"""
+        msg_type = message.get('type')
+        name = message.get('command') if msg_type == 'command' else msg_type
+        return name if name in self.METRIC_COMMANDS else 'other'
+    
+    def send_message(self, client_socket, message):
+        """Queue one framed message for a client"""
+        session = self.sessions.get(client_socket)
+        if session is not None:
+            self.send_frame(session, encode_message(message, session.encoding))
+    
+    def send_frame(self, session, frame, droppable=False):
+        """Queue an already encoded frame, applying the overflow policy"""
+        if not session.enqueue(frame, droppable):
+            log.warning("Send queue full for %s, disconnecting slow client", session.address,
+                        extra={'msg_type': 'slow_client'})
+            metrics.counter('edubot_slow_client_disconnects_total', "Clients dropped for a full send queue").inc()
+            self.close_session(session)
+            return
+        if self.mode == 'event_loop':
+            # Try to write straight away, the selector takes over if the socket is full
+            self.flush_session(session)
     
     def process_message(self, message, client_socket, address):
         """Process incoming message"""
         msg_type = message.get('type')
-        print(f"Received message from {address}: {msg_type}")
+        log.log(TRACE, "Received message", extra={'msg_type': msg_type, 'client': address})
         
         if msg_type == 'command':
             command = message.get('command')
@@ -276,24 +2666,39 @@ class RobotServer:
                 'type': 'command_response', 
                 'command': command, 
                 'status': 'success',
-                'timestamp': datetime.now().isoformat()
+                'timestamp': server_time()
             }
             
+            if command in STOP_COMMANDS:
+                self.fence_teleop(client_socket, data)
+            
             try:
                 if command == 'move':
+                    # Manual driving takes over from autonomous navigation
+                    self.navigator.stop()
                     direction = data.get('direction', '').lower()
+                    # Moves return immediately, the motion scheduler times them.
+                    # By default a move preempts the current one, 'queue' runs it after.
+                    queue = bool(data.get('queue', False))
+                    speed = self.clamp(data.get('speed', 1.0), 0.0, 1.0)
+                    # A map distance becomes the drive time for straight moves
+                    distance = data.get('distance')
+                    drive_time = 0.5
+                    if isinstance(distance, (int, float)) and distance > 0 and speed > 0:
+                        drive_time = min(distance / (self.robot.FORWARD_SPEED * speed), 5.0)
                     
+                    accepted = None
                     if direction == 'forward':
-                        self.robot.move_forward()
+                        accepted = self.robot.move_forward(drive_time, queue, speed)
                         response['message'] = 'Moving forward'
                     elif direction == 'backward':
-                        self.robot.move_backward()
+                        accepted = self.robot.move_backward(drive_time, queue, speed)
                         response['message'] = 'Moving backward'
                     elif direction == 'left':
-                        self.robot.turn_left()
+                        accepted = self.robot.turn_left(queue=queue, speed=speed)
                         response['message'] = 'Turning left'
                     elif direction == 'right':
-                        self.robot.turn_right()
+                        accepted = self.robot.turn_right(queue=queue, speed=speed)
                         response['message'] = 'Turning right'
                     elif direction == 'stop':
                         self.robot.stop_motors()
@@ -301,13 +2706,65 @@ class RobotServer:
                     else:
                         response['status'] = 'error'
                         response['message'] = f'Unknown direction: {direction}'
+                    
+                    if queue and accepted == 0:
+                        response['status'] = 'error'
+                        response['message'] = 'Motion queue full, move dropped'
+                    response.update(self.queue_status())
                         
-                elif command == 'stop':
+                elif command == 'stop' or command == 'emergency_stop':
+                    self.navigator.stop()
                     self.robot.stop_motors()
                     response['message'] = 'Emergency stop executed'
+                    response.update(self.queue_status())
+                
+                elif command == 'drive':
+                    # Streaming velocity control: each update replaces the last,
+                    # the motors stop by themselves if updates stop arriving
+                    self.navigator.stop()
+                    left = self.clamp(data.get('left', 0.0), -1.0, 1.0)
+                    right = self.clamp(data.get('right', 0.0), -1.0, 1.0)
+                    timeout = self.clamp(data.get('timeout', 0.5), 0.05, 2.0)
+                    self.robot.drive(left, right, timeout)
+                    response['message'] = f'Driving at {left:.2f}/{right:.2f}'
+                    response.update(self.queue_status())
+                
+                elif command == 'get_status':
+                    response['robot_status'] = self.robot_status()
+                    response['metrics'] = metrics.snapshot()
+                    response['message'] = 'Status retrieved'
+                
+                elif command == 'metrics':
+                    response['metrics'] = metrics.snapshot()
+                    response['exposition'] = metrics.exposition()
+                    response['message'] = 'Metrics retrieved'
+                
+                elif command == 'smart_stop':
+                    # Stop navigating and let the current short move wind down
+                    self.navigator.stop()
+                    self.robot.motion.finish_current()
+                    response['message'] = 'Smart stop executed'
+                    response.update(self.queue_status())
+                
+                elif command == 'start_autonomous':
+                    target_x = data.get('target_x')
+                    target_y = data.get('target_y')
+                    if not isinstance(target_x, (int, float)) or not isinstance(target_y, (int, float)):
+                        response['status'] = 'error'
+                        response['message'] = 'start_autonomous needs numeric target_x and target_y'
+                    else:
+                        self.navigator.start(target_x, target_y,
+                                             data.get('robot_x'), data.get('robot_y'),
+                                             data.get('heading'))
+                        response['message'] = f'Autonomous navigation to ({target_x:.0f}, {target_y:.0f}) started'
+                
+                elif command == 'stop_autonomous':
+                    self.navigator.stop()
+                    self.robot.stop_motors()
+                    response['message'] = 'Autonomous navigation stopped'
                     
                 elif command == 'get_sensors':
-                    sensor_data = self.robot.get_sensor_data()
+                    sensor_data = self.sampler.get()
                     response['sensor_data'] = sensor_data
                     response['message'] = 'Sensor data retrieved'
                     
@@ -318,95 +2775,328 @@ class RobotServer:
             except Exception as e:
                 response['status'] = 'error'
                 response['message'] = str(e)
-                print(f"Command execution error: {e}")
+                log.error("Command execution error: %s", e, extra={'msg_type': 'command_error'})
+            
+            if self.recorder is not None and response['status'] == 'success' and command in RECORD_COMMANDS:
+                self.recorder.record_command(command, data)
                 
-            # Send response
-            client_socket.send(json.dumps(response).encode())
-            print(f"Sent response to {address}: {response['status']}")
+            # Send response (teleop datagrams have no connection to answer on)
+            if client_socket is not None:
+                self.send_message(client_socket, response)
+            log.log(TRACE, "Sent response", extra={'msg_type': 'command_response', 'client': address,
+                                                     'command': command, 'status': response['status']})
             
         elif msg_type == 'test':
-            # Connection test message
+            # Connection test message, also used to agree on the telemetry encoding
+            # and as an NTP-style ping: the client sends its clock as t0, we answer
+            # with our receive (t1) and reply (t2) times so it can work out the
+            # round trip and the offset between the two clocks
+            received = server_time()
+            encoding = self.negotiate_encoding(message.get('encodings'))
+            session = self.sessions.get(client_socket)
+            if session is not None:
+                session.encoding = encoding
+            
             test_response = {
                 'type': 'test_response', 
                 'message': 'Connection test successful',
-                'timestamp': datetime.now().isoformat()
+                'encoding': encoding,
+                'timestamp': server_time()
             }
-            client_socket.send(json.dumps(test_response).encode())
-            print(f"Sent test response to {address}")
+            if self.udp_socket is not None and session is not None:
+                # Teleop datagrams carrying this token are applied for this client.
+                # Kept across repeated tests, which clients send to resync clocks.
+                if session.udp_token is None:
+                    with self.sessions_lock:
+                        session.udp_token = os.urandom(8).hex()
+                        self.udp_tokens[session.udp_token] = session
+                test_response['udp_port'] = self.udp_port
+                test_response['udp_token'] = session.udp_token
+            if isinstance(message.get('t0'), (int, float)):
+                test_response['t0'] = message['t0']
+                test_response['t1'] = received
+                test_response['t2'] = server_time()
+            # Always JSON: encode_binary has no layout for it
+            self.send_message(client_socket, test_response)
+            log.log(TRACE, "Sent response", extra={'msg_type': 'test_response', 'client': address})
             
         else:
             error_msg = {'type': 'error', 'message': f'Unknown message type: {msg_type}'}
-            client_socket.send(json.dumps(error_msg).encode())
+            self.send_message(client_socket, error_msg)
+    
+    def robot_status(self):
+        """Summary of the server and robot state for get_status"""
+        return {
+            'uptime': round(server_time() - self.started_at, 1),
+            'mode': self.mode,
+            'clients': len(self.sessions),
+            'motion': self.robot.motion.current,
+            'motion_queue': dict(zip(('depth', 'time'), self.robot.motion.backlog())),
+            'autonomous': self.navigator.state,
+            'ranging': 'edge' if self.robot.ranger is not None else 'polling'
+        }
+    
+    def metrics_dump_loop(self):
+        """Periodically write the metrics exposition to metrics_file"""
+        while self.running:
+            try:
+                metrics.write_file(self.metrics_file)
+            except OSError as e:
+                log.error("Metrics dump error: %s", e, extra={'msg_type': 'metrics_error'})
+            time.sleep(self.metrics_interval)
+    
+    def clamp(self, value, low, high):
+        """Clamp a numeric command parameter, rejecting anything else"""
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Expected a number, got {value!r}")
+        return max(low, min(high, float(value)))
+    
+    def latest_distance(self):
+        """Distance for control loops: the latest filtered reading, else the shared cache"""
+        if self.robot.ranger is not None:
+            return self.robot.get_distance()
+        return self.sampler.get().get('distance', 0.0)
+    
+    def replay_loop(self):
+        """Stream the recorded session once a client is connected to watch it"""
+        while self.running and not self.sessions:
+            time.sleep(0.1)
+        if self.running:
+            log.info("Replaying telemetry from %s at %sx", self.replay.prefix, self.replay.speed or 'max')
+            self.replay.run(self.publish_replay_record)
+    
+    def publish_replay_record(self, record):
+        """Send a recorded reading as a normal broadcast, commands as replay_command"""
+        if record['kind'] == 'sensor':
+            # Restamped so clients see the reading as taken now on our clock
+            message = {
+                'type': 'sensor_data',
+                'data': dict(record['data'], timestamp=server_time()),
+                'timestamp': server_time()
+            }
+        else:
+            message = {
+                'type': 'replay_command',
+                'command': record['command'],
+                'data': record['data'],
+                'timestamp': server_time(),
+                'wall_time': record['wall_time']
+            }
+        self.call_in_server_thread(lambda: self.broadcast(message))
+    
+    def publish_autonomous_update(self, update):
+        """Stream navigation progress to every client"""
+        message = {
+            'type': 'autonomous_update',
+            'data': update,
+            'timestamp': server_time()
+        }
+        self.call_in_server_thread(lambda: self.broadcast(message))
+    
+    def negotiate_encoding(self, requested):
+        """Pick the first encoding the client asked for that we support"""
+        if isinstance(requested, list):
+            for encoding in requested:
+                if encoding in SUPPORTED_ENCODINGS:
+                    return encoding
+        return 'json'
     
     def sensor_broadcast_loop(self):
         """Broadcast sensor data to all connected clients periodically"""
         while self.running:
             try:
-                if self.clients:
-                    sensor_data = self.robot.get_sensor_data()
-                    broadcast_msg = {
-                        'type': 'sensor_data',
-                        'data': sensor_data,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                    
-                    # Send to all connected clients
-                    for client in self.clients[:]:  # Use slice copy for safe iteration
-                        try:
-                            client.send(json.dumps(broadcast_msg).encode())
-                        except:
-                            # Remove disconnected clients
-                            self.clients.remove(client)
-                
-                time.sleep(2)  # Broadcast every 2 seconds
+                self.broadcast_sensor_data()
+                time.sleep(self.BROADCAST_INTERVAL)
                 
             except Exception as e:
-                print(f"Sensor broadcast error: {e}")
+                log.error("Sensor broadcast error: %s", e)
                 time.sleep(1)
     
+    def broadcast_sensor_data(self):
+        """Send one sensor reading to every connected client"""
+        if not self.sessions or self.replay is not None:
+            # Nobody listening, or the replay owns the sensor stream
+            self.last_broadcast = None
+            return
+        
+        # How far each broadcast lands from its intended interval
+        now = time.monotonic()
+        if self.last_broadcast is not None:
+            metrics.histogram('edubot_broadcast_drift_seconds', "Broadcast interval error",
+                              buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0)).observe(
+                abs(now - self.last_broadcast - self.BROADCAST_INTERVAL))
+        self.last_broadcast = now
+        
+        sensor_data = self.sampler.get()
+        broadcast_msg = {
+            'type': 'sensor_data',
+            'data': sensor_data,
+            'timestamp': server_time()
+        }
+        self.broadcast(broadcast_msg)
+    
+    def broadcast(self, message):
+        """Encode a message once per encoding and queue it for every connected client"""
+        frames = {}
+        with self.sessions_lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            frame = frames.get(session.encoding)
+            if frame is None:
+                frame = frames[session.encoding] = encode_message(message, session.encoding)
+            self.send_frame(session, frame, droppable=True)
+    
     def cleanup(self):
         """Cleanup resources"""
-        print("Cleaning up resources...")
+        log.info("Cleaning up resources...")
         self.running = False
+        self.navigator.stop()
+        self.sampler.stop()
+        if self.replay is not None:
+            self.replay.stop()
         
         # Close all client connections
-        for client in self.clients:
+        with self.sessions_lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
             try:
-                client.close()
+                self.close_session(session)
             except:
                 pass
-        self.clients.clear()
+        
+        if self.selector is not None:
+            try:
+                self.selector.close()
+            except:
+                pass
+            self.selector = None
+        for wakeup_socket in (self.wakeup_reader, self.wakeup_writer):
+            if wakeup_socket is not None:
+                wakeup_socket.close()
+        self.wakeup_reader = self.wakeup_writer = None
         
         # Close server socket
         try:
             self.server_socket.close()
         except:
             pass
+        if self.udp_socket is not None:
+            self.udp_socket.close()
+            self.udp_socket = None
+        
+        if self.recorder is not None:
+            self.recorder.close()
         
         # Cleanup GPIO
         try:
-            self.robot.stop_motors()
-            GPIO.cleanup()
-            print("GPIO cleaned up")
+            self.robot.cleanup()
+            log.info("GPIO cleaned up")
         except:
             pass
         
-        print("Server shutdown complete")
+        log.info("Server shutdown complete")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="EduBot Explorer robot server")
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help="minimum level written to the log")
+    parser.add_argument('--trace', action='store_true',
+                        help="log every received message and sent response")
+    parser.add_argument('--log-rate', type=float, default=10.0,
+                        help="records per second allowed per message type, 0 for no limit")
+    parser.add_argument('--log-json', action='store_true',
+                        help="write one JSON object per log line")
+    parser.add_argument('--host', default='0.0.0.0', help="address to listen on")
+    parser.add_argument('--port', type=int, default=5000, help="TCP port to listen on")
+    parser.add_argument('--mode', choices=['threaded', 'event_loop'], default='threaded',
+                        help="one thread per client, or a single selectors event loop")
+    parser.add_argument('--simulate', action='store_true',
+                        help="run against a simulated robot instead of the GPIO pins")
+    parser.add_argument('--ranging-rate', type=float, default=10.0,
+                        help="ultrasonic pings per second in edge-triggered mode")
+    parser.add_argument('--poll-ranging', action='store_true',
+                        help="measure distance by polling the echo pin on every request")
+    parser.add_argument('--sensor', dest='sensors', action='append', type=parse_sensor_spec,
+                        metavar='NAME:TRIGGER:ECHO[:ANGLE]',
+                        help="an ultrasonic sensor, repeat for an array; the first one is the primary "
+                             "(default front:24:25:0)")
+    parser.add_argument('--filter', choices=DistanceFilter.METHODS, default='median',
+                        help="smoothing applied to distance readings after outlier rejection")
+    parser.add_argument('--filter-window', type=int, default=5,
+                        help="recent distance readings the filter works over")
+    parser.add_argument('--sample-interval', type=float, default=0.2,
+                        help="seconds between sensor samples shared by all clients")
+    parser.add_argument('--sample-max-age', type=float, default=0.5,
+                        help="oldest cached sensor snapshot served before resampling")
+    parser.add_argument('--send-queue-size', type=int, default=64,
+                        help="outgoing messages buffered per client")
+    parser.add_argument('--overflow-policy', choices=['drop_oldest', 'disconnect'],
+                        default='drop_oldest',
+                        help="what to do when a slow client's send queue is full")
+    parser.add_argument('--udp-port', type=int,
+                        help="also accept sequence-numbered drive/move updates as UDP datagrams on this port")
+    parser.add_argument('--metrics-file',
+                        help="periodically write metrics in Prometheus text format to this file")
+    parser.add_argument('--metrics-interval', type=float, default=10.0,
+                        help="seconds between metrics file updates")
+    parser.add_argument('--record', metavar='PREFIX',
+                        help="log sensor readings and executed commands to PREFIX.RRRR.NNNN.tlm segments, "
+                             "one RRRR per run")
+    parser.add_argument('--replay', metavar='PREFIX',
+                        help="broadcast a recorded session instead of live sensor data (implies --simulate)")
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+                        help="replay rate relative to real time, 0 for as fast as possible")
+    parser.add_argument('--replay-loop', action='store_true', help="restart the replay when it ends")
+    parser.add_argument('--dump-telemetry', metavar='PREFIX',
+                        help="print a recorded session as JSON lines and exit")
+    args = parser.parse_args()
+    
+    if args.dump_telemetry:
+        for record in read_telemetry(args.dump_telemetry):
+            print(json.dumps(record))
+        sys.exit(0)
+    
+    log_listener = setup_logging(args.log_level, args.trace, args.log_rate, args.log_json)
+    atexit.register(log_listener.stop)  # flush queued records, also after sys.exit()
+    
     # Get host IP (optional)
     try:
         hostname = socket.gethostname()
         local_ip = socket.gethostbyname(hostname)
-        print(f"Host IP: {local_ip}")
+        log.info("Host IP: %s", local_ip)
     except:
-        print("Could not determine host IP")
+        log.info("Could not determine host IP")
     
     # Create and start server
-    server = RobotServer()
+    replay = None
+    if args.replay:
+        try:
+            replay = TelemetryReplay(args.replay, args.replay_speed, args.replay_loop)
+        except ValueError as e:
+            log.error("Replay error: %s", e)
+            sys.exit(1)
+    recorder = TelemetryRecorder(args.record) if args.record else None
+    
+    sensors = args.sensors or [('front', 24, 25, 0.0)]
+    gpio = None
+    if args.simulate or replay is not None:
+        gpio = SimulatedGPIO(sensors=[(trigger, echo, angle) for _, trigger, echo, angle in sensors])
+    robot = RealEduBot(ranging_rate=args.ranging_rate, edge_ranging=not args.poll_ranging, gpio=gpio,
+                       sensors=sensors,
+                       filter_factory=lambda: DistanceFilter(window=args.filter_window, method=args.filter))
+    server = RobotServer(host=args.host, port=args.port, mode=args.mode, robot=robot,
+                         sample_interval=args.sample_interval,
+                         sample_max_age=args.sample_max_age,
+                         send_queue_size=args.send_queue_size,
+                         overflow_policy=args.overflow_policy,
+                         metrics_file=args.metrics_file,
+                         metrics_interval=args.metrics_interval,
+                         udp_port=args.udp_port,
+                         recorder=recorder,
+                         replay=replay)
     
     try:
         server.start_server()
     except KeyboardInterrupt:
-        print("Server interrupted by user")
+        log.info("Server interrupted by user")
         server.cleanup()
@@ -0,0 +1,57 @@
+import json
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import RobotServer as server_module
+
+
+@pytest.fixture
+def server():
+    robot = server_module.RealEduBot(edge_ranging=False, gpio=server_module.SimulatedGPIO())
+    server = server_module.RobotServer(robot=robot)
+    yield server
+    server.cleanup()
+
+
+@pytest.fixture
+def session(server):
+    client_socket, peer = socket.socketpair()
+    session = server_module.ClientSession(client_socket, ('127.0.0.1', 0))
+    server.sessions[client_socket] = session
+    yield session
+    peer.close()
+
+
+def command(name, data):
+    return json.dumps({'type': 'command', 'command': name, 'data': data}).encode('utf-8')
+
+
+def replies(session):
+    return [json.loads(frame[server_module.FRAME_HEADER.size:]) for frame, _ in session.outbox]
+
+
+def test_malformed_commands_dont_supersede(server, session):
+    server.handle_payloads([
+        command('drive', {'left': 0.5, 'right': 0.5}),
+        command('move', [1, 2]),
+        command('move', {'direction': 'sideways'}),
+        command('drive', {'left': 'x'}),
+    ], session.socket, session.address)
+
+    statuses = [reply['status'] for reply in replies(session)]
+    assert statuses == ['success', 'error', 'error', 'error']
+    assert server.robot.motion.backlog()[0] == 1
+
+
+def test_superseded_reply_is_not_success(server, session):
+    server.handle_payloads([
+        command('move', {'direction': 'forward'}),
+        command('move', {'direction': 'bogus'}),
+        command('move', {'direction': 'left'}),
+    ], session.socket, session.address)
+
+    assert [reply['status'] for reply in replies(session)] == ['superseded', 'error', 'success']
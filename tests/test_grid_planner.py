@@ -0,0 +1,91 @@
+import heapq
+import importlib.util
+import math
+import os
+import random
+import time
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('PyQt5.QtWidgets')
+
+# The GUI module's file name isn't importable as is
+_spec = importlib.util.spec_from_file_location(
+    'edubot_explorer_gui', os.path.join(os.path.dirname(__file__), '..', 'EduBot-ExplorerGUI.py'))
+gui = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gui)
+
+
+def centre(planner, col, row):
+    return ((col + 0.5) * planner.cell_size, (row + 0.5) * planner.cell_size)
+
+
+def dijkstra(planner, start, goal):
+    distance = {goal: 0.0}
+    frontier = [(0.0, goal)]
+    while frontier:
+        cost, index = heapq.heappop(frontier)
+        if index == start:
+            return cost
+        if cost > distance[index]:
+            continue
+        for neighbour, step in planner.edges(index):
+            if cost + step < distance.get(neighbour, math.inf):
+                distance[neighbour] = cost + step
+                heapq.heappush(frontier, (cost + step, neighbour))
+    return math.inf
+
+
+def test_replan_from_cell_behind_start():
+    planner = gui.GridPlanner(150, 15, 15, 0)
+    goal = centre(planner, 9, 0)
+    assert planner.plan(centre(planner, 5, 0), goal) is not None
+    assert planner.plan(centre(planner, 4, 0), goal) == [goal]
+
+
+def test_replans_match_dijkstra():
+    rng = random.Random(7)
+    for _ in range(40):
+        planner = gui.GridPlanner(300, 225, 15, 0)
+        rects = [(rng.randrange(0, 300, 15), rng.randrange(0, 225, 15), 15 * rng.randint(1, 3), 15)
+                 for _ in range(25)]
+        planner.set_obstacles(rects)
+        goal = centre(planner, rng.randrange(20), rng.randrange(15))
+        start = centre(planner, rng.randrange(20), rng.randrange(15))
+        for _ in range(5):
+            planner.plan(start, goal)
+            expected = dijkstra(planner, planner.start, planner.goal)
+            assert planner.rhs[planner.start] == pytest.approx(expected)
+            # The robot moves on a few cells in any direction
+            start = (min(max(start[0] + rng.randint(-2, 2) * 15, 0), 299),
+                     min(max(start[1] + rng.randint(-2, 2) * 15, 0), 224))
+
+
+def test_hierarchical_planner_is_exact_on_small_arenas():
+    planner = gui.HierarchicalPlanner(300, 225, 15, 0)
+    planner.set_obstacles([(120, 0, 15, 180)])
+    assert planner.coarse is None
+    start, goal = centre(planner.fine, 2, 2), centre(planner.fine, 17, 2)
+    assert planner.plan(start, goal) == gui.GridPlanner.plan(planner.fine, start, goal)
+
+
+def test_hierarchical_planner_walks_round_a_wall_in_bounded_stages():
+    size, radius = 15000, 7
+    wall = (7000, 0, 30, 14000)
+    planner = gui.HierarchicalPlanner(size, size, 15, radius)
+    planner.set_obstacles([wall])
+    grid = gui.ObstacleGrid([wall])
+    position, goal = (100.0, 7000.0), (14000.0, 7000.0)
+    for _ in range(60):
+        began = time.perf_counter()
+        path = planner.plan(position, goal)
+        # Far under the seconds an exact search of the 1000x1000 grid takes
+        assert time.perf_counter() - began < 0.5
+        assert path
+        for point in path:
+            assert grid.segment_clear(position[0], position[1], point[0], point[1], radius)
+            position = point
+        if math.dist(position, goal) < planner.fine.cell_size:
+            break
+    assert math.dist(position, goal) < planner.fine.cell_size
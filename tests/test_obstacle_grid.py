@@ -0,0 +1,42 @@
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip('PyQt5.QtWidgets')
+
+# The GUI module's file name isn't importable as is
+_spec = importlib.util.spec_from_file_location(
+    'edubot_explorer_gui', os.path.join(os.path.dirname(__file__), '..', 'EduBot-ExplorerGUI.py'))
+gui = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gui)
+
+WALL = (100, 0, 10, 200)  # x, y, w, h
+
+
+@pytest.fixture
+def grid():
+    return gui.ObstacleGrid([WALL])
+
+
+def test_segment_through_obstacle_is_blocked(grid):
+    assert not grid.segment_clear(80, 100, 130, 100, radius=7)
+    assert grid.segment_clear(80, 100, 90, 100, radius=7)
+
+
+def test_start_in_margin_cannot_drive_through(grid):
+    # Centre 3 px left of the wall, inside its 7 px margin
+    assert not grid.segment_clear(97, 100, 101, 100, radius=7)
+    assert not grid.segment_clear(97, 100, 130, 100, radius=7)
+    # Along the wall doesn't get any further out
+    assert not grid.segment_clear(97, 100, 97, 104, radius=7)
+
+
+def test_start_in_margin_can_drive_out(grid):
+    assert grid.segment_clear(97, 100, 93, 100, radius=7)
+    assert grid.segment_clear(97, 100, 93, 96, radius=7)
+
+
+def test_start_inside_obstacle_only_leaves_by_the_nearest_side(grid):
+    assert grid.segment_clear(102, 100, 98, 100, radius=7)
+    assert not grid.segment_clear(102, 100, 106, 100, radius=7)
@@ -0,0 +1,77 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('PyQt5.QtWidgets')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import RobotServer as server
+
+# The GUI module's file name isn't importable as is
+_spec = importlib.util.spec_from_file_location(
+    'edubot_explorer_gui', os.path.join(os.path.dirname(__file__), '..', 'EduBot-ExplorerGUI.py'))
+gui = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(gui)
+
+# Values a float32 holds exactly, so both encodings decode to the same dict
+SENSOR_DATA = {
+    'distance': 42.5,
+    'raw_distance': 43.25,
+    'confidence': 0.87,
+    'sensors': [
+        {'name': 'front', 'angle': 0.0, 'distance': 42.5, 'raw_distance': 43.25, 'confidence': 0.87},
+        {'name': 'left', 'angle': -45.0, 'distance': 120.0, 'raw_distance': 118.5, 'confidence': 0.5},
+        {'name': 'right', 'angle': 45.0, 'distance': 400.0, 'raw_distance': 0.0, 'confidence': 0.0},
+    ],
+    'temperature': 21.5,
+    'battery': 87,
+    'timestamp': 1234.5678,
+    'status': 'active'
+}
+
+MESSAGES = [
+    {'type': 'sensor_data', 'data': SENSOR_DATA, 'timestamp': 1234.75},
+    {'type': 'command_response', 'command': 'get_sensors', 'status': 'success', 'timestamp': 1235.125,
+     'message': 'Sensor data retrieved', 'sensor_data': SENSOR_DATA, 'queue_depth': 2, 'queue_time': 1.5},
+    {'type': 'command_response', 'command': 'drive', 'status': 'error', 'timestamp': 1236.0,
+     'message': 'Motion queue full, move dropped', 'queue_depth': 0, 'queue_time': 0.0},
+]
+
+
+def payload_of(frame):
+    return frame[server.FRAME_HEADER.size:]
+
+
+@pytest.mark.parametrize('message', MESSAGES, ids=lambda message: message.get('command', message['type']))
+def test_binary_decodes_like_json(message):
+    frame = server.encode_message(message, server.BINARY_ENCODING)
+    payload = payload_of(frame)
+    assert payload[:1] != b'{', "message fell back to JSON"
+    expected = gui.decode_payload(payload_of(server.encode_message(message)))
+    assert gui.decode_payload(payload) == expected
+
+
+def test_both_sides_negotiate_the_same_encoding():
+    assert gui.BINARY_ENCODING == server.BINARY_ENCODING
+    assert gui.BINARY_COMMANDS == server.BINARY_COMMANDS
+    assert gui.STOP_COMMANDS == server.STOP_COMMANDS
+
+
+@pytest.mark.parametrize('decoder_class', [server.MessageDecoder, gui.MessageDecoder])
+def test_decoder_reassembles_split_and_merged_reads(decoder_class):
+    frames = [server.encode_message(message, encoding)
+              for message in MESSAGES for encoding in ('json', server.BINARY_ENCODING)]
+    stream = b''.join(frames)
+    expected = [payload_of(frame) for frame in frames]
+
+    # One byte at a time, then everything in one read, then reads that straddle frames
+    for chunk_size in (1, len(stream), 7, len(frames[0]) + 3):
+        decoder = decoder_class()
+        payloads = []
+        for start in range(0, len(stream), chunk_size):
+            payloads.extend(decoder.feed(stream[start:start + chunk_size]))
+        assert payloads == expected
+        assert not decoder.buffer
+
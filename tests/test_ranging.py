@@ -0,0 +1,25 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import RobotServer as server_module
+
+
+def test_missed_echo_is_one_timeout_reading():
+    gpio = server_module.SimulatedGPIO(seed=1)
+    gpio.DROPOUT = 1.0  # every echo is lost, the pin stays high until the sensor gives up
+    sensor = server_module.RangingSensor('front', 24, 25)
+    readings = []
+    record = sensor.record
+    sensor.record = lambda distance: (readings.append(distance), record(distance))
+
+    ranger = server_module.UltrasonicRanger(gpio, [sensor], rate=0)
+    ranger.start()
+    time.sleep(0.5)
+    ranger.stop()
+    time.sleep(0.1)  # edges of the last ping
+
+    assert len(readings) >= 3
+    assert set(readings) == {0.0}
+
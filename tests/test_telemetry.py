@@ -0,0 +1,54 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import RobotServer as server_module
+
+
+def reading(value):
+    return {'distance': float(value), 'timestamp': server_module.server_time(), 'status': 'active'}
+
+
+def test_slow_helper_keeps_segments_in_order(tmp_path, monkeypatch):
+    segment_class = server_module.TelemetrySegment
+
+    class SlowSegment(segment_class):
+        def __init__(self, path, capacity):
+            if threading.current_thread() is not threading.main_thread():
+                time.sleep(0.05)  # the helper falls behind
+            super().__init__(path, capacity)
+
+    monkeypatch.setattr(server_module, 'TelemetrySegment', SlowSegment)
+    prefix = str(tmp_path / 'run')
+    recorder = server_module.TelemetryRecorder(prefix, segment_records=4)
+    for value in range(40):
+        recorder.record_sensor(reading(value))
+        if value % 10 == 9:
+            time.sleep(0.1)  # let some prepared segments arrive
+    recorder.close()
+
+    distances = [record['data']['distance'] for record in server_module.read_telemetry(prefix)]
+    assert distances == [float(value) for value in range(40)]
+
+
+def test_disk_errors_never_reach_the_caller(tmp_path, monkeypatch):
+    prefix = str(tmp_path / 'run')
+    recorder = server_module.TelemetryRecorder(prefix, segment_records=4)
+    attempts = []
+
+    def fail(path, capacity):
+        attempts.append(path)
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr(server_module, 'TelemetrySegment', fail)
+    for value in range(20):
+        recorder.record_sensor(reading(value))
+    time.sleep(0.05)
+    recorder.close()
+
+    # The helper's prepare and at most one rollover, then nothing until the retry interval is up
+    assert len(attempts) <= 2
+    distances = [record['data']['distance'] for record in server_module.read_telemetry(prefix)]
+    assert distances == [0.0, 1.0, 2.0, 3.0]
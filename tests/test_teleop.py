@@ -0,0 +1,53 @@
+import json
+import os
+import socket
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import RobotServer as server_module
+
+
+@pytest.fixture
+def server():
+    robot = server_module.RealEduBot(edge_ranging=False, gpio=server_module.SimulatedGPIO())
+    server = server_module.RobotServer(robot=robot)
+    yield server
+    server.cleanup()
+
+
+@pytest.fixture
+def session(server):
+    client_socket, peer = socket.socketpair()
+    session = server_module.ClientSession(client_socket, ('127.0.0.1', 0))
+    session.udp_token = 'token'
+    server.sessions[client_socket] = session
+    server.udp_tokens['token'] = session
+    yield session
+    peer.close()
+
+
+def datagram(seq, direction='forward'):
+    message = {'token': 'token', 'seq': seq, 'command': 'move',
+               'data': {'direction': direction, 'distance': 200}}
+    return json.dumps(message).encode('utf-8')
+
+
+@pytest.mark.parametrize('command', server_module.STOP_COMMANDS)
+def test_datagram_sent_before_stop_is_stale(server, session, command):
+    server.process_message({'type': 'command', 'command': command, 'data': {'udp_seq': 1}},
+                           session.socket, session.address)
+    # Sent before the stop, delayed on the network
+    server.handle_datagram(datagram(1), ('127.0.0.1', 0))
+    assert server.robot.motion.backlog() == (0, 0.0)
+
+    server.handle_datagram(datagram(2), ('127.0.0.1', 0))
+    assert server.robot.motion.backlog()[0] == 1
+
+
+def test_stop_never_lowers_the_sequence(server, session):
+    server.handle_datagram(datagram(5), ('127.0.0.1', 0))
+    server.process_message({'type': 'command', 'command': 'stop', 'data': {'udp_seq': 3}},
+                           session.socket, session.address)
+    assert session.udp_seq == 5